@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Course, Module
+from .models import Course, GenerationJob, Module
 
 class ModuleInline(admin.TabularInline):
     model = Module
@@ -11,3 +11,9 @@ class CourseAdmin(admin.ModelAdmin):
     inlines = [ModuleInline]
 
 admin.site.register(Module)
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "attempts", "created_at", "finished_at")
+    list_filter = ("kind", "status")
@@ -0,0 +1,343 @@
+"""
+Допуск запросов к Ollama. Одновременно генерируется не больше OLLAMA_MAX_INFLIGHT
+ответов — иначе модель делит GPU/CPU на всех, и медленнее становятся все.
+Остальные ждут слота в очереди: интерактивные запросы (blueprint, урок по кнопке)
+впереди пакетной генерации уроков курса. Переполнение очереди — Overloaded (429),
+слишком долгое ожидание — тоже Overloaded (503); у обоих есть Retry-After.
+
+Одинаковые промпты, которые уже генерируются, не занимают новый слот: все ждут
+один вызов модели и получают его ответ (single-flight). Работает и из потоков,
+и из async view; очередь и in-flight общие.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+OLLAMA_MAX_INFLIGHT = int(os.getenv("OLLAMA_MAX_INFLIGHT", "2"))
+# сколько интерактивных запросов может ждать слот; пакетные ограничены числом воркеров
+OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "32"))
+# сколько интерактивный запрос ждёт слот, прежде чем получить 503; пакетные ждут сколько нужно
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "60"))
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class Overloaded(RuntimeError):
+    """Слот не получен: status — 429 (очередь полна) или 503 (не дождались)."""
+
+    def __init__(self, detail: str, status: int, retry_after: int):
+        super().__init__(detail)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted", "cancelled")
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+
+class _Flight:
+    """Один вызов модели и все, кто ждёт его ответа."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.admitted = (
+            threading.Event()
+        )  # ведущий получил слот — дальше ждать только генерацию
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.callbacks = []  # async-ожидающие: (loop, future)
+
+
+def _set_future(fut: "asyncio.Future", value=True):
+    if not fut.done():
+        fut.set_result(value)
+
+
+class AdmissionControl:
+    def __init__(
+        self,
+        max_inflight: int = OLLAMA_MAX_INFLIGHT,
+        max_queue: int = OLLAMA_MAX_QUEUE,
+        queue_timeout: float = OLLAMA_QUEUE_TIMEOUT,
+    ):
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._heap = []  # (priority, seq, _Waiter)
+        self._queued = {INTERACTIVE: 0, BATCH: 0}
+        self._seq = itertools.count()
+        self._flights = {}
+        # скользящее среднее времени генерации — для Retry-After
+        self._avg_s: Optional[float] = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.coalesced = 0
+
+    # ── слоты ────────────────────────────────────────────────────────────────
+    def _retry_after(self, ahead: int) -> int:
+        avg = self._avg_s if self._avg_s is not None else 10.0
+        return max(1, min(600, math.ceil(avg * (ahead + 1) / self.max_inflight)))
+
+    def _enter(self, priority: int, waiter: _Waiter) -> bool:
+        """Под self._lock: True — слот выдан сразу, False — waiter поставлен в очередь."""
+        # в куче могут лежать ушедшие ожидающие — считаем только живых
+        if self._inflight < self.max_inflight and not any(self._queued.values()):
+            self._inflight += 1
+            self.admitted += 1
+            return True
+        if priority == INTERACTIVE and self._queued[INTERACTIVE] >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(
+                "ollama_overloaded: generation queue is full",
+                429,
+                self._retry_after(sum(self._queued.values())),
+            )
+        self._queued[priority] += 1
+        heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+        return False
+
+    def _grant_next(self):
+        """Под self._lock: отдаёт свободные слоты первым живым ожидающим."""
+        while self._heap and self._inflight < self.max_inflight:
+            priority, _, waiter = heapq.heappop(self._heap)
+            if waiter.cancelled:
+                continue
+            self._queued[priority] -= 1
+            try:
+                waiter.wake()
+            except RuntimeError:
+                continue  # event loop ожидающего уже закрыт
+            waiter.granted = True
+            self._inflight += 1
+            self.admitted += 1
+
+    def _abandon(self, priority: int, waiter: _Waiter) -> bool:
+        """Под self._lock: ожидающий уходит; True — слот уже успели выдать, его надо вернуть."""
+        if waiter.granted:
+            return True
+        waiter.cancelled = True
+        self._queued[priority] -= 1
+        return False
+
+    def _timeout_for(self, priority: int) -> Optional[float]:
+        return self.queue_timeout if priority == INTERACTIVE else None
+
+    def _timed_out(self) -> Overloaded:
+        with self._lock:
+            self.timed_out += 1
+            ahead = sum(self._queued.values())
+        return Overloaded(
+            "ollama_overloaded: timed out waiting for a generation slot",
+            503,
+            self._retry_after(ahead),
+        )
+
+    def _release(self, started: Optional[float]):
+        with self._lock:
+            if started is not None:
+                elapsed = time.monotonic() - started
+                self._avg_s = (
+                    elapsed
+                    if self._avg_s is None
+                    else 0.8 * self._avg_s + 0.2 * elapsed
+                )
+            self._inflight -= 1
+            self._grant_next()
+
+    def acquire(self, priority: int = INTERACTIVE):
+        """
+        Ждёт слот в текущем потоке; возвращает release() (повторный вызов — no-op).
+        Для ответов, которые живут дольше одного блока with (стриминг).
+        """
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        with self._lock:
+            entered = self._enter(priority, waiter)
+        if not entered and not event.wait(self._timeout_for(priority)):
+            with self._lock:
+                entered = self._abandon(priority, waiter)
+            if not entered:
+                raise self._timed_out()
+        started = time.monotonic()
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self._release(started)
+
+        return release
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE):
+        release = self.acquire(priority)
+        try:
+            yield
+        finally:
+            release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = INTERACTIVE):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(_set_future, fut))
+        with self._lock:
+            entered = self._enter(priority, waiter)
+        if not entered:
+            try:
+                await asyncio.wait_for(fut, self._timeout_for(priority))
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                with self._lock:
+                    granted = self._abandon(priority, waiter)
+                if granted:
+                    self._release(None)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise self._timed_out() from None
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(started)
+
+    # ── single-flight ────────────────────────────────────────────────────────
+    def _join(self, key: str):
+        """Под self._lock: (flight, leader?)."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            return flight, True
+        flight.followers += 1
+        self.coalesced += 1
+        return flight, False
+
+    def _finish(
+        self,
+        key: str,
+        flight: _Flight,
+        result=None,
+        error: Optional[BaseException] = None,
+    ):
+        with self._lock:
+            self._flights.pop(key, None)
+            flight.result, flight.error = result, error
+            flight.done.set()
+            callbacks, flight.callbacks = flight.callbacks, []
+        for loop, fut in callbacks:
+            try:
+                loop.call_soon_threadsafe(_set_future, fut)
+            except RuntimeError:
+                pass  # loop ожидающего уже закрыт
+
+    def _fail(self, key: str, flight: _Flight, error: BaseException):
+        if not isinstance(error, Exception):
+            # отмена ведущего запроса (клиент ушёл) — для остальных это обычная ошибка
+            error = RuntimeError("generation was cancelled by the leading request")
+        self._finish(key, flight, error=error)
+
+    @staticmethod
+    def _outcome(flight: _Flight):
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def call(self, key: str, fn, priority: int = INTERACTIVE):
+        """fn() под слотом; одновременные вызовы с тем же key получают результат одного fn()."""
+        with self._lock:
+            flight, leader = self._join(key)
+        if not leader:
+            # пока ведущий сам в очереди, ждём не дольше, чем ждали бы слот
+            if (
+                not flight.done.wait(self._timeout_for(priority))
+                and not flight.admitted.is_set()
+            ):
+                raise self._timed_out()
+            flight.done.wait()
+            return self._outcome(flight)
+        try:
+            with self.slot(priority):
+                flight.admitted.set()
+                result = fn()
+        except BaseException as e:
+            self._fail(key, flight, e)
+            raise
+        self._finish(key, flight, result=result)
+        return result
+
+    async def acall(self, key: str, afn, priority: int = INTERACTIVE):
+        """Асинхронный call: afn — функция без аргументов, возвращающая корутину."""
+        with self._lock:
+            flight, leader = self._join(key)
+            if not leader and not flight.done.is_set():
+                loop = asyncio.get_running_loop()
+                fut = loop.create_future()
+                flight.callbacks.append((loop, fut))
+            else:
+                fut = None
+        if not leader:
+            if fut is not None:
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(fut), self._timeout_for(priority)
+                    )
+                except asyncio.TimeoutError:
+                    if not flight.admitted.is_set():
+                        raise self._timed_out() from None
+                    await asyncio.shield(fut)
+            return self._outcome(flight)
+        try:
+            async with self.aslot(priority):
+                flight.admitted.set()
+                result = await afn()
+        except BaseException as e:
+            self._fail(key, flight, e)
+            raise
+        self._finish(key, flight, result=result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_inflight": self.max_inflight,
+                "max_queue": self.max_queue,
+                "inflight": self._inflight,
+                "queued": {PRIORITY_NAMES[p]: n for p, n in self._queued.items()},
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "coalesced": self.coalesced,
+                "avg_generation_s": (
+                    round(self._avg_s, 3) if self._avg_s is not None else None
+                ),
+            }
+
+
+_admission: Optional[AdmissionControl] = None
+_admission_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionControl:
+    global _admission
+    if _admission is None:
+        with _admission_lock:
+            if _admission is None:
+                _admission = AdmissionControl()
+    return _admission
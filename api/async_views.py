@@ -0,0 +1,128 @@
+"""
+Асинхронные варианты генерации и поиска для запуска под ASGI (core/asgi.py).
+DRF не умеет async-view, поэтому это обычные Django-view с JsonResponse;
+вход и ответы — как у одноимённых эндпоинтов в views.py.
+"""
+
+import asyncio
+import json
+
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .admission import Overloaded
+from .generation import (
+    RAG_INDEX,
+    arun_generation,
+    blueprint_prompt,
+    finalize_blueprint,
+    finalize_lesson,
+    lesson_prompt,
+    search_index,
+)
+from .models import Course, Module
+from .rag import IndexFormatError
+
+
+def _overloaded(e: Overloaded) -> JsonResponse:
+    resp = JsonResponse({"detail": str(e)}, status=e.status)
+    resp["Retry-After"] = str(e.retry_after)
+    return resp
+
+
+def _json_body(request) -> dict:
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError as e:
+        raise ValueError("invalid JSON body") from e
+    if not isinstance(data, dict):
+        raise ValueError("JSON object expected")
+    return data
+
+
+@csrf_exempt
+@require_POST
+async def generate_blueprint(request):
+    """Как /api/generate/blueprint/."""
+    try:
+        data = _json_body(request)
+        prompt = blueprint_prompt(data)
+    except ValueError as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+
+    try:
+        result = await arun_generation(
+            prompt, finalize_blueprint, bypass_cache=bool(data.get("no_cache"))
+        )
+        return JsonResponse(result, status=200)
+    except Overloaded as e:
+        return _overloaded(e)
+    except Exception as e:
+        return JsonResponse(
+            {"detail": f"generation_error: {type(e).__name__}: {e}"}, status=500
+        )
+
+
+@csrf_exempt
+@require_POST
+async def generate_lesson(request):
+    """Как /api/generate/lesson/."""
+    try:
+        body = _json_body(request)
+        course_id = int(body.get("course_id") or 0)
+        module_order = int(body.get("module_order") or 1)
+        lesson_order = int(body.get("lesson_order") or 1)
+    except (ValueError, TypeError) as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+
+    course = await Course.objects.filter(id=course_id).afirst()
+    if course is None:
+        return JsonResponse({"detail": "Course not found"}, status=404)
+    module = await Module.objects.filter(course=course, order=module_order).afirst()
+    if module is None:
+        return JsonResponse({"detail": "Module not found"}, status=404)
+    # RAG-контекст читает индекс с диска — не в event loop
+    prompt = await asyncio.to_thread(lesson_prompt, course, module, lesson_order)
+
+    try:
+        result = await arun_generation(
+            prompt,
+            lambda raw: finalize_lesson(raw, course.topic),
+            bypass_cache=bool(body.get("no_cache")),
+        )
+        return JsonResponse(result, status=200)
+    except Overloaded as e:
+        return _overloaded(e)
+    except Exception as e:
+        return JsonResponse(
+            {"detail": f"generation_error: {type(e).__name__}: {e}"}, status=500
+        )
+
+
+@csrf_exempt
+@require_POST
+async def rag_search(request):
+    """Как /api/rag/search/; загрузка индекса и поиск — в пуле потоков."""
+    try:
+        payload = _json_body(request)
+        q = (payload.get("query") or "").strip()
+        top_k = int(payload.get("top_k") or 5)
+    except (ValueError, TypeError) as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+    if not q:
+        return JsonResponse({"detail": "query is required"}, status=400)
+
+    try:
+        idx = await asyncio.to_thread(RAG_INDEX.get)
+    except IndexFormatError as e:
+        return JsonResponse({"detail": f"RAG index is unreadable: {e}"}, status=400)
+    if idx is None:
+        return JsonResponse(
+            {"detail": "RAG index not found. Run ingest_rag first."}, status=400
+        )
+
+    results = await asyncio.to_thread(search_index, idx, q, top_k)
+    return JsonResponse(
+        {"results": [{"passage": p, "score": s} for p, s in results]}, status=200
+    )
@@ -0,0 +1,189 @@
+"""
+Упаковка RAG-контекста в промпт урока по бюджету токенов. Раньше в промпт шли
+5 лучших пассажей целиком, независимо от оценки и повторов, а время prefill
+в Ollama растёт с длиной промпта. Теперь:
+  1) пассажи с оценкой ниже RAG_MIN_SCORE_RATIO от лучшей отбрасываются;
+  2) почти-дубликаты (MinHash по шинглам из 3 слов) — тоже, остаётся лучший по рангу;
+  3) от пассажа остаются предложения, где есть слова запроса;
+  4) блоки добавляются по рангу, пока не кончится RAG_CONTEXT_TOKENS.
+"""
+
+import logging
+import os
+import re
+import threading
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .rag import tokenize
+
+logger = logging.getLogger(__name__)
+
+# сколько токенов промпта отдаём под RAG-контекст (num_ctx 8192 делят инструкции и ответ)
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "600"))
+# сколько пассажей достаём из индекса до упаковки
+RAG_CONTEXT_CANDIDATES = int(os.getenv("RAG_CONTEXT_CANDIDATES", "8"))
+RAG_MIN_SCORE_RATIO = float(os.getenv("RAG_MIN_SCORE_RATIO", "0.25"))
+# оценка Jaccard по MinHash, начиная с которой пассаж считается повтором
+RAG_DEDUP_JACCARD = float(os.getenv("RAG_DEDUP_JACCARD", "0.8"))
+# сколько пассажей брали раньше — для подсчёта сэкономленных токенов
+BASELINE_PASSAGES = 5
+
+_SENT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_NUM_PERM = 64
+_MASK = np.uint64(0xFFFFFFFF)
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, 1 << 32, size=_NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 1 << 32, size=_NUM_PERM, dtype=np.uint64)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка без токенизатора модели: ~4 байта UTF-8 на токен. Для BPE-словарей
+    Mistral/Llama это близко и для английского (~4 символа), и для русского (~2 символа).
+    """
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def minhash(text: str) -> np.ndarray:
+    """Подпись MinHash по шинглам из 3 слов: доля совпавших позиций ≈ Jaccard."""
+    words = tokenize(text)
+    shingles = {" ".join(words[i : i + 3]) for i in range(max(1, len(words) - 2))}
+    x = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # a*x + b по модулю 2**32 — разные хэш-функции на каждую позицию подписи
+    return ((_PERM_A[:, None] * x[None, :] + _PERM_B[:, None]) & _MASK).min(axis=1)
+
+
+def _split_head(passage: str) -> Tuple[str, str]:
+    # пассажи из индекса начинаются с "[file.md]\n" — источник оставляем при любой обрезке
+    if passage.startswith("["):
+        head, _, body = passage.partition("\n")
+        if head.endswith("]"):
+            return head, body
+    return "", passage
+
+
+def trim_passage(passage: str, q_tokens: Sequence[str], max_tokens: int) -> str:
+    """
+    Предложения пассажа со словами запроса, в исходном порядке и в пределах max_tokens.
+    Если слов запроса в пассаже нет (нашёлся плотным поиском) — предложения с начала.
+    """
+    head, body = _split_head(passage)
+    sentences = [s.strip() for s in _SENT_RE.split(body) if s.strip()]
+    query = set(q_tokens)
+    relevant = [s for s in sentences if query.intersection(tokenize(s))] or sentences
+    out = []
+    used = estimate_tokens(head) + 1 if head else 0
+    for s in relevant:
+        cost = estimate_tokens(s) + 1
+        if used + cost > max_tokens:
+            break
+        out.append(s)
+        used += cost
+    if not out:
+        return ""
+    return "\n".join(([head] if head else []) + out)
+
+
+def _block(passage: str, score: float) -> str:
+    return f"[CTX score={score:.2f}]\n{passage}"
+
+
+def pack_context(
+    results: List[Tuple[str, float]], query: str, budget: int = RAG_CONTEXT_TOKENS
+) -> Tuple[str, dict]:
+    """results — (пассаж, оценка) в порядке ранга. Возвращает (контекст, статистика упаковки)."""
+    baseline = "\n\n".join(_block(p, s) for p, s in results[:BASELINE_PASSAGES])
+    stats = {
+        "candidates": len(results),
+        "dropped_low_score": 0,
+        "dropped_duplicate": 0,
+        "trimmed": 0,
+        "passages": 0,
+        "tokens": 0,
+        "baseline_tokens": estimate_tokens(baseline) if baseline else 0,
+    }
+    best = max((s for _, s in results), default=0.0)
+    q_tokens = tokenize(query)
+    signatures: List[np.ndarray] = []
+    blocks = []
+    remaining = budget
+    for passage, score in results:
+        if score <= 0 or score < RAG_MIN_SCORE_RATIO * best:
+            stats["dropped_low_score"] += 1
+            continue
+        sig = minhash(passage)
+        if any(
+            float(np.mean(sig == other)) >= RAG_DEDUP_JACCARD for other in signatures
+        ):
+            stats["dropped_duplicate"] += 1
+            continue
+        signatures.append(sig)
+        overhead = estimate_tokens(_block("", score)) + 1
+        text = trim_passage(passage, q_tokens, remaining - overhead)
+        if not text:
+            continue
+        if text != passage:
+            stats["trimmed"] += 1
+        block = _block(text, score)
+        blocks.append(block)
+        remaining -= estimate_tokens(block) + 1
+    context = "\n\n".join(blocks)
+    stats["passages"] = len(blocks)
+    stats["tokens"] = estimate_tokens(context) if context else 0
+    stats["saved_tokens"] = stats["baseline_tokens"] - stats["tokens"]
+    _totals.add(stats)
+    logger.info(
+        "rag context: %d/%d passages, %d tokens (top-%d raw: %d, saved %d)",
+        stats["passages"],
+        stats["candidates"],
+        stats["tokens"],
+        BASELINE_PASSAGES,
+        stats["baseline_tokens"],
+        stats["saved_tokens"],
+    )
+    return context, stats
+
+
+class _Totals:
+    """Накопленная по процессу статистика упаковки — для /api/rag/status/."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.saved_tokens = 0
+        self.last: Optional[dict] = None
+
+    def add(self, stats: dict):
+        with self._lock:
+            self.requests += 1
+            self.tokens += stats["tokens"]
+            self.saved_tokens += stats["saved_tokens"]
+            self.last = stats
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "budget_tokens": RAG_CONTEXT_TOKENS,
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "saved_tokens": self.saved_tokens,
+                "avg_saved_tokens": (
+                    self.saved_tokens / self.requests if self.requests else None
+                ),
+                "last": self.last,
+            }
+
+
+_totals = _Totals()
+
+
+def context_stats() -> dict:
+    return _totals.stats()
@@ -0,0 +1,197 @@
+"""
+Рендер урока в файлы, сжатие и кэш сжатых фрагментов. Модуль не импортирует Django:
+его функции выполняются и в процессах пула экспорта (EXPORT_POOL=process), а при
+spawn/forkserver дочерний процесс Django не настраивает. На вход — только title и
+content_json урока, всё остальное передаётся явно.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .fileutil import publish_tmp
+
+# меняется при изменении раскладки архива — старые кэши перестают совпадать
+EXPORT_FORMAT = 2
+# 1–9 как в zlib: 1 быстрее, 9 плотнее
+EXPORT_COMPRESS_LEVEL = int(os.getenv("EXPORT_COMPRESS_LEVEL", "6"))
+
+
+def lesson_to_files(title: str, content: Optional[dict]) -> Dict[str, bytes]:
+    """
+    Преобразует content_json урока в набор файлов:
+    - markdown урока
+    - code_examples/*
+    - exercise/starter/*, exercise/tests/*
+    """
+    data: Dict[str, Any] = content or {}
+    title = data.get("title") or title
+    theory_md = data.get("theory_md") or ""
+    code_examples = data.get("code_examples") or []
+    exercise = data.get("exercise") or {}
+    ex_starter = exercise.get("starter_files") or []
+    ex_tests = exercise.get("tests") or []
+
+    files: Dict[str, bytes] = {}
+
+    # Основной md
+    md = [f"# {title}", "", theory_md, ""]
+    # Вставим кратко цели
+    objs = data.get("objectives") or []
+    if objs:
+        md.append("## Objectives")
+        md.extend([f"- {o}" for o in objs])
+        md.append("")
+    # Вставим квиз (как текст)
+    quiz = data.get("quiz") or []
+    if quiz:
+        md.append("## Quiz")
+        for i, q in enumerate(quiz, 1):
+            md.append(f"{i}. {q.get('question','')}")
+            opts = q.get("options") or []
+            if opts:
+                for j, op in enumerate(opts, 1):
+                    md.append(f"   {j}) {op}")
+        md.append("")
+    lesson_md = "\n".join(md).strip() + "\n"
+    files["lesson.md"] = lesson_md.encode("utf-8")
+
+    # code_examples
+    for f in code_examples:
+        name = f.get("filename") or "example.py"
+        cnt = f.get("content") or ""
+        files[f"code_examples/{name}"] = cnt.encode("utf-8")
+
+    # exercise
+    for f in ex_starter:
+        name = f.get("filename") or "main.py"
+        cnt = f.get("content") or ""
+        files[f"exercise/starter/{name}"] = cnt.encode("utf-8")
+    for f in ex_tests:
+        name = f.get("filename") or "test_basic.py"
+        cnt = f.get("content") or ""
+        files[f"exercise/tests/{name}"] = cnt.encode("utf-8")
+
+    return files
+
+
+# (имя, crc32, исходный размер, dos time, dos date, deflate-данные)
+Entry = Tuple[str, int, int, int, int, bytes]
+
+
+def _dos_datetime(ts: float) -> Tuple[int, int]:
+    t = time.localtime(ts)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = (max(t.tm_year, 1980) - 1980) << 9 | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def compress_files(
+    files: Dict[str, bytes],
+    mtime: Optional[float] = None,
+    level: int = EXPORT_COMPRESS_LEVEL,
+) -> List[Entry]:
+    """Сжимает файлы в записи для _ZipWriter (raw deflate, как ZIP_DEFLATED в zipfile)."""
+    dos_time, dos_date = _dos_datetime(time.time() if mtime is None else mtime)
+    out = []
+    for name, data in files.items():
+        c = zlib.compressobj(level, zlib.DEFLATED, -15)
+        out.append(
+            (
+                name,
+                zlib.crc32(data),
+                len(data),
+                dos_time,
+                dos_date,
+                c.compress(data) + c.flush(),
+            )
+        )
+    return out
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Кэш фрагментов уроков
+# ──────────────────────────────────────────────────────────────────────────────
+def fragment_key(title: str, content: Optional[dict], level: int) -> str:
+    raw = json.dumps(
+        [EXPORT_FORMAT, level, title, content], ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def fragment_path(cache_dir: Path, key: str) -> Path:
+    return Path(cache_dir) / "fragments" / key[:2] / f"{key}.frag"
+
+
+def write_atomic(path: Path, chunks) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        publish_tmp(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _save_fragment(path: Path, entries: List[Entry]) -> None:
+    # [u32 длина заголовка][JSON заголовок][deflate-данные подряд]
+    header = json.dumps(
+        [[n, crc, size, t, d, len(data)] for n, crc, size, t, d, data in entries]
+    ).encode("utf-8")
+    write_atomic(
+        path, [struct.pack("<I", len(header)), header] + [e[5] for e in entries]
+    )
+
+
+def _load_fragment(path: Path) -> Optional[List[Entry]]:
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    try:
+        (hlen,) = struct.unpack_from("<I", raw)
+        pos = 4 + hlen
+        entries = []
+        for n, crc, size, t, d, clen in json.loads(raw[4:pos]):
+            entries.append((n, crc, size, t, d, raw[pos : pos + clen]))
+            pos += clen
+        if pos != len(raw):
+            return None
+        return entries
+    except (struct.error, ValueError, TypeError):
+        return None  # битый файл — просто отрендерим урок заново
+
+
+def lesson_entries(
+    title: str,
+    content: Optional[dict],
+    cache_dir: Path,
+    level: int = EXPORT_COMPRESS_LEVEL,
+) -> List[Entry]:
+    """Сжатые файлы урока; при неизменном контенте берутся из кэша без рендера."""
+    path = fragment_path(cache_dir, fragment_key(title, content, level))
+    entries = _load_fragment(path)
+    if entries is None:
+        entries = compress_files(lesson_to_files(title, content), level=level)
+        try:
+            _save_fragment(path, entries)
+        except OSError:
+            pass  # кэш — не обязательная часть экспорта
+    return entries
+
+
+def lesson_entries_task(args) -> List[Entry]:
+    """Задача для пула: (title, content_json, cache_dir, level) — только простые типы."""
+    title, content, cache_dir, level = args
+    return lesson_entries(title, content, Path(cache_dir), level)
@@ -1,77 +1,146 @@
 from __future__ import annotations
 
-import io
+import hashlib
 import json
-import re
-import zipfile
-from typing import Dict, Any
+import multiprocessing
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from django.db.models import Prefetch
 from django.utils.text import slugify
+from .export_render import (
+    EXPORT_COMPRESS_LEVEL, EXPORT_FORMAT, Entry, compress_files, fragment_key, lesson_entries_task,
+)
+from .fileutil import publish_tmp
 from .models import Course, Module, Lesson
 
+# готовые архивы и сжатые файлы уроков; можно удалить целиком — пересоберутся
+EXPORT_CACHE_DIR = Path(os.getenv("EXPORT_CACHE_DIR", "export_cache"))
+# рендер и сжатие уроков в пуле; 1 — последовательно в потоке запроса
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "1"))
+EXPORT_POOL = os.getenv("EXPORT_POOL", "thread")  # thread | process
+# сколько уроков с content_json читается из БД за раз при экспорте
+EXPORT_LESSON_CHUNK = int(os.getenv("EXPORT_LESSON_CHUNK", "50"))
+# как стартуют процессы пула: spawn | forkserver | fork (fork опасен рядом с потоками и соединениями БД)
+EXPORT_POOL_START = os.getenv("EXPORT_POOL_START", "spawn")
+
 def _safe_slug(s: str) -> str:
     s = slugify(s or "item")
     return s or "item"
 
-def _lesson_to_files(lesson: Lesson) -> Dict[str, bytes]:
+# ──────────────────────────────────────────────────────────────────────────────
+# ZIP из заранее сжатых записей
+# ──────────────────────────────────────────────────────────────────────────────
+# zipfile не умеет дописывать уже сжатые данные, а нам нужно склеивать архив из
+# кэшированных фрагментов уроков — поэтому заголовки пишем сами (формат PKZIP 2.0).
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+
+class _ZipWriter:
+    """Пишет архив последовательно: entry() → байты записи, finish() → центральный каталог."""
+
+    def __init__(self):
+        self.offset = 0
+        self._central = []
+
+    def entry(self, name: str, entry: Entry) -> bytes:
+        _, crc, size, dos_time, dos_date, data = entry
+        raw_name = name.encode("utf-8")
+        flags = 0 if raw_name.isascii() else 0x800  # бит 11: имя в UTF-8
+        if self.offset > 0xFFFFFFFF or len(self._central) >= 0xFFFF:
+            raise ValueError("archive too large for ZIP without zip64")
+        self._central.append(_CENTRAL_HEADER.pack(
+            b"PK\x01\x02", 20, 3, 20, 0, flags, zlib.DEFLATED, dos_time, dos_date,
+            crc, len(data), size, len(raw_name), 0, 0, 0, 0, 0o644 << 16, self.offset,
+        ) + raw_name)
+        header = _LOCAL_HEADER.pack(
+            b"PK\x03\x04", 20, 0, flags, zlib.DEFLATED, dos_time, dos_date,
+            crc, len(data), size, len(raw_name), 0,
+        )
+        self.offset += len(header) + len(raw_name) + len(data)
+        return header + raw_name + data
+
+    def finish(self) -> bytes:
+        central = b"".join(self._central)
+        end = _END_RECORD.pack(b"PK\x05\x06", 0, 0, len(self._central), len(self._central),
+                               len(central), self.offset, 0)
+        return central + end
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Экспорт курса
+# ──────────────────────────────────────────────────────────────────────────────
+def _ordered_map(fn, items, workers: int, pool: str) -> Iterator:
     """
-    Преобразует Lesson.content_json в набор файлов:
-    - markdown урока
-    - code_examples/*
-    - exercise/starter/*, exercise/tests/*
+    map() в пуле с результатами в исходном порядке; вперёд считается не больше
+    2*workers элементов, чтобы память не росла с размером курса.
     """
-    data: Dict[str, Any] = lesson.content_json or {}
-    title = data.get("title") or lesson.title
-    theory_md = data.get("theory_md") or ""
-    code_examples = data.get("code_examples") or []
-    exercise = data.get("exercise") or {}
-    ex_starter = exercise.get("starter_files") or []
-    ex_tests = exercise.get("tests") or []
-
-    files: Dict[str, bytes] = {}
-
-    # Основной md
-    md = [f"# {title}", "", theory_md, ""]
-    # Вставим кратко цели
-    objs = data.get("objectives") or []
-    if objs:
-        md.append("## Objectives")
-        md.extend([f"- {o}" for o in objs])
-        md.append("")
-    # Вставим квиз (как текст)
-    quiz = data.get("quiz") or []
-    if quiz:
-        md.append("## Quiz")
-        for i, q in enumerate(quiz, 1):
-            md.append(f"{i}. {q.get('question','')}")
-            opts = q.get("options") or []
-            if opts:
-                for j, op in enumerate(opts, 1):
-                    md.append(f"   {j}) {op}")
-        md.append("")
-    lesson_md = "\n".join(md).strip() + "\n"
-    files["lesson.md"] = lesson_md.encode("utf-8")
-
-    # code_examples
-    for f in code_examples:
-        name = f.get("filename") or "example.py"
-        cnt = f.get("content") or ""
-        files[f"code_examples/{name}"] = cnt.encode("utf-8")
-
-    # exercise
-    for f in ex_starter:
-        name = f.get("filename") or "main.py"
-        cnt = f.get("content") or ""
-        files[f"exercise/starter/{name}"] = cnt.encode("utf-8")
-    for f in ex_tests:
-        name = f.get("filename") or "test_basic.py"
-        cnt = f.get("content") or ""
-        files[f"exercise/tests/{name}"] = cnt.encode("utf-8")
-
-    return files
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+    if pool == "process":
+        # задачи — только простые типы, а fn из export_render: дочернему процессу не нужен Django
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context(EXPORT_POOL_START))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    window = deque()
+    with executor:
+        for item in items:
+            window.append(executor.submit(fn, item))
+            if len(window) >= 2 * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
 
-def export_course_zip(course_id: int) -> bytes:
-    course = Course.objects.get(id=course_id)
 
+def iter_course_zip(course_id: int, workers: Optional[int] = None, pool: Optional[str] = None,
+                    level: Optional[int] = None) -> Iterator[bytes]:
+    """
+    ZIP курса кусками: после каждого урока отдаётся то, что уже записано в архив,
+    так что в памяти одновременно только несколько уроков, а не весь архив.
+    Уроки рендерятся и сжимаются в пуле из workers потоков/процессов, порядок
+    записей в архиве от этого не зависит.
+    Course.DoesNotExist бросается сразу, до первого куска.
+    """
+    course = _export_queryset().get(id=course_id)
+    return _course_zip_chunks(
+        course,
+        workers=EXPORT_WORKERS if workers is None else workers,
+        pool=pool or EXPORT_POOL,
+        level=EXPORT_COMPRESS_LEVEL if level is None else level,
+    )
+
+
+def _export_queryset():
+    """
+    Курс с модулями и уроками за три запроса, независимо от размера курса.
+    content_json здесь не читается — для манифеста хватает заголовков, а контент
+    потом идёт одним потоковым запросом (_lesson_contents).
+    """
+    lessons = Prefetch("lesson_set", queryset=Lesson.objects.order_by("order").defer("content_json"))
+    modules = Prefetch("modules", queryset=Module.objects.order_by("order").prefetch_related(lessons))
+    return Course.objects.prefetch_related(modules)
+
+
+def _lesson_contents(lesson_ids: List[int]) -> Iterator[tuple]:
+    """(id, content_json) этих уроков в порядке архива; в памяти не больше EXPORT_LESSON_CHUNK."""
+    return (
+        Lesson.objects.filter(id__in=lesson_ids)
+        .order_by("module__order", "order")
+        .values_list("id", "content_json")
+        .iterator(chunk_size=EXPORT_LESSON_CHUNK)
+    )
+
+
+def _course_zip_chunks(course: Course, workers: int, pool: str, level: int) -> Iterator[bytes]:
     manifest = {
         "id": course.id,
         "topic": course.topic,
@@ -85,36 +154,146 @@ def export_course_zip(course_id: int) -> bytes:
         "version": 1,
     }
 
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
-        # Модули
-        for m in course.modules.all().order_by("order"):
-            mslug = f"{m.order:02d}_{_safe_slug(m.title)}"
-            manifest["modules"].append({
-                "order": m.order,
-                "title": m.title,
-                "objectives": m.objectives_json,
-                "lessons": [],
-                "quiz_items": m.quiz_items,
-                "project": m.project,
-                "path": f"modules/{mslug}/"
+    lessons = []  # (путь в архиве, урок) в порядке архива
+    # Модули; .all() без order_by — иначе Django выбросит prefetch и пойдёт в БД заново
+    for m in course.modules.all():
+        mslug = f"{m.order:02d}_{_safe_slug(m.title)}"
+        manifest["modules"].append({
+            "order": m.order,
+            "title": m.title,
+            "objectives": m.objectives_json,
+            "lessons": [],
+            "quiz_items": m.quiz_items,
+            "project": m.project,
+            "path": f"modules/{mslug}/"
+        })
+
+        # Уроки
+        for l in m.lesson_set.all():
+            lslug = f"lesson_{l.order:02d}_{_safe_slug(l.title)}"
+            subpath = f"modules/{mslug}/{lslug}/"
+            lessons.append((subpath, l))
+            manifest["modules"][-1]["lessons"].append({
+                "order": l.order,
+                "title": l.title,
+                "path": subpath
             })
 
-            # Уроки
-            for l in m.lesson_set.all().order_by("order"):
-                lslug = f"lesson_{l.order:02d}_{_safe_slug(l.title)}"
-                subpath = f"modules/{mslug}/{lslug}/"
-                # добавим файлы урока
-                files = _lesson_to_files(l)
-                for rel, content in files.items():
-                    z.writestr(subpath + rel, content)
-                manifest["modules"][-1]["lessons"].append({
-                    "order": l.order,
-                    "title": l.title,
-                    "path": subpath
-                })
-
-        # manifest
-        z.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
-
-    return buf.getvalue()
+    def tasks():
+        # уроки сверяем по id: между запросами курс могли править. Новые уроки в этот
+        # экспорт не попадают, удалённые остаются в манифесте с пустым содержимым
+        contents = _lesson_contents([l.id for _, l in lessons])
+        ahead = {}  # строки, пришедшие раньше своей очереди (урок переставили)
+        for _, l in lessons:
+            while l.id not in ahead:
+                lesson_id, content = next(contents, (None, None))
+                if lesson_id is None:
+                    break
+                ahead[lesson_id] = content
+            yield l.title, ahead.pop(l.id, None), str(EXPORT_CACHE_DIR), level
+
+    zw = _ZipWriter()
+    for (subpath, _), entries in zip(lessons, _ordered_map(lesson_entries_task, tasks(), workers, pool), strict=True):
+        yield b"".join(zw.entry(subpath + e[0], e) for e in entries)
+
+    # manifest и центральный каталог
+    body = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+    (entry,) = compress_files({"manifest.json": body}, level=level)
+    yield zw.entry("manifest.json", entry) + zw.finish()
+
+
+def export_course_zip(course_id: int) -> bytes:
+    """Архив целиком в памяти — для мест, где нужен bytes (тесты, фоновые задачи)."""
+    return b"".join(iter_course_zip(course_id))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Кэш готовых архивов
+# ──────────────────────────────────────────────────────────────────────────────
+def course_etag(course: Course, level: Optional[int] = None) -> str:
+    """
+    Меняется вместе с Course.content_version и уровнем сжатия (архив с другим level —
+    другие байты); created_at — на случай переиспользования id.
+    """
+    level = EXPORT_COMPRESS_LEVEL if level is None else level
+    raw = f"{EXPORT_FORMAT}:{level}:{course.id}:{course.created_at.isoformat()}:{course.content_version}"
+    return hashlib.sha256(raw.encode("ascii")).hexdigest()[:24]
+
+
+def archive_path(course_id: int, etag: str) -> Path:
+    return EXPORT_CACHE_DIR / "courses" / f"course_{course_id}_{etag}.zip"
+
+
+def cached_course_zip(course_id: int, path: Path) -> Iterator[bytes]:
+    """
+    Отдаёт архив и попутно пишет его в path; файл появляется только после
+    полной записи (обрыв клиента кэш не портит), старые версии курса удаляются.
+    """
+    chunks = iter_course_zip(course_id)
+    return _tee_to_cache(chunks, path, course_id)
+
+
+def _tee_to_cache(chunks: Iterator[bytes], path: Path, course_id: int) -> Iterator[bytes]:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    except OSError:
+        yield from chunks  # кэш недоступен — просто отдаём архив
+        return
+    done = False
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        publish_tmp(tmp, path)
+        done = True
+    finally:
+        if not done:
+            os.unlink(tmp)
+    for old in path.parent.glob(f"course_{course_id}_*.zip"):
+        if old != path:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+
+def prune_cache(level: int = EXPORT_COMPRESS_LEVEL, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Удаляет из EXPORT_CACHE_DIR то, что экспорт уже не прочитает: фрагменты уроков,
+    которых в БД в таком виде больше нет (правка урока оставляет старый фрагмент),
+    архивы удалённых курсов и старых версий, брошенные .tmp старше часа.
+    Урок, изменённый во время обхода, просто отрендерится заново.
+    """
+    live = {
+        fragment_key(lesson.title, lesson.content_json, level)
+        for lesson in Lesson.objects.only("title", "content_json").iterator(chunk_size=500)
+    }
+    archives = {
+        archive_path(c.id, course_etag(c, level)).name
+        for c in Course.objects.only("id", "created_at", "content_version").iterator(chunk_size=2000)
+    }
+    stats = {"fragments": 0, "archives": 0, "tmp": 0, "bytes": 0}
+    tmp_cutoff = time.time() - 3600
+    candidates = [
+        ("fragments", p, p.suffix == ".frag" and p.stem not in live)
+        for p in (EXPORT_CACHE_DIR / "fragments").glob("*/*")
+    ] + [
+        ("archives", p, p.suffix == ".zip" and p.name not in archives)
+        for p in (EXPORT_CACHE_DIR / "courses").glob("*")
+    ]
+    for kind, path, stale in candidates:
+        try:
+            st = path.stat()
+            if path.suffix == ".tmp":
+                kind, stale = "tmp", st.st_mtime < tmp_cutoff
+            if not stale:
+                continue
+            if not dry_run:
+                path.unlink()
+        except OSError:
+            continue  # файл уже удалил другой процесс
+        stats[kind] += 1
+        stats["bytes"] += st.st_size
+    return stats
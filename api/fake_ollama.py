@@ -0,0 +1,177 @@
+"""
+Минимальный локальный сервер с HTTP API Ollama — для тестов и бенчмарков,
+чтобы не требовался запущенный Ollama с моделью.
+"""
+
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[A-Za-zА-Яа-я0-9_]+")
+
+
+def fake_embedding(text: str, dim: int = 64) -> list:
+    """
+    Детерминированный "эмбеддинг": хэши символьных триграмм слов со знаком.
+    Формы одного слова (loop/loops/looping) получают близкие векторы — грубая
+    замена настоящей модели, достаточная для проверки плотного поиска.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in _WORD_RE.findall(text.lower()):
+        word = f"#{word}#"
+        for i in range(len(word) - 2):
+            h = zlib.crc32(word[i : i + 3].encode("utf-8"))
+            vec[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = float(np.linalg.norm(vec))
+    return (vec / norm if norm else vec).tolist()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего Ollama
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.fake.lock:
+            self.server.fake.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_generate(self, payload: dict):
+        # NDJSON через chunked, по куску ответа на строку — как Ollama со "stream": true
+        fake = self.server.fake
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        text = fake.response
+        pieces = [
+            text[i : i + fake.chunk_size] for i in range(0, len(text), fake.chunk_size)
+        ]
+        for piece in pieces:
+            self._write_chunk(
+                {"model": payload.get("model"), "response": piece, "done": False}
+            )
+            if fake.token_delay:
+                time.sleep(fake.token_delay)
+        self._write_chunk({"model": payload.get("model"), "response": "", "done": True})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, obj: dict):
+        line = json.dumps(obj).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        with fake.lock:
+            fake.requests.append((self.path, payload))
+            n = len(fake.requests)
+        if fake.delay:
+            time.sleep(fake.delay)
+        if n <= fake.fail_first:
+            self._send_json(fake.fail_status, {"error": "fake failure"})
+            return
+        if self.path == "/api/generate" and payload.get("stream"):
+            self._stream_generate(payload)
+        elif self.path == "/api/generate":
+            self._send_json(
+                200,
+                {
+                    "model": payload.get("model"),
+                    "response": fake.response,
+                    "done": True,
+                },
+            )
+        elif self.path == "/api/embed":
+            texts = payload.get("input") or []
+            texts = [texts] if isinstance(texts, str) else texts
+            embeddings = [fake_embedding(t, fake.embed_dim) for t in texts]
+            self._send_json(
+                200, {"model": payload.get("model"), "embeddings": embeddings}
+            )
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+
+class _Server(ThreadingHTTPServer):
+    # по умолчанию backlog 5: при десятках одновременных подключений лишние ждут повтора SYN
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeOllama:
+    """
+    with FakeOllama(response='{"a": 1}') as fake:
+        OllamaClient(host=fake.url).generate("...")
+
+    fail_first — сколько первых запросов вернуть со статусом fail_status;
+    delay — задержка ответа в секундах (имитация генерации);
+    /api/embed отвечает fake_embedding размерности embed_dim;
+    в режиме stream ответ режется на куски по chunk_size символов с паузой token_delay.
+    """
+
+    def __init__(
+        self,
+        response: str = "{}",
+        delay: float = 0.0,
+        fail_first: int = 0,
+        fail_status: int = 503,
+        chunk_size: int = 8,
+        token_delay: float = 0.0,
+        embed_dim: int = 64,
+    ):
+        self.response = response
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.token_delay = token_delay
+        self.embed_dim = embed_dim
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,17 @@
+"""Мелочи для атомарной записи файлов; без Django — используется и в процессах пула экспорта."""
+
+import os
+
+# os.umask нельзя прочитать, не поменяв, — делаем это один раз при импорте, пока потоков нет
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def publish_tmp(tmp, path) -> None:
+    """
+    Подменяет path временным файлом из mkstemp. mkstemp создаёт файл с правами 0600 —
+    перед подменой выставляем обычные 0666 & ~umask, как у файла из open(), чтобы
+    индекс и кэш могли читать другие пользователи (веб-сервер, воркеры).
+    """
+    os.chmod(tmp, 0o666 & ~_UMASK)
+    os.replace(tmp, path)
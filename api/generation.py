@@ -0,0 +1,580 @@
+"""
+Сборка промптов, вызов модели и "авто-ремонт" ответов для генерации
+blueprint'ов и уроков. Используется и обычными, и потоковыми эндпоинтами.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Optional
+
+from pydantic import ValidationError
+
+from .admission import BATCH, INTERACTIVE, get_admission
+from .context_packer import RAG_CONTEXT_CANDIDATES, RAG_CONTEXT_TOKENS, pack_context
+from .llm_cache import cache_key, get_cache
+from .models import Lesson
+from .ollama_client import (
+    acall_ollama,
+    call_ollama,
+    embed_queries,
+    get_client,
+    parse_json_loose,
+)
+from .rag import SEARCH_CACHE, IndexCache, IndexFormatError
+from .schemas import CourseBlueprint, LessonContent
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ЖЕСТКИЕ ИНСТРУКЦИИ ДЛЯ МОДЕЛИ
+# ──────────────────────────────────────────────────────────────────────────────
+BLUEPRINT_INSTRUCTIONS = """
+You are Course Architect AI.
+
+Generate a STRICT JSON object for a programming course blueprint that matches EXACTLY this schema:
+
+{
+  "topic": string,
+  "level": "beginner" | "intermediate" | "advanced",
+  "duration_weeks": integer (1..52),
+  "prerequisites": string[],                    // 0..10
+  "learning_outcomes": string[],                // 5..12, measurable
+  "modules": [                                  // 3..20 modules
+    {
+      "title": string,
+      "objectives": string[],                   // 3..8 items, action verbs
+      "lessons": integer,                       // 2..8
+      "quiz_items": integer,                    // 5..15
+      "project": string | null
+    }
+  ],
+  "capstone": string,
+  "references": [                               // 2..12
+    {"title": string, "url": string, "license": "MIT" | "BSD" | "Apache-2.0" | "CC-BY" | "Docs"}
+  ]
+}
+
+HARD RULES (must always be satisfied):
+- Return JSON ONLY. No prose, no markdown.
+- learning_outcomes: at least 5 items (5..12).
+- modules: between 3 and 20 items.
+- For each module:
+  - objectives: 3..8 items (add realistic extra ones if needed).
+  - lessons: integer 2..8 (never above 8).
+  - quiz_items: integer 5..15 (never below 5).
+- Use official docs or permissive-licensed sources only (license 'Docs' for official docs).
+- If the user's duration_weeks is short, adjust scope so all numeric constraints still hold.
+"""
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ "АВТО-РЕМОНТА" JSON
+# ──────────────────────────────────────────────────────────────────────────────
+def clamp(n: int, lo: int, hi: int) -> int:
+    return max(lo, min(hi, int(n)))
+
+
+ACTION_VERBS = [
+    "Understand",
+    "Explain",
+    "Apply",
+    "Implement",
+    "Debug",
+    "Refactor",
+    "Test",
+    "Optimize",
+    "Use",
+    "Design",
+]
+
+
+def pad_objectives(obj_list, topic: str, need: int):
+    base = list(obj_list or [])
+    while len(base) < need:
+        base.append(f"Apply {topic} concepts in small tasks")
+    return base[:8]
+
+
+def pad_outcomes(lo_list, topic: str, min_len: int = 5):
+    base = list(lo_list or [])
+    verbs = iter(ACTION_VERBS)
+    while len(base) < min_len:
+        v = next(verbs, "Apply")
+        base.append(f"{v} {topic} to build small practical programs")
+    return base[:12]
+
+
+def ensure_references(refs, topic: str):
+    base = list(refs or [])
+    # добавим минимум официальных доков (валидные ссылки и license="Docs")
+    essentials = [
+        {
+            "title": "Python Official Docs",
+            "url": "https://docs.python.org/3/",
+            "license": "Docs",
+        },
+        {
+            "title": "pip User Guide",
+            "url": "https://pip.pypa.io/en/stable/",
+            "license": "Docs",
+        },
+    ]
+    # не дублируем существующие по url
+    have = {r.get("url") for r in base if isinstance(r, dict)}
+    for r in essentials:
+        if r["url"] not in have:
+            base.append(r)
+    return base[:12]
+
+
+def repair_blueprint_data(data: dict) -> dict:
+    """Подправляем поля до мин/макс ограничений схемы."""
+    topic = (data.get("topic") or "the topic").strip()
+
+    # learning_outcomes: 5..12
+    data["learning_outcomes"] = pad_outcomes(data.get("learning_outcomes"), topic, 5)
+
+    # modules: 3..20 (если меньше 3 — продублируем/упростим; если больше 20 — обрежем)
+    modules = list(data.get("modules") or [])
+    if len(modules) < 3 and modules:
+        while len(modules) < 3:
+            # добавляем упрощённую копию последнего модуля
+            clone = dict(modules[-1])
+            clone["title"] = f"{clone.get('title', 'Module')} (extended)"
+            modules.append(clone)
+    data["modules"] = modules[:20]
+
+    # правим каждый модуль
+    fixed_modules = []
+    for m in data["modules"]:
+        m = dict(m or {})
+        m["lessons"] = clamp(m.get("lessons", 4), 2, 8)
+        m["quiz_items"] = clamp(m.get("quiz_items", 8), 5, 15)
+        m["objectives"] = pad_objectives(m.get("objectives") or [], topic, 3)
+        fixed_modules.append(m)
+    data["modules"] = fixed_modules
+
+    # references: минимум 2
+    data["references"] = ensure_references(data.get("references"), topic)
+
+    # prerequisites: максимум 10; если None — в пустой список
+    prereq = data.get("prerequisites") or []
+    data["prerequisites"] = list(prereq)[:10]
+
+    # duration_weeks границы 1..52 (на всякий)
+    data["duration_weeks"] = clamp(data.get("duration_weeks", 4), 1, 52)
+
+    # level нормализуем
+    level = (data.get("level") or "beginner").lower()
+    if level not in {"beginner", "intermediate", "advanced"}:
+        level = "beginner"
+    data["level"] = level
+
+    return data
+
+
+LESSON_INSTR = """
+You are Course Lesson Writer AI.
+
+Return STRICT JSON ONLY matching this schema:
+{
+  "title": string,
+  "reading_time_min": integer (5..30),
+  "objectives": string[] (2..6 items, action verbs),
+  "theory_md": string,
+  "code_examples": [{"filename": string, "content": string}],
+  "quiz": [{"type":"mcq"|"short"|"code_output","question":string,"options":string[],"answer":string,"explain":string|null}] (3..15),
+  "exercise": {"task":string,"starter_files":[{"filename":string,"content":string}],"tests":[{"filename":string,"content":string}],"rubric":string[]},
+  "further_reading": [{"title":string,"url":string,"license":"MIT"|"BSD"|"Apache-2.0"|"CC-BY"|"Docs"}] (0..8)
+}
+
+HARD RULES:
+- JSON ONLY. No prose. No markdown fences.
+- All URLs in further_reading MUST be absolute http(s) links (e.g., https://docs.python.org/3/). DO NOT use relative links or markdown like [text](#anchor).
+- Code must be runnable and minimal. No nonexistent libs.
+- Respect the student's level and module objectives.
+"""
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# RAG-КОНТЕКСТ
+# ──────────────────────────────────────────────────────────────────────────────
+RAG_INDEX_PATH = Path("rag_index.bm25")
+# индекс грузится один раз на воркер и подменяется после ingest_rag
+RAG_INDEX = IndexCache(RAG_INDEX_PATH)
+# гибридный поиск, если индекс собран с эмбеддингами (ingest_rag --embed); 0 — только BM25
+RAG_DENSE = os.getenv("RAG_DENSE", "1") == "1"
+
+
+def search_index(idx, query: str, top_k: int = 5):
+    """
+    BM25 или BM25 + косинус по эмбеддингам (RRF). Вектор запроса считает та же модель,
+    что и пассажи; если Ollama недоступна — молча остаёмся на BM25.
+    """
+    return search_index_many(idx, [query], top_k)[0]
+
+
+def search_index_many(idx, queries: List[str], top_k: int = 5):
+    """
+    search_index для многих запросов. Сначала SEARCH_CACHE; промахи — одним вызовом
+    эмбеддера и BM25Index.rank_many. Ответ BM25 вместо гибрида (Ollama недоступна) не кэшируем.
+    """
+    dense = RAG_DENSE and idx.embeddings is not None
+    mode = f"hybrid:{idx.embed_model}" if dense else "bm25"
+    token_lists = [idx.analyzer.tokenize(q) for q in queries]
+    keys = [SEARCH_CACHE.key(idx, tokens, top_k, mode) for tokens in token_lists]
+    ranked = [SEARCH_CACHE.get(key) for key in keys]
+    missed = [i for i, r in enumerate(ranked) if r is None]
+    if missed:
+        query_vecs = (
+            embed_queries([queries[i] for i in missed], idx.embed_model)
+            if dense
+            else None
+        )
+        fresh = idx.rank_many([token_lists[i] for i in missed], top_k, query_vecs)
+        for i, r in zip(missed, fresh, strict=True):
+            ranked[i] = r
+            if query_vecs is not None or not dense:
+                SEARCH_CACHE.put(keys[i], r)
+    return [[(idx.passages[d], s) for d, s in r] for r in ranked]
+
+
+def build_rag_contexts(
+    queries: List[str],
+    k: int = RAG_CONTEXT_CANDIDATES,
+    budget: int = RAG_CONTEXT_TOKENS,
+) -> List[str]:
+    """Для каждого запроса — k лучших пассажей, упакованных в budget токенов (см. context_packer)."""
+    try:
+        idx = RAG_INDEX.get()
+    except IndexFormatError:
+        idx = None
+    if idx is None:
+        return ["" for _ in queries]
+    return [
+        pack_context(results, q, budget)[0]
+        for q, results in zip(queries, search_index_many(idx, queries, k), strict=True)
+    ]
+
+
+def build_rag_context(
+    query: str, k: int = RAG_CONTEXT_CANDIDATES, budget: int = RAG_CONTEXT_TOKENS
+) -> str:
+    try:
+        idx = RAG_INDEX.get()
+    except IndexFormatError:
+        return ""
+    if idx is None:
+        return ""
+    context, _ = pack_context(search_index(idx, query, top_k=k), query, budget)
+    return context
+
+
+def _is_http_url(s: str) -> bool:
+    return isinstance(s, str) and (s.startswith("http://") or s.startswith("https://"))
+
+
+def _sanitize_further_reading(items, topic: str):
+    allowed = {"MIT", "BSD", "Apache-2.0", "CC-BY", "Docs"}
+    out = []
+    for it in list(items or []):
+        t = (it or {}).get("title") or "Official Docs"
+        u = (it or {}).get("url") or ""
+        lic = (it or {}).get("license") or "Docs"
+        if not _is_http_url(u):
+            # Подставляем безопасный дефолт, чтобы пройти валидацию.
+            # Для Python-тем по умолчанию ведём на оф. доки.
+            u = "https://docs.python.org/3/"
+            lic = "Docs"
+        if lic not in allowed:
+            lic = "Docs"
+        out.append({"title": t, "url": u, "license": lic})
+    if not out:
+        out = [
+            {
+                "title": "Python Official Docs",
+                "url": "https://docs.python.org/3/",
+                "license": "Docs",
+            }
+        ]
+    return out[:8]
+
+
+def repair_lesson(data: dict, topic: str) -> dict:
+    data = dict(data or {})
+    data.setdefault("title", f"{topic}: Lesson")
+    data["reading_time_min"] = clamp(data.get("reading_time_min", 10), 5, 30)
+
+    objs = list(data.get("objectives") or [])
+    while len(objs) < 2:
+        objs.append(f"Apply {topic} basics in small tasks")
+    data["objectives"] = objs[:6]
+
+    quiz = list(data.get("quiz") or [])
+    while len(quiz) < 3:
+        quiz.append(
+            {
+                "type": "mcq",
+                "question": f"Basic concept of {topic}?",
+                "options": ["Option A", "Option B", "Option C"],
+                "answer": "Option A",
+                "explain": "A simple recall question.",
+            }
+        )
+    data["quiz"] = quiz[:15]
+
+    ex = dict(data.get("exercise") or {})
+    ex.setdefault("task", f"Write a small program related to {topic}.")
+    ex.setdefault("starter_files", [{"filename": "main.py", "content": "# TODO\n"}])
+    ex.setdefault(
+        "tests",
+        [
+            {
+                "filename": "test_basic.py",
+                "content": "def test_true():\n    assert True\n",
+            }
+        ],
+    )
+    ex.setdefault("rubric", ["Correctness", "Style", "Edge cases"])
+    data["exercise"] = ex
+
+    data["code_examples"] = list(data.get("code_examples") or [])[:10]
+    data["further_reading"] = _sanitize_further_reading(
+        data.get("further_reading"), topic
+    )
+
+    return data
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ПРОМПТЫ И ВАЛИДАЦИЯ ОТВЕТА
+# ──────────────────────────────────────────────────────────────────────────────
+def blueprint_prompt(data: dict) -> str:
+    """Промпт для blueprint по входу эндпоинта; ValueError, если нет topic."""
+    topic = (data.get("topic") or "").strip()
+    level = (data.get("level") or "beginner").strip().lower()
+    duration_weeks = int(data.get("duration_weeks") or 4)
+    goals = data.get("goals") or []
+
+    if not topic:
+        raise ValueError("topic is required")
+
+    goals_str = ""
+    if goals and isinstance(goals, list):
+        goals_str = "User goals:\n- " + "\n- ".join([str(g) for g in goals])
+
+    user_block = f"User input:\n- topic: {topic}\n- level: {level}\n- duration_weeks: {duration_weeks}\n{goals_str}"
+    return f"{BLUEPRINT_INSTRUCTIONS}\n\n{user_block}\n\nReturn JSON now."
+
+
+def finalize_blueprint(raw: str) -> dict:
+    """Разбирает ответ модели в валидный CourseBlueprint (с авто-ремонтом)."""
+    as_json = parse_json_loose(raw)
+    # пробуем строгую валидацию
+    try:
+        blueprint = CourseBlueprint(**as_json)
+    except ValidationError:
+        # авто-ремонт, затем повторная валидация
+        blueprint = CourseBlueprint(**repair_blueprint_data(as_json))
+    return blueprint.model_dump(mode="json")
+
+
+def module_rag_query(course, module) -> str:
+    # RAG-контекст под тему и модуль — у всех уроков модуля он общий
+    return f"{course.topic} {module.title} {' '.join(module.objectives_json)}"
+
+
+def lesson_prompt(
+    course, module, lesson_order: int, rag_ctx: Optional[str] = None
+) -> str:
+    """rag_ctx — уже собранный контекст модуля (пакетная генерация); None — искать здесь."""
+    if rag_ctx is None:
+        rag_ctx = build_rag_context(module_rag_query(course, module))
+
+    context = f"""
+Course topic: {course.topic}
+Level: {course.level}
+Module: {module.title}
+Module objectives:
+- """ + "\n- ".join(module.objectives_json)
+
+    if rag_ctx:
+        context += (
+            "\n\nRAG CONTEXT (authoritative excerpts, do not contradict):\n" + rag_ctx
+        )
+
+    return f"{LESSON_INSTR}\n\n{context}\n\nReturn JSON for lesson #{lesson_order}."
+
+
+def finalize_lesson(raw: str, topic: str) -> dict:
+    """Разбирает ответ модели в валидный LessonContent (с авто-ремонтом)."""
+    as_json = parse_json_loose(raw)
+    try:
+        lc = LessonContent(**as_json)
+    except ValidationError:
+        lc = LessonContent(**repair_lesson(as_json, topic))
+    return lc.model_dump(mode="json")
+
+
+def flight_key(prompt: str) -> str:
+    """Одинаковые промпты в полёте ждут один вызов модели — ключ как у кэша ответов."""
+    return cache_key(prompt, get_client().model, 0.2)
+
+
+def run_generation(
+    prompt: str, finalize, bypass_cache: bool = False, priority: int = INTERACTIVE
+) -> dict:
+    """
+    Ответ модели через кэш: при попадании Ollama не вызывается вовсе.
+    В кэш кладём только ответы, прошедшие finalize, чтобы не закэшировать мусор.
+    Вызов модели — через допуск (admission): может бросить Overloaded.
+    """
+    cache = get_cache()
+    raw = cache.get(prompt, bypass=bypass_cache)
+    if raw is not None:
+        try:
+            return finalize(raw)
+        except Exception:
+            pass  # запись из кэша больше не валидируется — генерируем заново
+    raw = get_admission().call(
+        flight_key(prompt), lambda: call_ollama(prompt), priority
+    )
+    result = finalize(raw)
+    cache.put(prompt, raw)
+    return result
+
+
+async def arun_generation(
+    prompt: str, finalize, bypass_cache: bool = False, priority: int = INTERACTIVE
+) -> dict:
+    """run_generation для async view: ждём Ollama без потока, кэш (может быть SQLite) — в пуле."""
+    cache = get_cache()
+    raw = await asyncio.to_thread(cache.get, prompt, bypass=bypass_cache)
+    if raw is not None:
+        try:
+            return finalize(raw)
+        except Exception:
+            pass
+    raw = await get_admission().acall(
+        flight_key(prompt), lambda: acall_ollama(prompt), priority
+    )
+    result = finalize(raw)
+    await asyncio.to_thread(cache.put, prompt, raw)
+    return result
+
+
+def generate_blueprint_data(
+    data: dict, bypass_cache: bool = False, priority: int = INTERACTIVE
+) -> dict:
+    return run_generation(
+        blueprint_prompt(data), finalize_blueprint, bypass_cache, priority
+    )
+
+
+def generate_lesson_data(
+    course,
+    module,
+    lesson_order: int,
+    bypass_cache: bool = False,
+    priority: int = INTERACTIVE,
+    rag_ctx: Optional[str] = None,
+) -> dict:
+    return run_generation(
+        lesson_prompt(course, module, lesson_order, rag_ctx),
+        lambda raw: finalize_lesson(raw, course.topic),
+        bypass_cache,
+        priority,
+    )
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ГЕНЕРАЦИЯ ВСЕХ УРОКОВ КУРСА
+# ──────────────────────────────────────────────────────────────────────────────
+# сколько уроков курса генерируется параллельно (запросов к Ollama одновременно)
+COURSE_GEN_CONCURRENCY = int(os.getenv("COURSE_GEN_CONCURRENCY", "2"))
+# верхняя граница concurrency, которую можно запросить через API
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "8"))
+
+
+def save_lesson_content(module, lesson_order: int, content: dict):
+    """Семантика /api/lessons/save: создать или перезаписать урок (module, order)."""
+    return Lesson.objects.update_or_create(
+        module=module,
+        order=lesson_order,
+        defaults={
+            "title": content["title"],
+            "content_json": content,
+        },
+    )
+
+
+def generate_course_lessons(
+    course,
+    concurrency: int = COURSE_GEN_CONCURRENCY,
+    bypass_cache: bool = False,
+    on_progress=None,
+) -> dict:
+    """
+    Генерирует все уроки курса по Module.lessons, не больше concurrency одновременно.
+    Уже сохранённые уроки пропускаются, так что прерванный прогон можно просто повторить.
+    on_progress(stats) вызывается после каждого урока; в БД пишет только вызывающий поток.
+    """
+    modules = list(course.modules.order_by("order"))
+    existing = set(
+        Lesson.objects.filter(module__course=course).values_list("module_id", "order")
+    )
+    planned = [(m, n) for m in modules for n in range(1, m.lessons + 1)]
+    todo = [(m, n) for m, n in planned if (m.id, n) not in existing]
+
+    stats = {
+        "total": len(planned),
+        "skipped": len(planned) - len(todo),
+        "generated": 0,
+        "failed": 0,
+        "errors": [],
+        "elapsed_s": 0.0,
+        "lessons_per_min": None,
+    }
+    if on_progress:
+        on_progress(dict(stats))
+    started = time.perf_counter()
+    # RAG-контекст нужен по одному на модуль — все запросы к индексу одной пачкой
+    pending = list({m.id: m for m, _ in todo}.values())
+    contexts = dict(
+        zip(
+            (m.id for m in pending),
+            build_rag_contexts([module_rag_query(course, m) for m in pending]),
+            strict=True,
+        )
+    )
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(
+                generate_lesson_data, course, m, n, bypass_cache, BATCH, contexts[m.id]
+            ): (m, n)
+            for m, n in todo
+        }
+        for fut in as_completed(futures):
+            m, n = futures[fut]
+            try:
+                save_lesson_content(m, n, fut.result())
+                stats["generated"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                if len(stats["errors"]) < 20:
+                    stats["errors"].append(
+                        {
+                            "module_order": m.order,
+                            "lesson_order": n,
+                            "detail": f"generation_error: {type(e).__name__}: {e}",
+                        }
+                    )
+            elapsed = time.perf_counter() - started
+            stats["elapsed_s"] = round(elapsed, 3)
+            stats["lessons_per_min"] = (
+                round(stats["generated"] * 60 / elapsed, 2) if elapsed else None
+            )
+            if on_progress:
+                on_progress(dict(stats))
+    return stats
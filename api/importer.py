@@ -0,0 +1,211 @@
+"""
+Массовая запись курсов и уроков: валидация пачками и bulk_create — несколько
+INSERT на пачку вместо запроса на каждый модуль/урок.
+"""
+
+import os
+import time
+from typing import Iterable, List
+
+from django.db import transaction
+from pydantic import ValidationError
+
+from .models import Course, Lesson, Module
+from .schemas import CourseBlueprint, LessonContent
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "100"))
+# сколько ошибок валидации возвращать в сводке
+IMPORT_MAX_ERRORS = 50
+
+
+def _course_from_blueprint(bp: CourseBlueprint, owner=None) -> Course:
+    return Course(
+        owner=owner,
+        topic=bp.topic,
+        level=bp.level,
+        duration_weeks=bp.duration_weeks,
+        prerequisites_json=bp.prerequisites,
+        learning_outcomes_json=bp.learning_outcomes,
+        capstone=bp.capstone,
+        references_json=[r.model_dump(mode="json") for r in bp.references],
+    )
+
+
+def _modules_for(course: Course, bp: CourseBlueprint) -> List[Module]:
+    return [
+        Module(
+            course=course,
+            order=idx,
+            title=m.title,
+            objectives_json=m.objectives,
+            lessons=m.lessons,
+            quiz_items=m.quiz_items,
+            project=m.project,
+        )
+        for idx, m in enumerate(bp.modules, start=1)
+    ]
+
+
+def _lesson_row(lc: LessonContent, **fields) -> Lesson:
+    # bulk_create не вызывает Lesson.save(), выжимку заполняем сами
+    content = lc.model_dump(mode="json")
+    return Lesson(
+        title=lc.title, content_json=content, **fields, **Lesson.summary_from(content)
+    )
+
+
+def create_course(bp: CourseBlueprint, owner=None) -> Course:
+    """Курс и все модули: два INSERT независимо от числа модулей."""
+    with transaction.atomic():
+        course = _course_from_blueprint(bp, owner)
+        course.save()
+        Module.objects.bulk_create(_modules_for(course, bp))
+    return course
+
+
+def _validate_course(item: dict):
+    """
+    Элемент импорта — blueprint (как отдаёт /api/generate/blueprint/), опционально
+    с "lessons": [{"module_order": 1, "lesson_order": 1, "lesson": {...LessonContent}}].
+    """
+    bp = CourseBlueprint(**item)
+    entries = item.get("lessons") or []
+    if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+        raise ValueError("lessons must be a list of objects")
+    lessons = []
+    for entry in entries:
+        module_order = int(entry.get("module_order") or 0)
+        lesson_order = int(entry.get("lesson_order") or 0)
+        if not 1 <= module_order <= len(bp.modules):
+            raise ValueError(f"module_order {module_order} out of range")
+        if lesson_order < 1:
+            raise ValueError("lesson_order must be >= 1")
+        lc = LessonContent(**(entry.get("lesson") or {}))
+        lessons.append((module_order, lesson_order, lc))
+    if len({(m, n) for m, n, _ in lessons}) != len(lessons):
+        raise ValueError("duplicate (module_order, lesson_order)")
+    return bp, lessons
+
+
+def _write_batch(batch, owner) -> dict:
+    with transaction.atomic():
+        courses = Course.objects.bulk_create(
+            [_course_from_blueprint(bp, owner) for bp, _ in batch]
+        )
+        modules = []
+        for course, (bp, _) in zip(courses, batch, strict=True):
+            modules.extend(_modules_for(course, bp))
+        Module.objects.bulk_create(modules)
+
+        by_key = {(m.course_id, m.order): m for m in modules}
+        lessons = [
+            _lesson_row(module=by_key[(course.id, mo)], order=lo, lc=lc)
+            for course, (_, items) in zip(courses, batch, strict=True)
+            for mo, lo, lc in items
+        ]
+        Lesson.objects.bulk_create(lessons)
+    return {
+        "course_ids": [c.id for c in courses],
+        "modules": len(modules),
+        "lessons": len(lessons),
+    }
+
+
+def import_courses(
+    items: Iterable[dict],
+    owner=None,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    on_batch=None,
+) -> dict:
+    """
+    Валидирует и пишет курсы пачками по batch_size, одна транзакция на пачку.
+    Невалидные элементы пропускаются и попадают в errors (по индексу во входе).
+    on_batch(summary) вызывается после каждой записанной пачки.
+    """
+    summary = {
+        "courses": 0,
+        "modules": 0,
+        "lessons": 0,
+        "invalid": 0,
+        "errors": [],
+        "course_ids": [],
+        "elapsed_s": 0.0,
+        "courses_per_s": None,
+    }
+    started = time.perf_counter()
+
+    def flush(batch):
+        written = _write_batch(batch, owner)
+        summary["courses"] += len(written["course_ids"])
+        summary["modules"] += written["modules"]
+        summary["lessons"] += written["lessons"]
+        summary["course_ids"].extend(written["course_ids"])
+        elapsed = time.perf_counter() - started
+        summary["elapsed_s"] = round(elapsed, 3)
+        summary["courses_per_s"] = (
+            round(summary["courses"] / elapsed, 1) if elapsed else None
+        )
+        if on_batch:
+            on_batch(summary)
+
+    batch = []
+    for i, item in enumerate(items):
+        try:
+            batch.append(_validate_course(item if isinstance(item, dict) else {}))
+        except (ValidationError, ValueError, TypeError) as e:
+            summary["invalid"] += 1
+            if len(summary["errors"]) < IMPORT_MAX_ERRORS:
+                summary["errors"].append({"index": i, "detail": f"invalid_course: {e}"})
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    summary["elapsed_s"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def save_lessons_bulk(items: List[dict]) -> dict:
+    """
+    Семантика /api/lessons/save для многих уроков сразу: (module_id, lesson_order)
+    создаётся или перезаписывается. Вход валидируется целиком до записи.
+    """
+    rows = {}
+    errors = []
+    for i, entry in enumerate(items):
+        try:
+            module_id = int(entry.get("module_id") or 0)
+            lesson_order = int(entry.get("lesson_order") or 1)
+            lc = LessonContent(**(entry.get("lesson") or {}))
+        except (ValidationError, ValueError, TypeError, AttributeError) as e:
+            errors.append({"index": i, "detail": f"invalid_lesson: {e}"})
+            continue
+        rows[(module_id, lesson_order)] = (
+            lc  # повтор ключа — побеждает последний, как при поочерёдных save
+        )
+    if errors:
+        return {"saved": 0, "errors": errors[:IMPORT_MAX_ERRORS]}
+
+    course_by_module = dict(
+        Module.objects.filter(id__in={m for m, _ in rows}).values_list(
+            "id", "course_id"
+        )
+    )
+    missing = sorted({m for m, _ in rows} - set(course_by_module))
+    if missing:
+        return {
+            "saved": 0,
+            "errors": [{"detail": f"module not found: {m}"} for m in missing],
+        }
+
+    with transaction.atomic():
+        Lesson.objects.bulk_create(
+            [_lesson_row(module_id=m, order=n, lc=lc) for (m, n), lc in rows.items()],
+            update_conflicts=True,
+            unique_fields=["module", "order"],
+            update_fields=["title", "content_json", "reading_time_min", "quiz_count"],
+        )
+        for course_id in set(course_by_module.values()):
+            Course.bump_content_version(course_id)
+    return {"saved": len(rows), "errors": []}
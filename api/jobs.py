@@ -0,0 +1,273 @@
+"""
+Очередь фоновых генераций без внешних брокеров: задания лежат в таблице GenerationJob,
+воркеры — потоки (в веб-процессе или в отдельном `manage.py run_jobs`), которые
+забирают задания атомарным UPDATE ... WHERE status='queued'.
+"""
+
+import os
+import threading
+import uuid
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .admission import BATCH
+from .models import Course, GenerationJob, Module
+from .generation import (
+    COURSE_GEN_CONCURRENCY,
+    generate_blueprint_data,
+    generate_course_lessons,
+    generate_lesson_data,
+)
+
+# сколько генераций одновременно — под возможности Ollama, а не под число веб-воркеров
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# running без heartbeat дольше этого считается брошенным (процесс упал) и возвращается в очередь
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "900"))
+# как часто воркер отмечает, что задание ещё выполняется; должно быть много меньше JOB_STALE_AFTER
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# запускать воркеры прямо в веб-процессе; 0 — если работает отдельный run_jobs
+JOBS_IN_PROCESS = os.getenv("JOBS_IN_PROCESS", "1") == "1"
+
+# задания ждут слот модели с пакетным приоритетом: без лимита очереди и таймаута,
+# их и так не больше JOB_WORKERS, а интерактивные запросы идут вперёд
+HANDLERS: Dict[str, Callable[[GenerationJob], dict]] = {}
+
+
+def handler(kind: str):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+
+    return register
+
+
+@handler("blueprint")
+def _run_blueprint(job: GenerationJob) -> dict:
+    payload = job.payload_json
+    return generate_blueprint_data(
+        payload, bypass_cache=bool(payload.get("no_cache")), priority=BATCH
+    )
+
+
+@handler("lesson")
+def _run_lesson(job: GenerationJob) -> dict:
+    payload = job.payload_json
+    course = Course.objects.get(id=int(payload.get("course_id") or 0))
+    module = Module.objects.get(
+        course=course, order=int(payload.get("module_order") or 1)
+    )
+    return generate_lesson_data(
+        course,
+        module,
+        int(payload.get("lesson_order") or 1),
+        bypass_cache=bool(payload.get("no_cache")),
+        priority=BATCH,
+    )
+
+
+@handler("course")
+def _run_course(job: GenerationJob) -> dict:
+    payload = job.payload_json
+    course = Course.objects.get(id=int(payload.get("course_id") or 0))
+
+    def progress(stats):
+        _owned(job).update(progress_json=stats, heartbeat_at=timezone.now())
+
+    return generate_course_lessons(
+        course,
+        concurrency=int(payload.get("concurrency") or COURSE_GEN_CONCURRENCY),
+        bypass_cache=bool(payload.get("no_cache")),
+        on_progress=progress,
+    )
+
+
+def submit(kind: str, payload: dict) -> GenerationJob:
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    job = GenerationJob.objects.create(kind=kind, payload_json=payload)
+    runner = ensure_runner()
+    if runner is not None:
+        runner.wake()
+    return job
+
+
+def claim_next() -> Optional[GenerationJob]:
+    """Забирает самое старое queued-задание; conditional UPDATE не даёт двум воркерам взять одно."""
+    for job_id in GenerationJob.objects.filter(status=GenerationJob.QUEUED).values_list(
+        "id", flat=True
+    )[:10]:
+        now = timezone.now()
+        taken = GenerationJob.objects.filter(
+            id=job_id, status=GenerationJob.QUEUED
+        ).update(
+            status=GenerationJob.RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+            claim=uuid.uuid4().hex,
+            attempts=F("attempts") + 1,
+        )
+        if taken:
+            return GenerationJob.objects.get(id=job_id)
+    return None
+
+
+def _owned(job: GenerationJob):
+    """Задание, пока оно running и захвачено именно этим воркером (не вернулось в очередь)."""
+    return GenerationJob.objects.filter(
+        id=job.id, status=GenerationJob.RUNNING, claim=job.claim
+    )
+
+
+class _Heartbeat:
+    """Фоновый поток: раз в JOB_HEARTBEAT_INTERVAL обновляет heartbeat_at, пока задание выполняется."""
+
+    def __init__(self, job: GenerationJob, interval: Optional[float] = None):
+        self.job = job
+        self.interval = JOB_HEARTBEAT_INTERVAL if interval is None else interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._loop, name=f"job-heartbeat-{job.id}", daemon=True
+        )
+
+    def _loop(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    if not _owned(self.job).update(heartbeat_at=timezone.now()):
+                        return  # задание уже не наше
+                except Exception:
+                    pass  # БД недоступна — попробуем на следующем тике
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_job(job: GenerationJob):
+    """Результат пишется, только если задание всё ещё running и захвачено этим воркером."""
+    try:
+        with _Heartbeat(job):
+            result = HANDLERS[job.kind](job)
+    except Exception as e:
+        _owned(job).update(
+            status=GenerationJob.FAILED,
+            error=f"generation_error: {type(e).__name__}: {e}",
+            finished_at=timezone.now(),
+        )
+    else:
+        _owned(job).update(
+            status=GenerationJob.DONE,
+            result_json=result,
+            error="",
+            finished_at=timezone.now(),
+        )
+
+
+def run_pending(limit: Optional[int] = None) -> int:
+    """Выполняет задания из очереди в текущем потоке; возвращает, сколько выполнено."""
+    done = 0
+    while limit is None or done < limit:
+        job = claim_next()
+        if job is None:
+            break
+        run_job(job)
+        done += 1
+    return done
+
+
+def requeue_stale() -> int:
+    """Возвращает в очередь задания, брошенные упавшим процессом; после JOB_MAX_ATTEMPTS — failed."""
+    cutoff = timezone.now() - timedelta(seconds=JOB_STALE_AFTER)
+    stale = GenerationJob.objects.filter(
+        Q(heartbeat_at__lt=cutoff)
+        | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status=GenerationJob.RUNNING,
+    )
+    stale.filter(attempts__gte=JOB_MAX_ATTEMPTS).update(
+        status=GenerationJob.FAILED,
+        error="abandoned: worker stopped too many times",
+        finished_at=timezone.now(),
+    )
+    return stale.update(
+        status=GenerationJob.QUEUED, started_at=None, heartbeat_at=None, claim=""
+    )
+
+
+class JobRunner:
+    def __init__(
+        self, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL
+    ):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        requeue_stale()
+        close_old_connections()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                job = claim_next()
+                if job is not None:
+                    run_job(job)
+                    continue
+                if self._wake.wait(self.poll_interval):
+                    self._wake.clear()
+                else:
+                    requeue_stale()
+            except Exception:
+                # БД недоступна и т.п. — не роняем поток, пробуем позже
+                self._stop.wait(self.poll_interval)
+
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> JobRunner:
+    """Воркеры в текущем процессе; при старте возвращают в очередь брошенные задания."""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner().start()
+    return _runner
+
+
+def ensure_runner() -> Optional[JobRunner]:
+    """
+    Запускает воркеры веб-процесса (если JOBS_IN_PROCESS) при первом обращении к заданиям —
+    submit или опросе статуса: задания, оставшиеся в очереди после перезапуска, иначе
+    ждали бы следующего submit.
+    """
+    return get_runner() if JOBS_IN_PROCESS else None
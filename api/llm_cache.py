@@ -0,0 +1,251 @@
+"""
+Кэш ответов модели по содержимому: ключ — sha256 от (модель, temperature, итоговый промпт).
+Повторный "regenerate" того же blueprint/урока отдаётся без обращения к Ollama.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .ollama_client import OLLAMA_MODEL
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")  # memory | sqlite | none
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 << 20)))
+
+
+def cache_key(prompt: str, model: str, temperature: float) -> str:
+    raw = json.dumps([model, float(temperature), prompt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """LRU в памяти процесса с TTL и ограничением по числу записей и байтам."""
+
+    def __init__(
+        self,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, tuple]" = (
+            OrderedDict()
+        )  # key -> (expires_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (time.time() + ttl, value)
+            self._bytes += len(value.encode("utf-8"))
+            while self._data and (
+                len(self._data) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key: str):
+        _, value = self._data.pop(key)
+        self._bytes -= len(value.encode("utf-8"))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def size(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes}
+
+
+class SQLiteBackend:
+    """Кэш в файле SQLite — переживает рестарты и общий для всех воркеров на машине."""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, size, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now + ttl, now),
+                )
+                self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+                count, total = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+                ).fetchone()
+                if count > self.max_entries or total > self.max_bytes:
+                    # выкидываем самые давно использованные, пока не влезем в лимиты
+                    excess_bytes = total - self.max_bytes
+                    victims = []
+                    for k, sz in self._conn.execute(
+                        "SELECT key, size FROM llm_cache ORDER BY last_used"
+                    ):
+                        if count <= self.max_entries and excess_bytes <= 0:
+                            break
+                        victims.append((k,))
+                        count -= 1
+                        excess_bytes -= sz
+                    self._conn.executemany(
+                        "DELETE FROM llm_cache WHERE key = ?", victims
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def size(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        return {"entries": count, "bytes": total}
+
+
+class LLMCache:
+    def __init__(self, backend=None, ttl: float = LLM_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+
+    def get(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        temperature: float = 0.2,
+        bypass: bool = False,
+    ) -> Optional[str]:
+        """Сохранённый ответ или None; bypass — как промах (для "regenerate")."""
+        if self.backend is None:
+            return None
+        if bypass:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        value = self.backend.get(cache_key(prompt, model or OLLAMA_MODEL, temperature))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(
+        self,
+        prompt: str,
+        raw: str,
+        model: Optional[str] = None,
+        temperature: float = 0.2,
+    ):
+        if self.backend is None:
+            return
+        self.backend.set(
+            cache_key(prompt, model or OLLAMA_MODEL, temperature), raw, self.ttl
+        )
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            looked_up = self.hits + self.misses
+            out = {
+                "backend": (
+                    type(self.backend).__name__ if self.backend is not None else None
+                ),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "stores": self.stores,
+                "hit_rate": self.hits / looked_up if looked_up else None,
+            }
+        if self.backend is not None:
+            out.update(self.backend.size())
+        return out
+
+
+def _make_backend():
+    if LLM_CACHE_BACKEND == "sqlite":
+        return SQLiteBackend()
+    if LLM_CACHE_BACKEND == "memory":
+        return MemoryBackend()
+    return None
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> LLMCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache(_make_backend())
+    return _cache
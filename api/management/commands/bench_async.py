@@ -0,0 +1,170 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from api import admission, llm_cache, ollama_client
+from api.fake_ollama import FakeOllama
+from api.management.commands.seed_knowledge import GOLDEN_COURSE
+
+SYNC_PATH = "/api/generate/blueprint/"
+ASYNC_PATH = "/api/async/generate/blueprint/"
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test against a local fake Ollama: sync endpoint in a thread-per-request WSGI worker "
+        "vs sync endpoint under ASGI vs async endpoint in one event loop"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Concurrent requests per variant"
+        )
+        parser.add_argument(
+            "--delay", type=float, default=0.2, help="Fake model latency, seconds"
+        )
+        parser.add_argument(
+            "--threads", type=int, default=8, help="WSGI worker threads"
+        )
+        parser.add_argument("--variants", default="wsgi,asgi-sync,async")
+        parser.add_argument(
+            "--max-inflight",
+            type=int,
+            default=0,
+            help="Admission limit for model calls (0 = no limit, measure the views only)",
+        )
+        parser.add_argument("--max-queue", type=int, default=admission.OLLAMA_MAX_QUEUE)
+
+    def handle(self, *args, **opts):
+        with FakeOllama(
+            response=json.dumps(GOLDEN_COURSE), delay=opts["delay"]
+        ) as fake:
+            saved = ollama_client._client, llm_cache._cache, admission._admission
+            ollama_client._client = ollama_client.OllamaClient(
+                host=fake.url, pool_size=opts["requests"]
+            )
+            llm_cache._cache = llm_cache.LLMCache(
+                None
+            )  # каждый запрос — настоящий вызов модели
+            try:
+                for variant in [v for v in opts["variants"].split(",") if v]:
+                    admission._admission = admission.AdmissionControl(
+                        max_inflight=opts["max_inflight"] or opts["requests"],
+                        max_queue=opts["max_queue"],
+                    )
+                    if variant == "wsgi":
+                        elapsed, codes, threads = self._load_wsgi(
+                            opts["requests"], opts["threads"]
+                        )
+                    else:
+                        path = SYNC_PATH if variant == "asgi-sync" else ASYNC_PATH
+                        elapsed, codes, threads = asyncio.run(
+                            self._load(path, opts["requests"])
+                        )
+                    ok = codes.count(200)
+                    self.stdout.write(
+                        f"{variant:<9} {opts['requests']} concurrent, model delay {opts['delay']}s: "
+                        f"{elapsed:6.2f}s wall, {ok}/{len(codes)} ok, {ok / elapsed:7.1f} req/s, "
+                        f"429: {codes.count(429)}, 503: {codes.count(503)}, median threads {threads}"
+                    )
+            finally:
+                ollama_client._client, llm_cache._cache, admission._admission = saved
+
+    def _load_wsgi(self, n, threads):
+        # как gunicorn с --threads: генерация занимает поток целиком, пока ждёт модель
+        def call(i):
+            resp = Client(HTTP_HOST="127.0.0.1").post(
+                SYNC_PATH,
+                {"topic": f"Python {i}", "no_cache": True},
+                content_type="application/json",
+            )
+            return resp.status_code
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            codes = list(pool.map(call, range(n)))
+        return time.perf_counter() - t0, codes, threads
+
+    async def _call(self, app, path: str, payload: dict) -> int:
+        """Один POST прямо в ASGI-приложение, без сети; возвращает HTTP-статус."""
+        body = json.dumps(payload).encode("utf-8")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"host", b"127.0.0.1"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("127.0.0.1", 50000),
+            "server": ("127.0.0.1", 80),
+        }
+        sent = False
+        status = 0
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get(
+                "more_body"
+            ):
+                disconnected.set()
+
+        await app(scope, receive, send)
+        return status
+
+    async def _load(self, path, n):
+        # ASGI-приложение в этом же процессе: sync view Django выполняет в отдельном потоке
+        # на каждый запрос, async view — прямо в event loop. Потоки фейкового Ollama
+        # не считаем: threads — сколько потоков держит само приложение, пока ждёт модель.
+        app = get_asgi_application()
+        samples = []
+        done = asyncio.Event()
+
+        async def sample():
+            while not done.is_set():
+                samples.append(
+                    sum(
+                        1
+                        for t in threading.enumerate()
+                        if not t.name.startswith("Thread-")
+                    )
+                )
+                await asyncio.sleep(0.01)
+
+        sampler = asyncio.create_task(sample())
+        t0 = time.perf_counter()
+        codes = await asyncio.gather(
+            *[
+                self._call(app, path, {"topic": f"Python {i}", "no_cache": True})
+                for i in range(n)
+            ]
+        )
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await sampler
+        samples.sort()
+        return elapsed, list(codes), samples[len(samples) // 2] if samples else 0
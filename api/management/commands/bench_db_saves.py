@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+
+from api.generation import save_lesson_content
+from api.models import Course, Lesson, Module
+
+# как было до настройки: rollback journal, DEFERRED-транзакции, стандартные 5 с ожидания
+LEGACY_SQLITE_OPTIONS = {}
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent lesson saves: legacy vs tuned SQLite settings (or the configured DB)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--saves", type=int, default=50, help="Saves per thread")
+        parser.add_argument(
+            "--profiles",
+            default="legacy,tuned",
+            help="legacy,tuned for SQLite (temporary files); 'current' uses the configured DB",
+        )
+
+    def handle(self, *args, **opts):
+        db = connections.settings["default"]
+        profiles = [p for p in opts["profiles"].split(",") if p]
+        if db["ENGINE"] != "django.db.backends.sqlite3" and profiles != ["current"]:
+            raise CommandError(
+                "legacy/tuned profiles are for SQLite; use --profiles current"
+            )
+
+        saved = {"NAME": db["NAME"], "OPTIONS": dict(db.get("OPTIONS") or {})}
+        for profile in profiles:
+            with tempfile.TemporaryDirectory() as tmp:
+                connection.close()
+                if profile != "current":
+                    db["NAME"] = os.path.join(tmp, "bench.sqlite3")
+                    db["OPTIONS"] = dict(
+                        LEGACY_SQLITE_OPTIONS
+                        if profile == "legacy"
+                        else saved["OPTIONS"]
+                    )
+                    call_command("migrate", verbosity=0)
+                try:
+                    self._run(profile, opts["threads"], opts["saves"])
+                finally:
+                    connection.close()
+                    db["NAME"], db["OPTIONS"] = saved["NAME"], dict(saved["OPTIONS"])
+
+    def _run(self, profile, n_threads, saves):
+        course = Course.objects.create(topic="DB bench", level="beginner", capstone="-")
+        modules = [
+            Module.objects.create(course=course, order=i + 1, title=f"M{i}", lessons=8)
+            for i in range(n_threads)
+        ]
+        content = {
+            "title": "Bench lesson",
+            "theory_md": "text " * 400,
+            "quiz": [],
+            "objectives": [],
+        }
+        ok = [0] * n_threads
+        locked = [0] * n_threads
+        start = threading.Barrier(n_threads)
+
+        def worker(i):
+            try:
+                start.wait()
+                for n in range(saves):
+                    try:
+                        save_lesson_content(
+                            modules[i], n % 8 + 1, dict(content, title=f"L{n}")
+                        )
+                        # читатель рядом с писателями, как листинг уроков в UI
+                        list(
+                            Lesson.objects.filter(module=modules[i]).values_list(
+                                "id", "title"
+                            )
+                        )
+                        ok[i] += 1
+                    except OperationalError:
+                        locked[i] += 1
+            finally:
+                connections["default"].close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        self.stdout.write(
+            f"{profile:<8} threads={n_threads} saves={sum(ok):>5} errors={sum(locked):>5} "
+            f"{elapsed:6.2f}s  {sum(ok) / elapsed:7.1f} saves/s"
+        )
@@ -0,0 +1,133 @@
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api import exporter
+from api.models import Course, Lesson, Module
+
+
+def synthetic_lesson(module_order: int, order: int, code_files: int = 4) -> dict:
+    return {
+        "title": f"Lesson {module_order}.{order}",
+        "theory_md": ("Python lesson text with examples. " * 60).strip(),
+        "objectives": ["Explain the idea", "Apply it in code"],
+        "quiz": [{"question": f"Q{i}?", "options": ["A", "B", "C"]} for i in range(5)],
+        "code_examples": [
+            {
+                "filename": f"example_{i}.py",
+                "content": f"def f{i}(x):\n    return x * {i}\n" * 20,
+            }
+            for i in range(code_files)
+        ],
+        "exercise": {
+            "starter_files": [{"filename": "main.py", "content": "# TODO\n"}],
+            "tests": [
+                {
+                    "filename": "test_main.py",
+                    "content": "def test_ok():\n    assert True\n",
+                }
+            ],
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark course ZIP export: queries and time, serial vs pooled rendering (data rolled back afterwards)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--modules", type=int, default=20)
+        parser.add_argument("--lessons", type=int, default=8, help="Lessons per module")
+        parser.add_argument(
+            "--code-files", type=int, default=4, help="Code examples per lesson"
+        )
+        parser.add_argument(
+            "--workers",
+            default="1,2,4",
+            help="Comma-separated pool sizes; 1 = serial path",
+        )
+        parser.add_argument(
+            "--pool", choices=["thread", "process"], default=exporter.EXPORT_POOL
+        )
+        parser.add_argument(
+            "--level",
+            type=int,
+            default=exporter.EXPORT_COMPRESS_LEVEL,
+            help="zlib level 1-9",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def _run(self, course_id, workers, pool, level, cold):
+        timings = []
+        for _ in range(self.repeat):
+            with tempfile.TemporaryDirectory() as tmp:
+                if cold:
+                    exporter.EXPORT_CACHE_DIR = Path(
+                        tmp
+                    )  # пустой кэш фрагментов — честный рендер
+                with CaptureQueriesContext(connection) as ctx:
+                    t0 = time.perf_counter()
+                    size = len(
+                        b"".join(
+                            exporter.iter_course_zip(
+                                course_id, workers=workers, pool=pool, level=level
+                            )
+                        )
+                    )
+                    timings.append(time.perf_counter() - t0)
+        timings.sort()
+        return timings[len(timings) // 2], size, len(ctx.captured_queries)
+
+    def handle(self, *args, **opts):
+        self.repeat = opts["repeat"]
+        saved_dir = exporter.EXPORT_CACHE_DIR
+        with transaction.atomic(), tempfile.TemporaryDirectory() as warm_dir:
+            course = Course.objects.create(
+                topic="Bench course", level="beginner", capstone="-"
+            )
+            for mo in range(1, opts["modules"] + 1):
+                m = Module.objects.create(
+                    course=course,
+                    order=mo,
+                    title=f"Module {mo}",
+                    lessons=opts["lessons"],
+                )
+                Lesson.objects.bulk_create(
+                    Lesson(
+                        module=m,
+                        order=n,
+                        title=f"Lesson {n}",
+                        content_json=synthetic_lesson(mo, n, opts["code_files"]),
+                    )
+                    for n in range(1, opts["lessons"] + 1)
+                )
+            self.stdout.write(
+                f"{opts['modules']}x{opts['lessons']} course, pool={opts['pool']}, level={opts['level']}"
+            )
+            try:
+                base = None
+                for workers in [
+                    int(w) for w in opts["workers"].split(",") if w.strip()
+                ]:
+                    median, size, queries = self._run(
+                        course.id, workers, opts["pool"], opts["level"], cold=True
+                    )
+                    base = base or median
+                    self.stdout.write(
+                        f"  workers={workers:<3} cold  {median * 1000:8.1f} ms  x{base / median:4.2f}  "
+                        f"{size / 1024:.0f} KiB  {queries} queries"
+                    )
+                exporter.EXPORT_CACHE_DIR = Path(warm_dir)
+                exporter.export_course_zip(course.id)  # прогрев кэша фрагментов
+                median, size, queries = self._run(
+                    course.id, 1, opts["pool"], opts["level"], cold=False
+                )
+                self.stdout.write(
+                    f"  cached fragments {median * 1000:8.1f} ms  {queries} queries"
+                )
+            finally:
+                exporter.EXPORT_CACHE_DIR = saved_dir
+                transaction.set_rollback(True)
@@ -0,0 +1,137 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from api.fake_ollama import fake_embedding
+from api.ollama_client import OLLAMA_EMBED_MODEL, OllamaEmbedder
+from api.rag import BM25Index, tokenize
+
+SUFFIXES = ["", "s", "ing", "ed", "er"]
+
+
+class FakeEmbedder:
+    model = "fake-trigram"
+
+    def __call__(self, texts):
+        return [fake_embedding(t, 256) for t in texts]
+
+
+def labeled_corpus(
+    n_passages: int,
+    n_queries: int,
+    n_stems: int = 5_000,
+    length: int = 40,
+    seed: int = 0,
+):
+    """
+    Пассажи из псевдослов с суффиксами и два набора запросов с известным ответом (пассаж i)
+    из трёх его редких слов: "mixed" — одно слово как в тексте, два в других формах
+    (loop -> looping); "paraphrase" — все три в других формах, лексически запрос
+    с пассажем может не совпадать вовсе.
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    stems = [
+        "".join(rng.choice(letters, size=rng.integers(5, 9))) for _ in range(n_stems)
+    ]
+    passages, words_of = [], []
+    for _ in range(n_passages):
+        ids = (rng.zipf(1.3, size=length) - 1) % n_stems
+        words = [(int(i), SUFFIXES[rng.integers(len(SUFFIXES))]) for i in ids]
+        words_of.append(words)
+        passages.append(" ".join(stems[i] + suf for i, suf in words))
+    queries = {"mixed": [], "paraphrase": []}
+    for target in rng.choice(
+        n_passages, size=min(n_queries, n_passages), replace=False
+    ):
+        # редкие слова пассажа — по ним человек и искал бы
+        rare = sorted(set(words_of[target]), key=lambda w: -w[0])[:3]
+        variants = []
+        for i, suf in rare:
+            other = [s for s in SUFFIXES if s != suf]
+            variants.append(stems[i] + other[rng.integers(len(other))])
+        exact = stems[rare[0][0]] + rare[0][1]
+        queries["mixed"].append((" ".join([exact] + variants[1:]), int(target)))
+        queries["paraphrase"].append((" ".join(variants), int(target)))
+    return passages, queries
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark RAG retrieval: BM25 vs dense vs hybrid (RRF) — recall@k and latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--passages",
+            type=int,
+            default=3000,
+            help="Labeled corpus size for recall@k",
+        )
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--top-k", type=int, default=5)
+        parser.add_argument(
+            "--embedder",
+            choices=["fake", "ollama"],
+            default="fake",
+            help="fake = trigram hashing in-process; ollama = OLLAMA_EMBED_MODEL via /api/embed",
+        )
+        parser.add_argument(
+            "--sizes",
+            default="10000,100000",
+            help="Corpus sizes for dense search latency (random unit vectors)",
+        )
+        parser.add_argument(
+            "--dim", type=int, default=768, help="Vector size for the latency runs"
+        )
+
+    def handle(self, *args, **opts):
+        top_k = opts["top_k"]
+        embedder = (
+            FakeEmbedder()
+            if opts["embedder"] == "fake"
+            else OllamaEmbedder(OLLAMA_EMBED_MODEL)
+        )
+        passages, queries = labeled_corpus(opts["passages"], opts["queries"])
+
+        t0 = time.perf_counter()
+        idx = BM25Index()
+        idx.build(
+            [(f"doc{i}.md", p) for i, p in enumerate(passages)], embedder=embedder
+        )
+        self.stdout.write(
+            f"corpus: {len(idx.passages)} passages, embedder={embedder.model}, "
+            f"build+embed {time.perf_counter() - t0:.1f}s"
+        )
+
+        runs = {
+            "bm25": lambda q, v: idx.top_k(tokenize(q), top_k),
+            "dense": lambda q, v: idx.dense_top_k(v, top_k),
+            "hybrid": lambda q, v: idx.hybrid_top_k(tokenize(q), v, top_k),
+        }
+        for kind, qs in queries.items():
+            q_vecs = np.asarray(embedder([q for q, _ in qs]), dtype=np.float32)
+            for name, run in runs.items():
+                hits = 0
+                t0 = time.perf_counter()
+                for (q, target), v in zip(qs, q_vecs, strict=True):
+                    hits += any(d == target for d, _ in run(q, v))
+                ms = (time.perf_counter() - t0) * 1000 / len(qs)
+                self.stdout.write(
+                    f"{kind:<10} {name:<7} recall@{top_k}={hits / len(qs):.3f}  {ms:8.3f} ms/query ({len(qs)} queries)"
+                )
+
+        # латентность плотного этапа на больших корпусах не зависит от содержимого
+        rng = np.random.default_rng(0)
+        for n in [int(s) for s in opts["sizes"].split(",") if s.strip()]:
+            big = BM25Index()
+            big.embeddings = rng.standard_normal((n, opts["dim"]), dtype=np.float32)
+            big.embeddings /= np.linalg.norm(big.embeddings, axis=1, keepdims=True)
+            vecs = rng.standard_normal((20, opts["dim"]), dtype=np.float32)
+            t0 = time.perf_counter()
+            for v in vecs:
+                big.dense_top_k(v, top_k)
+            ms = (time.perf_counter() - t0) * 1000 / len(vecs)
+            self.stdout.write(f"dense n={n:>8} dim={opts['dim']}: {ms:8.3f} ms/query")
+            del big
@@ -0,0 +1,244 @@
+import re
+import time
+from collections import Counter
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from rank_bm25 import BM25Okapi
+
+from api.rag import (
+    WORD_RE,
+    Analyzer,
+    BM25Index,
+    _analyze_passages,
+    split_passages,
+    tokenize,
+)
+
+
+def synthetic_corpus(
+    n_passages: int, vocab_size: int = 50_000, length: int = 60, seed: int = 0
+):
+    """Пассажи из слов с ципфовым распределением — похоже на реальные тексты по частотам."""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{i}" for i in range(vocab_size)])
+    ids = np.minimum(rng.zipf(1.2, size=(n_passages, length)), vocab_size) - 1
+    return [" ".join(row) for row in words[ids]]
+
+
+def synthetic_queries(n: int, vocab_size: int = 50_000, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    # 2–4 слова из «средней» части словаря, как у реальных запросов
+    return [
+        " ".join(
+            f"w{w}"
+            for w in rng.integers(10, min(vocab_size, 5_000), size=rng.integers(2, 5))
+        )
+        for _ in range(n)
+    ]
+
+
+def markdown_corpus(mb: float, seed: int = 0) -> str:
+    """Markdown примерно на mb мегабайт: заголовки, абзацы, списки и код, английский вперемешку с русским."""
+    rng = np.random.default_rng(seed)
+    words = np.array(
+        "Python loop list dict function class import return value string Django model view query index "
+        "цикл список словарь функция класс значение строка модель запрос индекс пример данные "
+        "the a of and to in is for это и в на для".split()
+    )
+    sections, size = [], 0
+    while size < mb * 1e6:
+        parts = [f"# {' '.join(rng.choice(words, 3)).capitalize()}"]
+        for _ in range(rng.integers(2, 6)):
+            kind = rng.integers(4)
+            if kind == 0:
+                parts.append(
+                    "\n".join(f"- {' '.join(rng.choice(words, 6))}" for _ in range(4))
+                )
+            elif kind == 1:
+                parts.append(
+                    f"```python\nfor x in {rng.choice(words)}:\n    print(x.{rng.choice(words)}())\n```"
+                )
+            else:
+                sentences = (
+                    " ".join(rng.choice(words, rng.integers(6, 16))).capitalize() + "."
+                    for _ in range(rng.integers(2, 8))
+                )
+                parts.append(" ".join(sentences))
+        section = "\n\n".join(parts)
+        sections.append(section)
+        size += len(section.encode("utf-8")) + 2
+    return "\n\n".join(sections)
+
+
+def tokenize_baseline(text: str):
+    # прежняя версия: lower() на каждое слово
+    return [w.lower() for w in WORD_RE.findall(text or "")]
+
+
+def split_passages_baseline(text: str, max_chars: int = 800):
+    # прежняя версия: склейка строк в буфере
+    parts = re.split(r"\n\s*\n|^# .*$", text, flags=re.MULTILINE)
+    out = []
+    buf = ""
+    for p in parts:
+        p = p.strip()
+        if not p:
+            continue
+        if len(buf) + len(p) + 1 <= max_chars:
+            buf = (buf + "\n" + p).strip()
+        else:
+            if buf:
+                out.append(buf)
+            buf = p
+    if buf:
+        out.append(buf)
+    return out
+
+
+def analyze_baseline(passages):
+    # прежняя версия _analyze_passages: Counter на каждый пассаж
+    local, rows = {}, []
+    for d, pas in enumerate(passages):
+        for tok, cnt in Counter(tokenize_baseline(pas)).items():
+            rows.append((local.setdefault(tok, len(local)), d, cnt))
+    return local, rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark RAG text pipeline (split/tokenize MB/s) and BM25 search: "
+        "inverted index vs full BM25Okapi scan, one query at a time vs search_many"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="10000,100000,1000000",
+            help="Comma-separated corpus sizes for the search run (empty = skip)",
+        )
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--top-k", type=int, default=5)
+        parser.add_argument(
+            "--no-reference", action="store_true", help="Skip the BM25Okapi baseline"
+        )
+        parser.add_argument(
+            "--text-mb",
+            type=float,
+            default=20.0,
+            help="Markdown corpus size for the tokenizer/splitter throughput run (0 = skip)",
+        )
+        parser.add_argument(
+            "--stem",
+            default="english",
+            help="Stemmer language for the analyzer throughput line",
+        )
+
+    def text_pipeline(self, mb: float, stem: str):
+        text = markdown_corpus(mb)
+        size_mb = len(text.encode("utf-8")) / 1e6
+        passages = split_passages(text)
+
+        def rate(fn, arg, repeat=3):
+            best = min(self._timed(fn, arg) for _ in range(repeat))
+            return size_mb / best
+
+        # по пассажам, как при индексации: на коротких строках накладные расходы заметнее
+        def per_passage(fn):
+            return lambda ps: [fn(p) for p in ps]
+
+        lines = [
+            (
+                "split_passages",
+                rate(split_passages_baseline, text),
+                rate(split_passages, text),
+                split_passages_baseline(text) == passages,
+            ),
+            (
+                "tokenize (whole text)",
+                rate(tokenize_baseline, text),
+                rate(tokenize, text),
+                tokenize_baseline(text) == tokenize(text),
+            ),
+            (
+                "tokenize (per passage)",
+                rate(per_passage(tokenize_baseline), passages),
+                rate(per_passage(tokenize), passages),
+                True,
+            ),
+            (
+                "analyze passages",
+                rate(analyze_baseline, passages),
+                rate(_analyze_passages, passages),
+                True,
+            ),
+        ]
+        self.stdout.write(f"text: {size_mb:.1f} MB markdown, {len(passages)} passages")
+        for name, old, new, same in lines:
+            self.stdout.write(
+                f"{name:<24} before={old:7.1f} MB/s  after={new:7.1f} MB/s  ({new / old:4.2f}x)"
+                + ("" if same else "  OUTPUT DIFFERS")
+            )
+        for config in ({"stopwords": True}, {"stopwords": True, "stemmer": stem}):
+            try:
+                analyzer = Analyzer.from_config(config)
+            except ImportError as e:
+                self.stdout.write(f"analyzer {config}: skipped ({e})")
+                continue
+            mbs = rate(lambda ps, a=analyzer: _analyze_passages(ps, a), passages)
+            self.stdout.write(f"analyze passages, {analyzer}: {mbs:7.1f} MB/s")
+
+    @staticmethod
+    def _timed(fn, arg) -> float:
+        t0 = time.perf_counter()
+        fn(arg)
+        return time.perf_counter() - t0
+
+    def handle(self, *args, **opts):
+        if opts["text_mb"] > 0:
+            self.text_pipeline(opts["text_mb"], opts["stem"])
+        sizes = [int(s) for s in opts["sizes"].split(",") if s.strip()]
+        queries = synthetic_queries(opts["queries"])
+        top_k = opts["top_k"]
+
+        for n in sizes:
+            passages = synthetic_corpus(n)
+            docs = [(f"doc{i}.md", p) for i, p in enumerate(passages)]
+
+            t0 = time.perf_counter()
+            idx = BM25Index()
+            idx.build(docs)
+            build_s = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            new_results = [idx.top_k(tokenize(q), top_k) for q in queries]
+            new_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+            line = f"n={n:>9}  build={build_s:7.2f}s  inverted={new_ms:9.3f} ms/query"
+
+            t0 = time.perf_counter()
+            batch_results = idx.top_k_many([tokenize(q) for q in queries], top_k)
+            batch_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+            line += (
+                f"  batch={batch_ms:9.3f} ms/query ({new_ms / batch_ms:4.1f}x, "
+                f"mismatches={sum(a != b for a, b in zip(new_results, batch_results, strict=True))})"
+            )
+
+            if not opts["no_reference"]:
+                ref = BM25Okapi([tokenize(p) for p in idx.passages])
+                t0 = time.perf_counter()
+                ref_results = []
+                for q in queries:
+                    scores = ref.get_scores(tokenize(q))
+                    order = sorted(
+                        range(len(scores)), key=lambda i: scores[i], reverse=True
+                    )[:top_k]
+                    ref_results.append([(i, float(scores[i])) for i in order])
+                ref_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+                mismatches = sum(
+                    a != b for a, b in zip(new_results, ref_results, strict=True)
+                )
+                line += f"  full_scan={ref_ms:9.3f} ms/query  speedup={ref_ms / new_ms:7.1f}x  mismatches={mismatches}"
+                del ref
+
+            self.stdout.write(line)
+            del idx, docs, passages
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.generation import COURSE_GEN_CONCURRENCY, generate_course_lessons
+from api.models import Course
+
+
+class Command(BaseCommand):
+    help = "Generate all missing lessons of a course via Ollama (resumable: saved lessons are skipped)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_id", type=int)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=COURSE_GEN_CONCURRENCY,
+            help="Lessons generated in parallel",
+        )
+        parser.add_argument(
+            "--no-cache", action="store_true", help="Ignore cached model answers"
+        )
+
+    def handle(self, *args, **opts):
+        try:
+            course = Course.objects.get(id=opts["course_id"])
+        except Course.DoesNotExist:
+            raise CommandError(f"Course {opts['course_id']} not found") from None
+
+        def progress(s):
+            done = s["skipped"] + s["generated"] + s["failed"]
+            rate = (
+                f", {s['lessons_per_min']} lessons/min" if s["lessons_per_min"] else ""
+            )
+            self.stdout.write(
+                f"  {done}/{s['total']} (skipped {s['skipped']}, failed {s['failed']}){rate}"
+            )
+
+        self.stdout.write(
+            f"Course {course.id}: {course.topic}, concurrency {opts['concurrency']}"
+        )
+        stats = generate_course_lessons(
+            course,
+            concurrency=opts["concurrency"],
+            bypass_cache=opts["no_cache"],
+            on_progress=progress,
+        )
+        for err in stats["errors"]:
+            self.stderr.write(
+                f"  module {err['module_order']} lesson {err['lesson_order']}: {err['detail']}"
+            )
+        msg = (
+            f"Generated {stats['generated']}, skipped {stats['skipped']}, failed {stats['failed']} "
+            f"in {stats['elapsed_s']:.1f}s"
+        )
+        if stats["failed"]:
+            self.stdout.write(self.style.WARNING(msg))
+        else:
+            self.stdout.write(self.style.SUCCESS(msg))
@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import IMPORT_BATCH_SIZE, import_courses
+
+
+def iter_course_files(paths):
+    """JSON-файлы из путей (папки обходятся рекурсивно); в файле — blueprint или список blueprint."""
+    for raw in paths:
+        p = Path(raw)
+        files = sorted(p.rglob("*.json")) if p.is_dir() else [p]
+        for f in files:
+            try:
+                data = json.loads(f.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                raise CommandError(f"{f}: {e}") from e
+            yield from data if isinstance(data, list) else [data]
+
+
+class Command(BaseCommand):
+    help = "Bulk-import course blueprints (optionally with lessons) from JSON files, e.g. golden_course/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="JSON files or folders")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help="Courses per transaction",
+        )
+
+    def handle(self, *args, **opts):
+        def progress(s):
+            self.stdout.write(
+                f"  {s['courses']} courses, {s['lessons']} lessons ({s['courses_per_s']} courses/s)"
+            )
+
+        summary = import_courses(
+            iter_course_files(opts["paths"]),
+            batch_size=opts["batch_size"],
+            on_batch=progress,
+        )
+        for err in summary["errors"]:
+            self.stderr.write(f"  #{err['index']}: {err['detail']}")
+        rate = summary["courses"] / summary["elapsed_s"] if summary["elapsed_s"] else 0
+        msg = (
+            f"Imported {summary['courses']} courses, {summary['modules']} modules, {summary['lessons']} lessons "
+            f"in {summary['elapsed_s']:.2f}s ({rate:.0f} courses/s); invalid: {summary['invalid']}"
+        )
+        self.stdout.write(
+            self.style.WARNING(msg) if summary["invalid"] else self.style.SUCCESS(msg)
+        )
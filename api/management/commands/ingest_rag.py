@@ -1,22 +1,81 @@
 from django.core.management.base import BaseCommand
 from pathlib import Path
-from api.rag import BM25Index, read_knowledge_dir
+from api.ollama_client import OLLAMA_EMBED_MODEL, OllamaEmbedder
+from api.rag import DEFAULT_ANALYZER, Analyzer, BM25Index, IndexFormatError, update_index
 
 class Command(BaseCommand):
-    help = "Build BM25 RAG index from knowledge/ dir"
+    help = "Build BM25 RAG index from knowledge/ dir (incrementally, reusing unchanged files)"
 
     def add_arguments(self, parser):
         parser.add_argument("--src", default="knowledge", help="Folder with .md/.txt")
-        parser.add_argument("--out", default="rag_index.pkl", help="Output pickle file")
+        parser.add_argument("--out", default="rag_index.bm25", help="Output index file")
+        parser.add_argument("--workers", type=int, default=1, help="Processes for splitting/tokenizing changed files")
+        parser.add_argument("--full", action="store_true", help="Ignore the existing index and rebuild from scratch")
+        parser.add_argument("--embed", action="store_true",
+                            help="Also store passage embeddings for hybrid search (kept on later runs)")
+        parser.add_argument("--no-embed", action="store_true", help="Drop passage embeddings from the index")
+        parser.add_argument("--embed-model", default=None,
+                            help=f"Ollama embedding model (default: the index's model or {OLLAMA_EMBED_MODEL})")
+        parser.add_argument("--stopwords", action="store_true", help="Drop English/Russian stopwords from the index")
+        parser.add_argument("--stem", default=None, metavar="LANGUAGE",
+                            help="Snowball stemming via nltk, e.g. english or russian")
+        parser.add_argument("--plain", action="store_true",
+                            help="Plain lowercase tokens, no stopwords or stemming (the default for new indexes)")
 
     def handle(self, *args, **opts):
         src = Path(opts["src"]).resolve()
         out = Path(opts["out"]).resolve()
         self.stdout.write(f"Reading: {src}")
-        docs = read_knowledge_dir(src)
-        if not docs:
+
+        previous = None
+        if out.exists() and not opts["full"]:
+            previous = BM25Index()
+            try:
+                previous.load(out)
+            except IndexFormatError as e:
+                self.stdout.write(self.style.WARNING(f"{e}; doing a full rebuild"))
+                previous = None
+
+        # эмбеддинги, раз включённые, обновляются вместе с индексом, пока не выключить явно
+        had_embeddings = previous is not None and previous.embeddings is not None
+        embedder = None
+        if not opts["no_embed"] and (opts["embed"] or had_embeddings):
+            model = opts["embed_model"] or (previous.embed_model if had_embeddings else None) or OLLAMA_EMBED_MODEL
+            embedder = OllamaEmbedder(model)
+
+        # анализатор, как и эмбеддинги, сохраняется в индексе; смена — полная пересборка
+        if opts["plain"]:
+            analyzer = DEFAULT_ANALYZER
+        elif opts["stopwords"] or opts["stem"]:
+            analyzer = Analyzer.from_config({"stopwords": opts["stopwords"], "stemmer": opts["stem"]})
+        else:
+            analyzer = None if previous is not None else Analyzer.from_env()
+
+        idx, summary = update_index(src, previous, workers=opts["workers"], spool_dir=out.parent,
+                                    embedder=embedder, analyzer=analyzer)
+        if not len(idx.passages):
             self.stdout.write(self.style.WARNING("No docs found."))
-        idx = BM25Index()
-        idx.build(docs)
+        changed = summary["files_added"] + summary["files_updated"] + summary["files_removed"]
+        dense_changed = (idx.embeddings is not None) != had_embeddings or (
+            idx.embeddings is not None and idx.embed_model != previous.embed_model
+        )
+        if previous is not None and not changed and idx.files == previous.files and not dense_changed:
+            self.stdout.write(self.style.SUCCESS(f"Index is up to date: {out} (passages={len(idx.passages)})"))
+            return
         idx.save(out)
+        self.stdout.write(
+            "files: +{files_added} added, ~{files_updated} updated, -{files_removed} removed, "
+            "{files_unchanged} unchanged".format(**summary)
+        )
+        self.stdout.write(
+            "passages: +{passages_added} added, -{passages_removed} removed, "
+            "{passages_reused} reused".format(**summary)
+        )
+        if embedder is not None:
+            self.stdout.write(
+                f"embeddings ({embedder.model}): {summary['passages_embedded']} computed, "
+                f"{summary['embeddings_reused']} reused"
+            )
+        if previous is not None and idx.analyzer != previous.analyzer:
+            self.stdout.write(f"analyzer: {previous.analyzer} -> {idx.analyzer}")
         self.stdout.write(self.style.SUCCESS(f"Saved index: {out} (passages={len(idx.passages)})"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.exporter import EXPORT_CACHE_DIR, EXPORT_COMPRESS_LEVEL, prune_cache
+
+
+class Command(BaseCommand):
+    help = "Delete orphaned lesson fragments and outdated course archives from the export cache (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--level",
+            type=int,
+            default=EXPORT_COMPRESS_LEVEL,
+            help="zlib level of fragments to keep (fragments of other levels are deleted)",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report what would be deleted"
+        )
+
+    def handle(self, *args, **opts):
+        stats = prune_cache(level=opts["level"], dry_run=opts["dry_run"])
+        verb = "Would delete" if opts["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} from {EXPORT_CACHE_DIR}: {stats['fragments']} fragments, {stats['archives']} archives, "
+                f"{stats['tmp']} temp files ({stats['bytes'] / 1e6:.1f} MB)"
+            )
+        )
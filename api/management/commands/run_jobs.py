@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import JOB_POLL_INTERVAL, JOB_WORKERS, JobRunner
+
+
+class Command(BaseCommand):
+    help = "Run generation job workers in the foreground (use with JOBS_IN_PROCESS=0 on web workers)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=JOB_WORKERS, help="Concurrent generations"
+        )
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=JOB_POLL_INTERVAL,
+            help="Queue poll interval, seconds",
+        )
+
+    def handle(self, *args, **opts):
+        runner = JobRunner(workers=opts["workers"], poll_interval=opts["poll"]).start()
+        self.stdout.write(self.style.SUCCESS(f"Job workers started: {opts['workers']}"))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping...")
+            runner.stop()
@@ -34,7 +34,7 @@ See: {PY}tutorial/controlflow.html#defining-functions""",
 # Comprehensions
 List/Dict/Set comprehensions, generator expressions.
 - `[x*x for x in range(10) if x%2==0]`
-- `{k:v for k,v in pairs}`
+- `{{k:v for k,v in pairs}}`
 See: {PY}tutorial/datastructures.html""",
 
     "datastructures.md": f"""\
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_generationjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="progress_json",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_generationjob_progress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="content_version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:57
+
+from django.db import migrations, models
+
+
+def fill_summary(apps, schema_editor):
+    # в исторической модели нет Lesson.summary_from — считаем так же, вручную
+    Lesson = apps.get_model("api", "Lesson")
+    batch = []
+    for lesson in Lesson.objects.only("id", "content_json").iterator(chunk_size=500):
+        content = lesson.content_json if isinstance(lesson.content_json, dict) else {}
+        reading = content.get("reading_time_min")
+        quiz = content.get("quiz")
+        lesson.reading_time_min = (
+            reading if isinstance(reading, int) and 0 <= reading < 32768 else None
+        )
+        lesson.quiz_count = min(len(quiz), 32767) if isinstance(quiz, list) else 0
+        batch.append(lesson)
+        if len(batch) >= 500:
+            Lesson.objects.bulk_update(batch, ["reading_time_min", "quiz_count"])
+            batch = []
+    if batch:
+        Lesson.objects.bulk_update(batch, ["reading_time_min", "quiz_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_course_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lesson",
+            name="quiz_count",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="lesson",
+            name="reading_time_min",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
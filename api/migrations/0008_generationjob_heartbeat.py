@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_lesson_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="claim",
+            field=models.CharField(blank=True, default="", max_length=32),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
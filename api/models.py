@@ -1,4 +1,8 @@
+import uuid
+
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -13,6 +17,31 @@ class Course(models.Model):
     capstone = models.TextField()
     references_json = models.JSONField(default=list)          # [{title,url,license}]
     created_at = models.DateTimeField(auto_now_add=True)
+    # растёт при каждом изменении содержимого курса; ключ кэша экспорта и ETag
+    content_version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        # каталог: новые первыми (keyset по created_at, id), в т.ч. с фильтром по уровню/владельцу
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="course_created_idx"),
+            models.Index(fields=["level", "-created_at", "-id"], name="course_level_created_idx"),
+            models.Index(fields=["owner", "-created_at", "-id"], name="course_owner_created_idx"),
+        ]
+
+    @classmethod
+    def bump_content_version(cls, course_id: int):
+        cls.objects.filter(id=course_id).update(content_version=models.F("content_version") + 1)
+
+    def save(self, *args, **kwargs):
+        # любое изменение полей курса (в т.ч. из админки) — новая версия для экспорта
+        bump = not self._state.adding
+        if bump:
+            self.content_version = models.F("content_version") + 1
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "content_version"}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=["content_version"])
 
 class Module(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="modules")
@@ -35,7 +64,95 @@ class Lesson(models.Model):
     order = models.PositiveSmallIntegerField()
     title = models.CharField(max_length=200)
     content_json = models.JSONField(default=dict)  # весь структурный контент урока
+    # выжимка из content_json для списков — чтобы не тянуть и не разбирать весь JSON
+    reading_time_min = models.PositiveSmallIntegerField(null=True, blank=True)
+    quiz_count = models.PositiveSmallIntegerField(default=0)
 
     class Meta:
         ordering = ["order"]
         unique_together = [("module", "order")]
+
+    @staticmethod
+    def summary_from(content) -> dict:
+        """Поля выжимки по content_json; content_json из add_lesson не валидируется, поэтому осторожно."""
+        content = content if isinstance(content, dict) else {}
+        reading = content.get("reading_time_min")
+        quiz = content.get("quiz")
+        return {
+            "reading_time_min": reading if isinstance(reading, int) and 0 <= reading < 32768 else None,
+            "quiz_count": min(len(quiz), 32767) if isinstance(quiz, list) else 0,
+        }
+
+    def save(self, *args, **kwargs):
+        for field, value in self.summary_from(self.content_json).items():
+            setattr(self, field, value)
+        if kwargs.get("update_fields") is not None and "content_json" in kwargs["update_fields"]:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "reading_time_min", "quiz_count"}
+        super().save(*args, **kwargs)
+
+
+class GenerationJob(models.Model):
+    """Фоновая генерация (blueprint/урок); состояние в БД, поэтому переживает рестарт."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20)                    # blueprint | lesson | course
+    status = models.CharField(max_length=10, default=QUEUED)
+    payload_json = models.JSONField(default=dict)             # вход эндпоинта как есть
+    result_json = models.JSONField(null=True, blank=True)
+    progress_json = models.JSONField(null=True, blank=True)   # для долгих заданий (курс целиком)
+    error = models.TextField(blank=True, default="")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # обновляет воркер, пока задание выполняется; по нему requeue_stale отличает брошенные
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # метка захвата: результат записывает только тот, кто задание забрал последним
+    claim = models.CharField(max_length=32, blank=True, default="")
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+
+# Модули и уроки меняют содержимое курса: версию поднимаем на любом save/delete,
+# откуда бы он ни пришёл (view, админка, каскад). bulk_create/update сигналов не шлют —
+# там bump_content_version вызывается явно (importer).
+def _deleted_with(origin, *models_) -> bool:
+    """delete() начался с одной из моделей models_ (объект или QuerySet) — т.е. это каскад."""
+    model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    return model in models_
+
+
+@receiver(post_save, sender=Module)
+def _module_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Course.bump_content_version(instance.course_id)
+
+
+@receiver(post_delete, sender=Module)
+def _module_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Course):
+        Course.bump_content_version(instance.course_id)
+
+
+def _bump_lesson_course(lesson: Lesson):
+    Course.objects.filter(modules=lesson.module_id).update(content_version=models.F("content_version") + 1)
+
+
+@receiver(post_save, sender=Lesson)
+def _lesson_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _bump_lesson_course(instance)
+
+
+@receiver(post_delete, sender=Lesson)
+def _lesson_deleted(sender, instance, origin=None, **kwargs):
+    # при удалении модуля или курса версию поднимет (или уже не нужно поднимать) он сам
+    if not _deleted_with(origin, Course, Module):
+        _bump_lesson_course(instance)
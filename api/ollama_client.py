@@ -1,26 +1,411 @@
 import os
 import re
 import json
+import time
+import asyncio
+import threading
+import weakref
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+# модель эмбеддингов для плотного поиска в RAG (ingest_rag --embed)
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "180"))
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_BACKOFF = float(os.getenv("OLLAMA_BACKOFF", "0.5"))
+# асинхронным view незачем держать поток на запрос, соединений может быть намного больше
+OLLAMA_ASYNC_POOL_SIZE = int(os.getenv("OLLAMA_ASYNC_POOL_SIZE", "100"))
+# эмбеддинг поискового запроса: без него поиск просто остаётся на BM25, поэтому ждём недолго
+OLLAMA_QUERY_EMBED_TIMEOUT = float(os.getenv("OLLAMA_QUERY_EMBED_TIMEOUT", "2"))
+# после ошибки эмбеддера столько секунд поиск его не вызывает
+OLLAMA_QUERY_EMBED_COOLDOWN = float(os.getenv("OLLAMA_QUERY_EMBED_COOLDOWN", "30"))
+
+
+class _CallStats:
+    """Счётчики вызовов: латентность, повторы, трафик — общие для sync и async клиента."""
+
+    def _init_stats(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency_ms = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.last_call: dict | None = None
+
+    def _record(self, path: str, started: float, attempts: int, sent: int, received: int, ok: bool):
+        latency_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.calls += 1
+            self.errors += 0 if ok else 1
+            self.retries += attempts - 1
+            self.total_latency_ms += latency_ms
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.last_call = {
+                "path": path,
+                "latency_ms": latency_ms,
+                "attempts": attempts,
+                "bytes_sent": sent,
+                "bytes_received": received,
+                "ok": ok,
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "avg_latency_ms": self.total_latency_ms / self.calls if self.calls else None,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "last_call": self.last_call,
+            }
+
+
+class OllamaClient(_CallStats):
+    """
+    Клиент Ollama с пулом keep-alive соединений (requests.Session).
+
+    Ошибки соединения и 5xx повторяются до max_retries раз с экспоненциальной
+    паузой backoff * 2**попытка; таймаут чтения не повторяем — генерация могла
+    идти минуты. По каждому вызову копится латентность и объём трафика (stats()).
+    """
+
+    def __init__(
+        self,
+        host: str = OLLAMA_HOST,
+        model: str = OLLAMA_MODEL,
+        pool_size: int = OLLAMA_POOL_SIZE,
+        connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+        read_timeout: float = OLLAMA_READ_TIMEOUT,
+        max_retries: int = OLLAMA_MAX_RETRIES,
+        backoff: float = OLLAMA_BACKOFF,
+    ):
+        self.host = host.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._init_stats()
+
+    def post(self, path: str, payload: dict) -> dict:
+        """POST на {host}{path} с повторами; возвращает JSON ответа."""
+        body = json.dumps(payload).encode("utf-8")
+        started = time.perf_counter()
+        attempts = 0
+        received = 0
+        try:
+            while True:
+                attempts += 1
+                try:
+                    r = self.session.post(
+                        self.host + path,
+                        data=body,
+                        headers={"Content-Type": "application/json"},
+                        timeout=self.timeout,
+                    )
+                except requests.ConnectionError:
+                    if attempts > self.max_retries:
+                        raise
+                else:
+                    received += len(r.content)
+                    if r.status_code < 500 or attempts > self.max_retries:
+                        r.raise_for_status()
+                        data = r.json()
+                        self._record(path, started, attempts, len(body) * attempts, received, True)
+                        return data
+                time.sleep(self.backoff * 2 ** (attempts - 1))
+        except Exception:
+            self._record(path, started, attempts, len(body) * attempts, received, False)
+            raise
+
+    def generate(self, prompt: str, model: str | None = None, temperature: float = 0.2) -> str:
+        """Вызывает /api/generate и возвращает raw-текст ответа модели."""
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": False,
+            "options": {"temperature": temperature, "num_ctx": 8192},
+        }
+        return self.post("/api/generate", payload).get("response", "")
+
+    def embed(self, texts: list, model: str | None = None) -> list:
+        """/api/embed: по вектору на каждый текст, в том же порядке."""
+        data = self.post("/api/embed", {"model": model or OLLAMA_EMBED_MODEL, "input": list(texts)})
+        return data.get("embeddings", [])
+
+    def generate_stream(self, prompt: str, model: str | None = None, temperature: float = 0.2):
+        """
+        /api/generate в режиме stream: отдаёт куски текста по мере генерации.
+        Повторы — как в post(), но только до первого полученного байта.
+        """
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": True,
+            "options": {"temperature": temperature, "num_ctx": 8192},
+        }
+        body = json.dumps(payload).encode("utf-8")
+        path = "/api/generate"
+        started = time.perf_counter()
+        attempts = 0
+        received = 0
+        ok = False
+        try:
+            while True:
+                attempts += 1
+                try:
+                    r = self.session.post(
+                        self.host + path,
+                        data=body,
+                        headers={"Content-Type": "application/json"},
+                        timeout=self.timeout,
+                        stream=True,
+                    )
+                except requests.ConnectionError:
+                    if attempts > self.max_retries:
+                        raise
+                else:
+                    if r.status_code < 500 or attempts > self.max_retries:
+                        break
+                    r.close()
+                time.sleep(self.backoff * 2 ** (attempts - 1))
+
+            with r:
+                r.raise_for_status()
+                for line in r.iter_lines():
+                    if not line:
+                        continue
+                    received += len(line) + 1
+                    data = json.loads(line)
+                    if data.get("error"):
+                        raise RuntimeError(f"ollama: {data['error']}")
+                    if data.get("response"):
+                        yield data["response"]
+                    if data.get("done"):
+                        break
+            ok = True
+        finally:
+            self._record(path, started, attempts, len(body) * attempts, received, ok)
+
+
+class OllamaHTTPError(RuntimeError):
+    """Ответ Ollama с кодом >= 400 (аналог requests.HTTPError для async-клиента)."""
+
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"ollama HTTP {status}: {body[:200].decode('utf-8', 'replace')}")
+        self.status = status
+
+
+class AsyncOllamaClient(_CallStats):
+    """
+    То же, что OllamaClient, но на httpx.AsyncClient: ожидание ответа модели
+    не занимает поток, один ASGI-воркер держит сотни генераций одновременно.
+    Политика повторов та же: соединение и 5xx — да, таймаут чтения — нет.
+
+    Пул httpcore тратит CPU пропорционально (запросы x соединения) на каждый ответ;
+    одновременных вызовов модели немного — их ограничивает admission (OLLAMA_MAX_INFLIGHT).
+    """
+
+    def __init__(
+        self,
+        host: str = OLLAMA_HOST,
+        model: str = OLLAMA_MODEL,
+        pool_size: int = OLLAMA_ASYNC_POOL_SIZE,
+        connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+        read_timeout: float = OLLAMA_READ_TIMEOUT,
+        max_retries: int = OLLAMA_MAX_RETRIES,
+        backoff: float = OLLAMA_BACKOFF,
+    ):
+        self.host = host.rstrip("/")
+        self.model = model
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # pool=None: сверх pool_size запросы ждут соединения, а не падают
+        self.http = httpx.AsyncClient(
+            base_url=self.host,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self._init_stats()
+
+    async def post(self, path: str, payload: dict) -> dict:
+        body = json.dumps(payload).encode("utf-8")
+        started = time.perf_counter()
+        attempts = 0
+        received = 0
+        try:
+            while True:
+                attempts += 1
+                try:
+                    r = await self.http.post(path, content=body, headers={"Content-Type": "application/json"})
+                except httpx.ReadTimeout as e:
+                    raise TimeoutError(f"ollama read timeout after {self.read_timeout}s") from e
+                except httpx.TransportError:
+                    # соединение не установилось или закрыто сервером; httpx уже выкинул его из пула
+                    if attempts > self.max_retries:
+                        raise
+                else:
+                    received += len(r.content)
+                    if r.status_code < 500 or attempts > self.max_retries:
+                        if r.status_code >= 400:
+                            raise OllamaHTTPError(r.status_code, r.content)
+                        result = r.json()
+                        self._record(path, started, attempts, len(body) * attempts, received, True)
+                        return result
+                await asyncio.sleep(self.backoff * 2 ** (attempts - 1))
+        except Exception:
+            self._record(path, started, attempts, len(body) * attempts, received, False)
+            raise
+
+    async def generate(self, prompt: str, model: str | None = None, temperature: float = 0.2) -> str:
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": False,
+            "options": {"temperature": temperature, "num_ctx": 8192},
+        }
+        return (await self.post("/api/generate", payload)).get("response", "")
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+_client: OllamaClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OllamaClient:
+    """Общий на процесс клиент — чтобы соединения из пула переиспользовались между запросами."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
+
+
+# соединения asyncio привязаны к event loop: под ASGI loop один, а async view под WSGI
+# выполняется в asyncio.run на каждый запрос — поэтому клиент на loop, а не на процесс
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOllamaClient]" = weakref.WeakKeyDictionary()
+# loop держит на задачи только слабые ссылки — без этого сборщик мусора закроет клиент посреди запроса
+_closers: set = set()
+
+
+async def _close_with_loop(loop: asyncio.AbstractEventLoop, client: AsyncOllamaClient):
+    """
+    Ждёт, пока loop не начнут останавливать: asyncio.run (и async_to_sync под WSGI)
+    отменяет оставшиеся задачи до закрытия loop — тогда закрываем соединения клиента.
+    Под ASGI loop живёт весь процесс, и задача просто висит.
+    """
+    try:
+        await loop.create_future()
+    finally:
+        if _async_clients.get(loop) is client:
+            del _async_clients[loop]
+        await client.aclose()
+
+
+def get_async_client() -> AsyncOllamaClient:
+    """Асинхронный клиент текущего event loop; адрес и модель — как у get_client()."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    sync = get_client()
+    if client is None or client.host != sync.host:
+        client = AsyncOllamaClient(host=sync.host, model=sync.model)
+        _async_clients[loop] = client
+        task = loop.create_task(_close_with_loop(loop, client))
+        _closers.add(task)
+        task.add_done_callback(_closers.discard)
+    return client
+
+
+async def acall_ollama(prompt: str, model: str | None = None, temperature: float = 0.2) -> str:
+    """Асинхронный call_ollama."""
+    return await get_async_client().generate(prompt, model=model, temperature=temperature)
+
+
+class OllamaEmbedder:
+    """Эмбеддер для rag.py: атрибут model и вызов embedder(texts) -> векторы."""
+
+    def __init__(self, model: str = OLLAMA_EMBED_MODEL, client: OllamaClient | None = None):
+        self.model = model
+        self.client = client
+
+    def __call__(self, texts: list) -> list:
+        return (self.client or get_client()).embed(texts, model=self.model)
+
+
+class _Breaker:
+    """Размыкается на cooldown секунд после ошибки — недоступная Ollama не тормозит каждый поиск."""
+
+    def __init__(self, cooldown: float = OLLAMA_QUERY_EMBED_COOLDOWN):
+        self.cooldown = cooldown
+        self.open_until = 0.0
+
+    def allow(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def trip(self):
+        self.open_until = time.monotonic() + self.cooldown
+
+    def reset(self):
+        self.open_until = 0.0
+
+
+_query_client: OllamaClient | None = None
+_query_breaker = _Breaker()
+
+
+def get_query_client() -> OllamaClient:
+    """Клиент для эмбеддингов запросов: короткий таймаут чтения и без повторов; адрес — как у get_client()."""
+    global _query_client
+    sync = get_client()
+    client = _query_client
+    if client is None or client.host != sync.host:
+        with _client_lock:
+            client = _query_client
+            if client is None or client.host != sync.host:
+                client = _query_client = OllamaClient(
+                    host=sync.host, read_timeout=OLLAMA_QUERY_EMBED_TIMEOUT, max_retries=0,
+                )
+    return client
+
+
+def embed_queries(texts: list, model: str) -> list | None:
+    """
+    Векторы поисковых запросов или None, если Ollama не ответила: тогда вызывающий
+    остаётся на BM25, а следующие OLLAMA_QUERY_EMBED_COOLDOWN секунд эмбеддер не вызывается.
+    """
+    if not _query_breaker.allow():
+        return None
+    try:
+        vecs = get_query_client().embed(texts, model=model)
+    except Exception:
+        _query_breaker.trip()
+        return None
+    _query_breaker.reset()
+    return vecs
+
 
 def call_ollama(prompt: str, model: str | None = None, temperature: float = 0.2) -> str:
     """
     Вызывает локальный Ollama /api/generate и возвращает raw-текст ответа модели.
     """
-    url = f"{OLLAMA_HOST}/api/generate"
-    payload = {
-        "model": model or OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": False,
-        "options": {"temperature": temperature, "num_ctx": 8192},
-    }
-    r = requests.post(url, json=payload, timeout=180)
-    r.raise_for_status()
-    data = r.json()
-    return data.get("response", "")
+    return get_client().generate(prompt, model=model, temperature=temperature)
 
 def parse_json_loose(text: str) -> dict:
     """
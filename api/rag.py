@@ -1,81 +1,1092 @@
 import os
 import re
-import pickle
+import json
+import math
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from rank_bm25 import BM25Okapi
+import numpy as np
+from .fileutil import publish_tmp
 
 # Простая токенизация без внешних загрузок
 WORD_RE = re.compile(r"[A-Za-zА-Яа-я0-9_]+")
+# то же по тексту, уже приведённому к нижнему регистру
+_LOWER_WORD_RE = re.compile(r"[a-zа-я0-9_]+")
+# единственные символы вне WORD_RE, чей lower() в него попадает: İ -> i̇ и знак Кельвина -> k
+_LOWER_INTO_WORD = ("\u0130", "\u212a")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n|^# .*$", re.MULTILINE)
 
 def tokenize(text: str) -> List[str]:
-    return [w.lower() for w in WORD_RE.findall(text or "")]
+    # один lower() на весь текст вместо lower() на каждое слово; токены те же
+    text = text or ""
+    if any(c in text for c in _LOWER_INTO_WORD):
+        return [w.lower() for w in WORD_RE.findall(text)]
+    return _LOWER_WORD_RE.findall(text.lower())
 
 def split_passages(text: str, max_chars: int = 800) -> List[str]:
     # грубый сплит по заголовкам/пустым строкам, потом нарезка блоков
-    parts = re.split(r"\n\s*\n|^# .*$", text, flags=re.MULTILINE)
     out = []
-    buf = ""
-    for p in parts:
+    buf: List[str] = []
+    size = 0  # len("\n".join(buf))
+    for p in _PARAGRAPH_RE.split(text):
         p = p.strip()
         if not p:
             continue
-        if len(buf) + len(p) + 1 <= max_chars:
-            buf = (buf + "\n" + p).strip()
+        if size + len(p) + 1 <= max_chars:
+            size += len(p) + (1 if buf else 0)
+            buf.append(p)
         else:
             if buf:
-                out.append(buf)
-            buf = p
+                out.append("\n".join(buf))
+            buf = [p]
+            size = len(p)
     if buf:
-        out.append(buf)
+        out.append("\n".join(buf))
     return out
 
+
+# ── анализатор ──
+# по умолчанию токены индекса — ровно tokenize; стоп-слова и стемминг включаются явно
+RAG_STOPWORDS = os.getenv("RAG_STOPWORDS", "0") == "1"
+# язык Snowball-стеммера nltk ("english", "russian", ...); пусто — без стемминга
+RAG_STEMMER = os.getenv("RAG_STEMMER", "")
+# сколько форм слова Analyzer помнит вместе с их основами
+STEM_CACHE_SIZE = 200_000
+
+# свой короткий список: стоп-слова nltk требуют отдельной загрузки корпуса
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have if in into is it its of on or that the their then there
+these this to was were will with
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было
+вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас
+нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их
+чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при
+наконец два об другой хоть после над больше тот через эти нас про всего них какая много разве три
+эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно
+всю между это
+""".split())
+
+
+class Analyzer:
+    """
+    tokenize, а затем (по настройке) без стоп-слов и со стеммингом Snowball из nltk.
+    Настройка пишется в заголовок индекса: запросы разбираются тем же анализатором,
+    что и пассажи, иначе "loops" в запросе не найдёт "loop" в индексе.
+    """
+
+    def __init__(self, stopwords: bool = False, stemmer: Optional[str] = None):
+        self.stopwords = bool(stopwords)
+        self.stemmer = stemmer or None
+        self._stem = None
+        if self.stemmer:
+            try:
+                from nltk.stem.snowball import SnowballStemmer
+            except ImportError as e:
+                raise ImportError("RAG stemming needs nltk (see requirements.txt)") from e
+            self._stem = SnowballStemmer(self.stemmer).stem
+        # стемминг дорогой, а различных слов в корпусе немного — основу каждого считаем один раз
+        self._stems: Dict[str, str] = {}
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "Analyzer":
+        config = config or {}
+        key = (bool(config.get("stopwords")), config.get("stemmer") or None)
+        analyzer = _ANALYZERS.get(key)
+        if analyzer is None:
+            analyzer = _ANALYZERS.setdefault(key, cls(*key))
+        return analyzer
+
+    @classmethod
+    def from_env(cls) -> "Analyzer":
+        return cls.from_config({"stopwords": RAG_STOPWORDS, "stemmer": RAG_STEMMER})
+
+    def config(self) -> dict:
+        return {"stopwords": self.stopwords, "stemmer": self.stemmer}
+
+    def __eq__(self, other):
+        return isinstance(other, Analyzer) and self.config() == other.config()
+
+    def __hash__(self):
+        return hash((self.stopwords, self.stemmer))
+
+    def __reduce__(self):
+        # в процессы пула уходит только настройка, не кэш основ
+        return (Analyzer.from_config, (self.config(),))
+
+    def __repr__(self):
+        return f"Analyzer(stopwords={self.stopwords}, stemmer={self.stemmer!r})"
+
+    def tokenize(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        if self.stopwords:
+            tokens = [t for t in tokens if t not in STOPWORDS]
+        if self._stem is not None:
+            stems = self._stems
+            if len(stems) > STEM_CACHE_SIZE:
+                stems.clear()
+            out = []
+            for t in tokens:
+                s = stems.get(t)
+                if s is None:
+                    s = stems[t] = self._stem(t)
+                out.append(s)
+            tokens = out
+        return tokens
+
+    def token_ids(self, text: str, vocab: Dict[str, int]) -> List[int]:
+        """Токены сразу id словаря vocab; новые термины дописываются в конец."""
+        setdefault = vocab.setdefault
+        return [setdefault(t, len(vocab)) for t in self.tokenize(text)]
+
+
+_ANALYZERS: Dict[Tuple[bool, Optional[str]], Analyzer] = {}
+DEFAULT_ANALYZER = Analyzer.from_config(None)
+
+FORMAT_MAGIC = b"CGBM25IX"
+FORMAT_VERSION = 1
+_ALIGN = 64
+
+
+class IndexFormatError(ValueError):
+    """Файл индекса не того формата или версии — его нужно пересобрать через ingest_rag."""
+
+
+class PassageStore(Sequence):
+    """
+    Пассажи, лежащие в индексе одним UTF-8 блобом + смещениями.
+    Строка декодируется только при обращении, поэтому загрузка не зависит от размера корпуса.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return max(len(self.offsets) - 1, 0)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("passage index out of range")
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+
+def _encode_passages(passages: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    if isinstance(passages, PassageStore):
+        return passages.blob, passages.offsets
+    encoded = [p.encode("utf-8") for p in passages]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def file_passages(path: str, text: str) -> List[str]:
+    # сохраняем легкий префикс источника
+    head = f"[{os.path.basename(path)}]\n"
+    return [head + pas for pas in split_passages(text)]
+
+
+def _analyze_passages(passages: Sequence[str], analyzer: Analyzer = DEFAULT_ANALYZER) -> dict:
+    """
+    Токенизация пассажей одного файла в компактные массивы.
+    Термины нумеруются локально (terms — в порядке первого появления), глобальные id
+    назначает тот, кто собирает индекс; так результат дёшево передаётся между процессами.
+    """
+    local: Dict[str, int] = {}
+    ids: List[int] = []
+    doc_len: List[int] = []
+    for pas in passages:
+        tokens = analyzer.token_ids(pas, local)
+        ids.extend(tokens)
+        doc_len.append(len(tokens))
+    # tf: пары (документ, термин) одним np.unique вместо Counter на каждый пассаж
+    docs = np.repeat(np.arange(len(doc_len), dtype=np.int64), doc_len)
+    pairs, tf = np.unique(docs * max(len(local), 1) + np.asarray(ids, dtype=np.int64), return_counts=True)
+    doc_local, term_local = np.divmod(pairs, max(len(local), 1))
+    encoded = [p.encode("utf-8") for p in passages]
+    return {
+        "terms": list(local),
+        "term_local": term_local,
+        "doc_local": doc_local,
+        "tf": tf.astype(np.int32),
+        "doc_len": np.asarray(doc_len, dtype=np.int32),
+        "blob": b"".join(encoded),
+        "text_lens": np.asarray([len(e) for e in encoded], dtype=np.int64),
+    }
+
+
+def _analyze_file(task: Tuple[str, Optional[str], Analyzer]) -> Optional[dict]:
+    """Задача для пула: прочитать файл, посчитать sha256 и, если он изменился, разобрать."""
+    path, known_sha, analyzer = task
+    try:
+        raw = Path(path).read_bytes()
+    except OSError:
+        return None
+    sha = hashlib.sha256(raw).hexdigest()
+    if sha == known_sha:
+        return {"sha256": sha}
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    out = _analyze_passages(file_passages(path, text), analyzer)
+    out["sha256"] = sha
+    return out
+
+
+def _iter_analyzed(tasks: Iterable[Tuple[str, Optional[str], Analyzer]], workers: int) -> Iterator[Optional[dict]]:
+    """
+    Результаты _analyze_file в порядке задач. В пуле одновременно не больше 2*workers
+    файлов, так что память не зависит от размера корпуса.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield _analyze_file(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window: deque = deque()
+        for task in tasks:
+            window.append(pool.submit(_analyze_file, task))
+            if len(window) >= 2 * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+# ── плотный поиск ──
+# сколько пассажей отправлять в эмбеддер за раз
+EMBED_BATCH = 32
+# сглаживающая константа RRF, как в исходной статье (Cormack et al., 2009)
+RRF_K = 60
+# сколько лучших из каждого списка (BM25, косинус) участвуют в слиянии
+HYBRID_CANDIDATES = 50
+# search_many: сколько постингов (или оценок плотного поиска) разворачивать за раз
+SEARCH_MANY_CHUNK = 1 << 22
+
+
+def _normalize_rows(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def embed_passages(index: "BM25Index", embedder, reuse: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                   batch_size: int = EMBED_BATCH) -> Tuple[int, int]:
+    """
+    Заполняет index.embeddings. embedder — объект с атрибутом model и вызовом
+    embedder(texts) -> векторы (см. ollama_client.OllamaEmbedder).
+    reuse = (старые эмбеддинги, старый id пассажа -> новый или -1): эти строки копируются,
+    в эмбеддер уходят только остальные пассажи. Возвращает (посчитано, переиспользовано).
+    """
+    n = len(index.passages)
+    todo = np.ones(n, dtype=bool)
+    emb = None
+    reused = 0
+    if reuse is not None:
+        old, mapping = reuse
+        keep = np.flatnonzero(mapping >= 0)
+        if len(keep):
+            emb = np.zeros((n, old.shape[1]), dtype=np.float32)
+            emb[mapping[keep]] = old[keep]
+            todo[mapping[keep]] = False
+            reused = len(keep)
+    rows = np.flatnonzero(todo)
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start:start + batch_size]
+        vecs = _normalize_rows(embedder([index.passages[i] for i in chunk]))
+        if vecs.ndim != 2 or len(vecs) != len(chunk):
+            raise ValueError(f"embedder returned {vecs.shape} for {len(chunk)} passages")
+        if emb is None:
+            emb = np.zeros((n, vecs.shape[1]), dtype=np.float32)
+        emb[chunk] = vecs
+    index.embeddings = emb if emb is not None else np.zeros((n, 0), dtype=np.float32)
+    index.embed_model = embedder.model
+    return len(rows), reused
+
+
+def _read_array(filepath: Path, spec: dict, mmap: bool) -> np.ndarray:
+    dtype = np.dtype(spec["dtype"])
+    shape = tuple(spec["shape"])
+    count = int(np.prod(shape)) if shape else 1
+    if count == 0:
+        return np.empty(shape, dtype=dtype)
+    if mmap:
+        return np.memmap(filepath, dtype=dtype, mode="r", offset=spec["offset"], shape=shape)
+    return np.fromfile(filepath, dtype=dtype, count=count, offset=spec["offset"]).reshape(shape)
+
+
 class BM25Index:
+    """
+    BM25 (Okapi) с заранее посчитанной статистикой.
+
+    На диске лежат словарь, вектор IDF, длины документов и постинги (CSR по терминам),
+    поэтому load — это чтение заголовка и memmap массивов, без пересчёта.
+    Параметры и формулы совпадают с rank_bm25.BM25Okapi, оценки те же.
+    """
+
+    k1 = 1.5
+    b = 0.75
+    epsilon = 0.25
+
     def __init__(self):
-        self.passages: List[str] = []
-        self.tokenized: List[List[str]] = []
-        self.bm25 = None
+        self.passages: Sequence[str] = []
+        self.vocab: Dict[str, int] = {}
+        self.idf = np.zeros(0, dtype=np.float64)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.avgdl = 0.0
+        # постинги термина t: post_docs/post_tf[post_offsets[t]:post_offsets[t + 1]]
+        self.post_offsets = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_tf = np.zeros(0, dtype=np.int32)
+        self._norm = np.zeros(0, dtype=np.float64)
+        # манифест исходных файлов: path (относительно корня), size, mtime_ns, sha256,
+        # passages = [start, end) — пассажи файла лежат подряд
+        self.files: List[dict] = []
+        # плотный этап (опционально): нормированные float32-векторы пассажей, строка = id пассажа
+        self.embeddings: Optional[np.ndarray] = None
+        self.embed_model: Optional[str] = None
+        # чем разобраны пассажи — тем же разбираются запросы
+        self.analyzer = DEFAULT_ANALYZER
+        # id сборки: меняется при каждой пересборке, хранится в файле — ключ для SearchCache
+        self.version = uuid.uuid4().hex
 
-    def build(self, docs: List[Tuple[str, str]]):
-        # docs: list of (path, content). Мы разворачиваем в пассажи
+    def build(self, docs: Iterable[Tuple[str, str]], embedder=None, analyzer: Optional[Analyzer] = None):
+        # docs: iterable of (path, content). Мы разворачиваем в пассажи
         passages = []
         for path, txt in docs:
-            for pas in split_passages(txt):
-                # сохраняем легкий префикс источника
-                head = f"[{os.path.basename(path)}]\n"
-                passages.append(head + pas)
+            passages.extend(file_passages(path, txt))
+
+        if analyzer is not None:
+            self.analyzer = analyzer
+        a = _analyze_passages(passages, self.analyzer)
         self.passages = passages
-        self.tokenized = [tokenize(p) for p in passages]
-        self.bm25 = BM25Okapi(self.tokenized)
+        self.files = []
+        self._set_postings(
+            {t: i for i, t in enumerate(a["terms"])},
+            a["doc_len"], a["term_local"], a["doc_local"].astype(np.int32), a["tf"],
+        )
+        self.embeddings = self.embed_model = None
+        if embedder is not None:
+            embed_passages(self, embedder)
+
+    def _set_postings(self, vocab, doc_len, term_ids, doc_ids, tfs):
+        """Раскладывает тройки (термин, документ, tf) в CSR и считает IDF как BM25Okapi."""
+        n_terms = len(vocab)
+        n_docs = len(doc_len)
+        order = np.lexsort((doc_ids, term_ids))
+        df = np.bincount(term_ids, minlength=n_terms)
+        offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+
+        # math.log и порядок суммирования как в rank_bm25 — чтобы IDF совпадал бит в бит
+        idf = np.empty(n_terms, dtype=np.float64)
+        idf_sum = 0.0
+        negative = []
+        for t, freq in enumerate(df.tolist()):
+            v = math.log(n_docs - freq + 0.5) - math.log(freq + 0.5)
+            idf[t] = v
+            idf_sum += v
+            if v < 0:
+                negative.append(t)
+        if n_terms:
+            idf[negative] = self.epsilon * (idf_sum / n_terms)
+
+        self.vocab = vocab
+        self.idf = idf
+        self.doc_len = doc_len
+        self.avgdl = float(doc_len.sum()) / n_docs if n_docs else 0.0
+        self.post_offsets = offsets
+        self.post_docs = doc_ids[order]
+        self.post_tf = tfs[order]
+        self.version = uuid.uuid4().hex
+        self._update_norm()
+
+    def _update_norm(self):
+        if self.avgdl:
+            self._norm = self.k1 * (1 - self.b + self.b * self.doc_len.astype(np.float64) / self.avgdl)
+        else:
+            self._norm = np.zeros(len(self.doc_len), dtype=np.float64)
 
     def save(self, filepath: Path):
-        with open(filepath, "wb") as f:
-            pickle.dump(
-                {"passages": self.passages, "tokenized": self.tokenized},
-                f,
-                protocol=pickle.HIGHEST_PROTOCOL,
-            )
-
-    def load(self, filepath: Path):
+        """
+        Формат файла:
+          MAGIC | uint32 версия | массивы (выровнены по 64 байта) | JSON-заголовок | uint64 offset, uint64 len, MAGIC
+        """
+        blob, text_offsets = _encode_passages(self.passages)
+        arrays = {
+            "idf": self.idf,
+            "doc_len": self.doc_len,
+            "post_offsets": self.post_offsets,
+            "post_docs": self.post_docs,
+            "post_tf": self.post_tf,
+            "text_offsets": text_offsets,
+            "text_blob": blob,
+        }
+        if self.embeddings is not None:
+            arrays["embeddings"] = np.asarray(self.embeddings, dtype=np.float32)
+        # пишем во временный файл рядом и атомарно подменяем,
+        # чтобы работающие процессы никогда не увидели недописанный индекс
+        filepath = Path(filepath)
+        fd, tmp = tempfile.mkstemp(dir=filepath.parent, prefix=filepath.name + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(FORMAT_MAGIC)
+                f.write(struct.pack("<I", FORMAT_VERSION))
+                layout = {}
+                for name, arr in arrays.items():
+                    arr = np.ascontiguousarray(arr)
+                    f.write(b"\0" * (-f.tell() % _ALIGN))
+                    layout[name] = {"dtype": arr.dtype.str, "offset": f.tell(), "shape": list(arr.shape)}
+                    f.write(memoryview(arr).cast("B"))
+                header = {
+                    "format_version": FORMAT_VERSION,
+                    "version": self.version,
+                    "params": {"k1": self.k1, "b": self.b, "epsilon": self.epsilon},
+                    "n_docs": len(self.doc_len),
+                    "avgdl": self.avgdl,
+                    "vocab": list(self.vocab),
+                    "analyzer": self.analyzer.config(),
+                    "files": self.files,
+                    "dense": (
+                        {"model": self.embed_model, "dim": int(self.embeddings.shape[1])}
+                        if self.embeddings is not None else None
+                    ),
+                    "arrays": layout,
+                }
+                raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+                header_offset = f.tell()
+                f.write(raw)
+                f.write(struct.pack("<QQ", header_offset, len(raw)))
+                f.write(FORMAT_MAGIC)
+            publish_tmp(tmp, filepath)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def load(self, filepath: Path, mmap: Optional[bool] = None):
+        """
+        Читает заголовок и отображает массивы в память (mmap=True).
+        На Windows по умолчанию читаем в память: там os.replace не может
+        заменить файл, пока он отображён в другом процессе.
+        """
+        filepath = Path(filepath)
+        if mmap is None:
+            mmap = os.name != "nt"
         with open(filepath, "rb") as f:
-            data = pickle.load(f)
-        self.passages = data["passages"]
-        self.tokenized = data["tokenized"]
-        self.bm25 = BM25Okapi(self.tokenized)
+            head = f.read(12)
+            if len(head) < 12 or head[:8] != FORMAT_MAGIC:
+                raise IndexFormatError(f"{filepath}: not a BM25 index file, rebuild it with ingest_rag")
+            (version,) = struct.unpack("<I", head[8:])
+            if version != FORMAT_VERSION:
+                raise IndexFormatError(
+                    f"{filepath}: index format v{version}, expected v{FORMAT_VERSION}; rebuild it with ingest_rag"
+                )
+            f.seek(-24, os.SEEK_END)
+            trailer = f.read(24)
+            if trailer[16:] != FORMAT_MAGIC:
+                raise IndexFormatError(f"{filepath}: truncated index file, rebuild it with ingest_rag")
+            header_offset, header_len = struct.unpack("<QQ", trailer[:16])
+            f.seek(header_offset)
+            header = json.loads(f.read(header_len).decode("utf-8"))
 
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[str, float]]:
-        q_tokens = tokenize(query)
-        scores = self.bm25.get_scores(q_tokens)
-        idxs = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-        return [(self.passages[i], float(scores[i])) for i in idxs]
+        params = header["params"]
+        self.k1, self.b, self.epsilon = params["k1"], params["b"], params["epsilon"]
+        arrays = {name: _read_array(filepath, spec, mmap) for name, spec in header["arrays"].items()}
+        self.vocab = {t: i for i, t in enumerate(header["vocab"])}
+        self.avgdl = header["avgdl"]
+        self.files = header.get("files", [])
+        self.idf = arrays["idf"]
+        self.doc_len = arrays["doc_len"]
+        self.post_offsets = arrays["post_offsets"]
+        self.post_docs = arrays["post_docs"]
+        self.post_tf = arrays["post_tf"]
+        self.passages = PassageStore(arrays["text_blob"], arrays["text_offsets"])
+        # индексы без плотного этапа (в т.ч. собранные до него) просто не имеют этого массива
+        self.embeddings = arrays.get("embeddings")
+        self.embed_model = (header.get("dense") or {}).get("model")
+        self.analyzer = Analyzer.from_config(header.get("analyzer"))
+        # у файлов, сохранённых до появления version, — своя на каждую загрузку
+        self.version = header.get("version") or uuid.uuid4().hex
+        self._update_norm()
 
-def read_knowledge_dir(root: Path) -> List[Tuple[str, str]]:
-    docs = []
+    def _term_ids(self, q_tokens: List[str]) -> List[int]:
+        # повторы оставляем: BM25Okapi тоже суммирует вклад термина за каждое вхождение
+        return [t for t in (self.vocab.get(q) for q in q_tokens) if t is not None]
+
+    def score_candidates(self, q_tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Оценки только тех пассажей, где есть хотя бы один термин запроса.
+        Возвращает (отсортированные id документов, их оценки); у остальных оценка 0.
+        """
+        terms = self._term_ids(q_tokens)
+        if not terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        cand = np.unique(np.concatenate([
+            self.post_docs[self.post_offsets[t]:self.post_offsets[t + 1]] for t in set(terms)
+        ]))
+        scores = np.zeros(len(cand), dtype=np.float64)
+        for t in terms:
+            lo, hi = self.post_offsets[t], self.post_offsets[t + 1]
+            docs = self.post_docs[lo:hi]
+            tf = self.post_tf[lo:hi].astype(np.float64)
+            scores[np.searchsorted(cand, docs)] += self.idf[t] * (tf * (self.k1 + 1) / (tf + self._norm[docs]))
+        return cand, scores
+
+    def get_scores(self, q_tokens: List[str]) -> np.ndarray:
+        """BM25-оценки всех пассажей; то же, что BM25Okapi.get_scores."""
+        scores = np.zeros(len(self.doc_len), dtype=np.float64)
+        cand, cand_scores = self.score_candidates(q_tokens)
+        scores[cand] = cand_scores
+        return scores
+
+    def top_k(self, q_tokens: List[str], top_k: int = 5) -> List[Tuple[int, float]]:
+        cand, scores = self.score_candidates(q_tokens)
+        return _rank_top_k(cand, scores, len(self.doc_len), top_k)
+
+    def dense_top_k(self, query_vec, top_k: int = 5) -> List[Tuple[int, float]]:
+        """k пассажей с наибольшим косинусом к query_vec — одно умножение матрицы на вектор."""
+        if self.embeddings is None or not len(self.embeddings):
+            return []
+        q = _normalize_rows(np.asarray(query_vec, dtype=np.float32).reshape(1, -1))[0]
+        scores = self.embeddings @ q
+        return _top_by_score(np.arange(len(scores)), scores, min(top_k, len(scores)))
+
+    def hybrid_top_k(self, q_tokens: List[str], query_vec, top_k: int = 5,
+                     candidates: int = HYBRID_CANDIDATES, rrf_k: int = RRF_K) -> List[Tuple[int, float]]:
+        """
+        Слияние BM25 и плотного поиска по рангам (Reciprocal Rank Fusion):
+        оценка пассажа — сумма 1 / (rrf_k + ранг) по обоим спискам из candidates лучших.
+        Шкалы BM25 и косинуса несравнимы, ранги — сравнимы.
+        """
+        n = max(top_k, candidates)
+        cand, scores = self.score_candidates(q_tokens)
+        return _rrf(_top_by_score(cand, scores, n), self.dense_top_k(query_vec, n), top_k, rrf_k)
+
+    def score_candidates_many(self, token_lists: List[List[str]],
+                              chunk: int = SEARCH_MANY_CHUNK) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        score_candidates для многих запросов сразу, с теми же оценками бит в бит.
+
+        Вклад каждого термина (idf * tf-часть BM25 по его постингам) считается один раз
+        на пачку, даже если термин есть в сотне запросов. Дальше — разреженное произведение
+        (запрос x термин) x (термин x документ): пары (запрос, вхождение термина)
+        разворачиваются в постинги и суммируются по ключу (запрос, документ) одним bincount —
+        в том же порядке, что и в score_candidates. Запросы идут пачками, чтобы развёрнутых
+        постингов было не больше chunk. Массивы у одинаковых запросов общие — не менять.
+        """
+        # одинаковые запросы (у уроков одного модуля запрос общий) считаем один раз
+        slot_of: Dict[Tuple[int, ...], int] = {}
+        slots = [slot_of.setdefault(tuple(self._term_ids(tokens)), len(slot_of)) for tokens in token_lists]
+        term_lists = [list(terms) for terms in slot_of]
+        df = np.diff(self.post_offsets)
+        scored: List[Tuple[np.ndarray, np.ndarray]] = []
+        start = 0
+        size = 0
+        for q, terms in enumerate(term_lists):
+            size += int(df[terms].sum()) if terms else 0
+            if size > chunk and q > start:
+                scored.extend(self._score_chunk(term_lists[start:q]))
+                start, size = q, int(df[terms].sum()) if terms else 0
+        scored.extend(self._score_chunk(term_lists[start:]))
+        return [scored[i] for i in slots]
+
+    def _score_chunk(self, term_lists: List[List[int]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        n_q = len(term_lists)
+        n_docs = len(self.doc_len)
+        occ_terms = np.fromiter(chain.from_iterable(term_lists), dtype=np.int64)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        if not len(occ_terms):
+            return [empty] * n_q
+        occ_query = np.repeat(np.arange(n_q, dtype=np.int64), [len(t) for t in term_lists])
+
+        # постинги уникальных терминов подряд и их вклады в оценку
+        uniq, occ_uniq = np.unique(occ_terms, return_inverse=True)
+        lo = self.post_offsets[uniq]
+        lens = self.post_offsets[uniq + 1] - lo
+        starts = np.zeros(len(uniq) + 1, dtype=np.int64)
+        np.cumsum(lens, out=starts[1:])
+        pos = np.repeat(lo - starts[:-1], lens) + np.arange(starts[-1])
+        docs = self.post_docs[pos].astype(np.int64)
+        tf = self.post_tf[pos].astype(np.float64)
+        contrib = self.idf[np.repeat(uniq, lens)] * (tf * (self.k1 + 1) / (tf + self._norm[docs]))
+
+        # каждое вхождение термина в запрос — его постинги со своим номером запроса
+        occ_lens = lens[occ_uniq]
+        occ_starts = np.zeros(len(occ_lens) + 1, dtype=np.int64)
+        np.cumsum(occ_lens, out=occ_starts[1:])
+        sel = np.repeat(starts[occ_uniq] - occ_starts[:-1], occ_lens) + np.arange(occ_starts[-1])
+        keys = np.repeat(occ_query, occ_lens) * n_docs + docs[sel]
+        cells, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=contrib[sel], minlength=len(cells))
+
+        bounds = np.searchsorted(cells, np.arange(n_q + 1, dtype=np.int64) * n_docs)
+        return [
+            (cells[bounds[q]:bounds[q + 1]] - q * n_docs, sums[bounds[q]:bounds[q + 1]])
+            for q in range(n_q)
+        ]
+
+    def top_k_many(self, token_lists: List[List[str]], top_k: int = 5) -> List[List[Tuple[int, float]]]:
+        n_docs = len(self.doc_len)
+        return [_rank_top_k(cand, scores, n_docs, top_k) for cand, scores in self.score_candidates_many(token_lists)]
+
+    def dense_top_k_many(self, query_vecs, top_k: int = 5, chunk: int = SEARCH_MANY_CHUNK) -> List[List[Tuple[int, float]]]:
+        """dense_top_k для многих запросов: одно матричное произведение на пачку запросов."""
+        q = _normalize_rows(np.asarray(query_vecs, dtype=np.float32).reshape(len(query_vecs), -1))
+        if self.embeddings is None or not len(self.embeddings):
+            return [[] for _ in range(len(q))]
+        n = len(self.embeddings)
+        docs = np.arange(n)
+        step = max(1, chunk // n)
+        out = []
+        for i in range(0, len(q), step):
+            scores = self.embeddings @ q[i:i + step].T
+            out.extend(_top_by_score(docs, scores[:, j], min(top_k, n)) for j in range(scores.shape[1]))
+        return out
+
+    def rank_many(self, token_lists: List[List[str]], top_k: int = 5,
+                  query_vecs=None) -> List[List[Tuple[int, float]]]:
+        """(id пассажа, оценка) для многих запросов: BM25 или, с query_vecs, гибрид."""
+        if query_vecs is not None and self.embeddings is not None:
+            n = max(top_k, HYBRID_CANDIDATES)
+            return [
+                _rrf(_top_by_score(cand, scores, n), dense, top_k)
+                for (cand, scores), dense in zip(self.score_candidates_many(token_lists),
+                                                 self.dense_top_k_many(query_vecs, n), strict=True)
+            ]
+        return self.top_k_many(token_lists, top_k)
+
+    def search_many(self, queries: List[str], top_k: int = 5, query_vecs=None) -> List[List[Tuple[str, float]]]:
+        """search для многих запросов сразу; результаты те же, что у search по одному."""
+        ranked = self.rank_many([self.analyzer.tokenize(q) for q in queries], top_k, query_vecs)
+        return [[(self.passages[i], s) for i, s in r] for r in ranked]
+
+    def search(self, query: str, top_k: int = 5, query_vec=None) -> List[Tuple[str, float]]:
+        """BM25; с query_vec и эмбеддингами в индексе — гибрид (оценки тогда RRF, а не BM25)."""
+        tokens = self.analyzer.tokenize(query)
+        if query_vec is not None and self.embeddings is not None:
+            ranked = self.hybrid_top_k(tokens, query_vec, top_k)
+        else:
+            ranked = self.top_k(tokens, top_k)
+        return [(self.passages[i], s) for i, s in ranked]
+
+
+def _top_by_score(docs: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """k лучших по убыванию оценки, при равенстве — по возрастанию id (docs отсортированы)."""
+    if k <= 0 or len(docs) == 0:
+        return []
+    if len(docs) > k:
+        thr = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > thr)
+        ties = np.flatnonzero(scores == thr)[: k - len(above)]
+        sel = np.concatenate([above, ties])
+        docs, scores = docs[sel], scores[sel]
+    order = np.lexsort((docs, -scores))
+    return [(int(docs[i]), float(scores[i])) for i in order]
+
+
+def _rrf(lexical: List[Tuple[int, float]], dense: List[Tuple[int, float]], top_k: int,
+         rrf_k: int = RRF_K) -> List[Tuple[int, float]]:
+    fused: Dict[int, float] = {}
+    for ranked in (lexical, dense):
+        for rank, (d, _) in enumerate(ranked, start=1):
+            fused[d] = fused.get(d, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda x: (-x[1], x[0]))[:top_k]
+
+
+def _rank_top_k(cand: np.ndarray, scores: np.ndarray, n_docs: int, top_k: int) -> List[Tuple[int, float]]:
+    """
+    Тот же порядок, что sorted(range(n), key=score, reverse=True)[:top_k] по всему корпусу,
+    но без полного прохода: положительные кандидаты, потом нули по порядку id, потом отрицательные.
+    """
+    k = min(top_k, n_docs)
+    positive = scores > 0
+    out = _top_by_score(cand[positive], scores[positive], k)
+    if len(out) < k:
+        # нулевая оценка у всех, кто не попал в кандидаты, и у кандидатов с нулём
+        nonzero = cand[scores != 0]
+        j = 0
+        for i in range(n_docs):
+            while j < len(nonzero) and nonzero[j] < i:
+                j += 1
+            if j < len(nonzero) and nonzero[j] == i:
+                continue
+            out.append((i, 0.0))
+            if len(out) == k:
+                break
+    if len(out) < k:
+        negative = scores < 0
+        out.extend(_top_by_score(cand[negative], scores[negative], k - len(out)))
+    return out
+
+
+RAG_SEARCH_CACHE_ENTRIES = int(os.getenv("RAG_SEARCH_CACHE_ENTRIES", "4096"))
+RAG_SEARCH_CACHE_BYTES = int(os.getenv("RAG_SEARCH_CACHE_BYTES", str(4 << 20)))
+
+
+class SearchCache:
+    """
+    LRU результатов поиска: хранятся только (id пассажа, оценка), тексты берутся из индекса.
+
+    Ключ — версия индекса, режим (bm25 или гибрид с моделью эмбеддингов), top_k и
+    отсортированное мультимножество токенов: "Python loops" и "loops python" — один ключ
+    (для BM25 порядок слов не важен, для эмбеддингов — почти). После ingest_rag у индекса
+    другая version, старые записи просто перестают находиться и вытесняются.
+    Размер записи оценивается приблизительно — ключ плюс ~64 байта на результат.
+    """
+
+    def __init__(self, max_entries: int = RAG_SEARCH_CACHE_ENTRIES, max_bytes: int = RAG_SEARCH_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[Tuple[int, float], ...]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(index: BM25Index, tokens: List[str], top_k: int, mode: str = "bm25") -> str:
+        return f"{index.version}|{mode}|{top_k}|{' '.join(sorted(tokens))}"
+
+    @staticmethod
+    def _size(key: str, ranked) -> int:
+        return len(key) + 64 * len(ranked) + 100
+
+    def get(self, key: str) -> Optional[List[Tuple[int, float]]]:
+        with self._lock:
+            ranked = self._data.get(key)
+            if ranked is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return list(ranked)
+
+    def put(self, key: str, ranked: List[Tuple[int, float]]):
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._size(key, self._data.pop(key))
+            self._data[key] = tuple(ranked)
+            self._bytes += self._size(key, ranked)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                old_key, old = self._data.popitem(last=False)
+                self._bytes -= self._size(old_key, old)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            looked_up = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / looked_up if looked_up else None,
+            }
+
+
+SEARCH_CACHE = SearchCache()
+
+
+def _file_sha256(filepath: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class IndexCache:
+    """
+    Один загруженный BM25Index на процесс.
+
+    На каждом get() делается только os.stat(); если mtime/размер файла
+    изменились (ingest_rag пересобрал индекс), сверяем sha256 содержимого и,
+    если оно действительно другое, грузим новый индекс и подменяем ссылку
+    целиком — параллельные запросы видят либо старый, либо новый индекс.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # (index, (mtime_ns, size), sha256) — меняется одним присваиванием
+        self._state: Tuple[Optional[BM25Index], Optional[Tuple[int, int]], Optional[str]] = (None, None, None)
+        self._error: Optional[IndexFormatError] = None
+        self.loads = 0
+        self.checks = 0
+        self.last_load_ms: Optional[float] = None
+        self.total_load_ms = 0.0
+        self.last_hash_ms: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+
+    def _signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self) -> Optional[BM25Index]:
+        """Текущий индекс или None, если файла индекса нет."""
+        sig = self._signature()
+        index, cur_sig, _ = self._state
+        if sig is None:
+            return None
+        if sig == cur_sig:
+            if self._error is not None:
+                raise self._error
+            return index
+
+        with self._lock:
+            index, cur_sig, cur_hash = self._state
+            if sig == cur_sig:
+                if self._error is not None:
+                    raise self._error
+                return index
+            self.checks += 1
+
+            t0 = time.perf_counter()
+            digest = _file_sha256(self.path)
+            self.last_hash_ms = (time.perf_counter() - t0) * 1000
+            if index is not None and digest == cur_hash:
+                # файл перезаписан тем же содержимым — перечитывать нечего
+                self._state = (index, sig, cur_hash)
+                return index
+
+            t0 = time.perf_counter()
+            new_index = BM25Index()
+            try:
+                new_index.load(self.path)
+            except IndexFormatError as e:
+                # запоминаем, чтобы не перечитывать битый файл на каждом запросе
+                self._error = e
+                self._state = (None, sig, digest)
+                raise
+            elapsed = (time.perf_counter() - t0) * 1000
+
+            self._error = None
+            self._state = (new_index, sig, digest)
+            self.loads += 1
+            self.last_load_ms = elapsed
+            self.total_load_ms += elapsed
+            self.loaded_at = time.time()
+            return new_index
+
+    def stats(self) -> dict:
+        index, sig, digest = self._state
+        return {
+            "path": str(self.path),
+            "loaded": index is not None,
+            "error": str(self._error) if self._error is not None else None,
+            "passages": len(index.passages) if index is not None else 0,
+            "embed_model": index.embed_model if index is not None and index.embeddings is not None else None,
+            "sha256": digest,
+            "mtime_ns": sig[0] if sig else None,
+            "loads": self.loads,
+            "checks": self.checks,
+            "last_load_ms": self.last_load_ms,
+            "total_load_ms": self.total_load_ms,
+            "last_hash_ms": self.last_hash_ms,
+            "loaded_at": self.loaded_at,
+        }
+
+
+KNOWLEDGE_SUFFIXES = {".md", ".txt"}
+
+
+def iter_knowledge_dir(root: Path) -> Iterator[Tuple[str, str]]:
+    """(path, content) по одному файлу, без загрузки всего каталога в память."""
     for p in root.rglob("*"):
-        if p.suffix.lower() in {".md", ".txt"} and p.is_file():
+        if p.suffix.lower() in KNOWLEDGE_SUFFIXES and p.is_file():
             try:
-                docs.append((str(p), p.read_text(encoding="utf-8")))
+                yield str(p), p.read_text(encoding="utf-8")
             except Exception:
                 pass
-    return docs
+
+
+def read_knowledge_dir(root: Path) -> List[Tuple[str, str]]:
+    return list(iter_knowledge_dir(root))
+
+
+def scan_knowledge_dir(root: Path) -> List[Tuple[str, Path, int, int]]:
+    """(путь относительно root, путь, size, mtime_ns) для всех .md/.txt, в стабильном порядке."""
+    out = []
+    for p in root.rglob("*"):
+        if p.suffix.lower() in KNOWLEDGE_SUFFIXES and p.is_file():
+            st = p.stat()
+            out.append((p.relative_to(root).as_posix(), p, st.st_size, st.st_mtime_ns))
+    out.sort(key=lambda x: x[0])
+    return out
+
+
+def update_index(
+    root: Path,
+    previous: Optional[BM25Index] = None,
+    workers: int = 1,
+    spool_dir: Optional[Path] = None,
+    embedder=None,
+    analyzer: Optional[Analyzer] = None,
+) -> Tuple[BM25Index, dict]:
+    """
+    Строит индекс по root, переиспользуя из previous пассажи и постинги неизменённых файлов.
+
+    Файл считается неизменённым, если совпали size и mtime, либо (после touch/копирования)
+    sha256 содержимого. Заново режутся и токенизируются только добавленные/изменённые файлы —
+    в workers процессах, потоково. Тексты пассажей сразу уходят во временный файл в spool_dir,
+    в памяти остаются только компактные массивы постингов. IDF и длины пересчитываются
+    по всему корпусу — это дёшево, всё уже в массивах.
+
+    С embedder у индекса будут эмбеддинги пассажей: векторы неизменённых пассажей берутся
+    из previous (если он посчитан той же моделью), в модель уходят только новые.
+
+    analyzer по умолчанию — тот же, что у previous. Если он другой, из previous ничего
+    не переиспользуется: все файлы разбираются заново.
+    """
+    root = Path(root)
+    if analyzer is None:
+        analyzer = previous.analyzer if previous is not None else DEFAULT_ANALYZER
+    reanalyze = previous is not None and previous.analyzer != analyzer
+    prev_files = {f["path"]: f for f in (previous.files if previous is not None else [])}
+    summary = {
+        "files_added": 0, "files_updated": 0, "files_removed": 0, "files_unchanged": 0,
+        "passages_added": 0, "passages_removed": 0, "passages_reused": 0,
+    }
+
+    if previous is not None:
+        # постинги старого индекса обратно в тройки (термин, документ, tf)
+        prev_terms = np.repeat(
+            np.arange(len(previous.vocab), dtype=np.int64), np.diff(previous.post_offsets)
+        )
+        prev_docs = np.asarray(previous.post_docs)
+        # старый id документа -> новый, -1 если файл удалён или изменён
+        prev_doc_map = np.full(len(previous.doc_len), -1, dtype=np.int64)
+        prev_blob, prev_text_offsets = _encode_passages(previous.passages)
+    vocab: Dict[str, int] = dict(previous.vocab) if previous is not None else {}
+
+    scanned = []
+    for rel, path, size, mtime_ns in scan_knowledge_dir(root):
+        prev = prev_files.pop(rel, None)
+        same_stat = (prev is not None and not reanalyze
+                     and prev["size"] == size and prev["mtime_ns"] == mtime_ns)
+        scanned.append((rel, path, size, mtime_ns, prev, same_stat))
+    for gone in prev_files.values():
+        summary["files_removed"] += 1
+        summary["passages_removed"] += gone["passages"][1] - gone["passages"][0]
+
+    results = _iter_analyzed(
+        ((str(path), None if reanalyze else prev and prev["sha256"], analyzer)
+         for _, path, _, _, prev, same_stat in scanned if not same_stat),
+        workers,
+    )
+    files: List[dict] = []
+    text_lens: List[np.ndarray] = []
+    doc_len_parts: List[np.ndarray] = []
+    term_parts: List[np.ndarray] = []
+    doc_parts: List[np.ndarray] = []
+    tf_parts: List[np.ndarray] = []
+    n_docs = 0
+    with tempfile.TemporaryFile(dir=spool_dir) as spool:
+        try:
+            for rel, _, size, mtime_ns, prev, same_stat in scanned:
+                res = None if same_stat else next(results)
+                if not same_stat and res is None:
+                    # не читается или не UTF-8 — как и раньше, просто пропускаем
+                    if prev is not None:
+                        summary["files_removed"] += 1
+                        summary["passages_removed"] += prev["passages"][1] - prev["passages"][0]
+                    continue
+                entry = {"path": rel, "size": size, "mtime_ns": mtime_ns,
+                         "sha256": prev["sha256"] if same_stat else res["sha256"]}
+
+                if same_stat or "terms" not in res:
+                    start, end = prev["passages"]
+                    prev_doc_map[start:end] = np.arange(n_docs, n_docs + end - start)
+                    spool.write(memoryview(prev_blob[prev_text_offsets[start]:prev_text_offsets[end]]))
+                    text_lens.append(np.diff(prev_text_offsets[start:end + 1]))
+                    doc_len_parts.append(np.asarray(previous.doc_len[start:end]))
+                    summary["files_unchanged"] += 1
+                    summary["passages_reused"] += end - start
+                else:
+                    lut = np.asarray([vocab.setdefault(t, len(vocab)) for t in res["terms"]], dtype=np.int64)
+                    term_parts.append(lut[res["term_local"]])
+                    doc_parts.append(res["doc_local"] + n_docs)
+                    tf_parts.append(res["tf"])
+                    spool.write(res["blob"])
+                    text_lens.append(res["text_lens"])
+                    doc_len_parts.append(res["doc_len"])
+                    n_new = len(res["doc_len"])
+                    summary["files_updated" if prev is not None else "files_added"] += 1
+                    summary["passages_added"] += n_new
+                    if prev is not None:
+                        summary["passages_removed"] += prev["passages"][1] - prev["passages"][0]
+
+                entry["passages"] = [n_docs, n_docs + len(doc_len_parts[-1])]
+                n_docs = entry["passages"][1]
+                files.append(entry)
+
+            spool.flush()
+            blob_size = spool.tell()
+            blob = (np.memmap(spool, dtype=np.uint8, mode="r", shape=(blob_size,))
+                    if blob_size else np.zeros(0, dtype=np.uint8))
+        finally:
+            results.close()
+
+    if previous is not None:
+        keep = prev_doc_map[prev_docs] >= 0
+        term_parts.append(prev_terms[keep])
+        doc_parts.append(prev_doc_map[prev_docs[keep]])
+        tf_parts.append(np.asarray(previous.post_tf)[keep])
+    term_ids = np.concatenate(term_parts) if term_parts else np.zeros(0, dtype=np.int64)
+    doc_ids = (np.concatenate(doc_parts) if doc_parts else np.zeros(0, dtype=np.int64)).astype(np.int32)
+    tfs = np.concatenate(tf_parts) if tf_parts else np.zeros(0, dtype=np.int32)
+
+    # термины, которые остались только в удалённых файлах, выкидываем из словаря
+    df = np.bincount(term_ids, minlength=len(vocab))
+    alive = df > 0
+    remap = np.cumsum(alive) - 1
+    terms = list(vocab)
+    vocab = {terms[t]: i for i, t in enumerate(np.flatnonzero(alive).tolist())}
+
+    offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    if text_lens:
+        np.cumsum(np.concatenate(text_lens), out=offsets[1:])
+
+    index = BM25Index()
+    index.passages = PassageStore(blob, offsets)
+    index.files = files
+    index.analyzer = analyzer
+    doc_len = np.concatenate(doc_len_parts) if doc_len_parts else np.zeros(0, dtype=np.int32)
+    index._set_postings(vocab, doc_len.astype(np.int32), remap[term_ids], doc_ids, tfs)
+
+    if embedder is not None:
+        reuse = None
+        if previous is not None and previous.embeddings is not None and previous.embed_model == embedder.model:
+            reuse = (previous.embeddings, prev_doc_map)
+        summary["passages_embedded"], summary["embeddings_reused"] = embed_passages(index, embedder, reuse)
+    return index, summary
@@ -1,3 +1,1764 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from pathlib import Path
 
-# Create your tests here.
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+import requests
+from rank_bm25 import BM25Okapi
+import numpy as np
+
+from . import export_render, exporter, importer, jobs
+from .context_packer import estimate_tokens, minhash, pack_context, trim_passage
+from .admission import BATCH, INTERACTIVE, AdmissionControl, Overloaded
+from .exporter import export_course_zip
+from .fake_ollama import FakeOllama, fake_embedding
+from .management.commands.bench_rag import (
+    markdown_corpus,
+    split_passages_baseline,
+    tokenize_baseline,
+)
+from .generation import (
+    GENERATION_MAX_CONCURRENCY,
+    finalize_blueprint,
+    repair_lesson,
+    run_generation,
+    search_index,
+    search_index_many,
+)
+from .models import Course, GenerationJob, Lesson, Module
+from .llm_cache import LLMCache, MemoryBackend, SQLiteBackend
+from . import ollama_client
+from .ollama_client import (
+    AsyncOllamaClient,
+    OllamaClient,
+    OllamaEmbedder,
+    OllamaHTTPError,
+    get_async_client,
+)
+from .rag import (
+    DEFAULT_ANALYZER,
+    Analyzer,
+    BM25Index,
+    IndexCache,
+    IndexFormatError,
+    SearchCache,
+    split_passages,
+    tokenize,
+    update_index,
+)
+
+DOCS = [
+    (
+        "basics.md",
+        "# Basics\nVariables and types.\n\nprint() and f-strings for output.",
+    ),
+    (
+        "loops.md",
+        "for loops iterate over lists\n\nwhile loops repeat while a condition holds",
+    ),
+    (
+        "funcs.md",
+        "def defines functions; return values from functions\n\nlambda, map and filter",
+    ),
+    ("files.md", "open files with a context manager and read lines in a for loop"),
+]
+
+GOLDEN_COURSE = {
+    "topic": "Python Basics",
+    "level": "beginner",
+    "duration_weeks": 4,
+    "prerequisites": ["Familiarity with basic computer concepts"],
+    "learning_outcomes": [
+        "Understand Python syntax and core data types",
+        "Use control flow to implement logic",
+        "Define and call functions with arguments",
+        "Work with files and handle exceptions",
+        "Write simple tests for functions",
+    ],
+    "modules": [
+        {
+            "title": "Intro & Types",
+            "objectives": ["Understand REPL", "Use basic types", "Apply printing"],
+            "lessons": 3,
+            "quiz_items": 6,
+            "project": None,
+        },
+        {
+            "title": "Control Flow",
+            "objectives": [
+                "Use if/elif/else",
+                "Implement loops",
+                "Trace simple programs",
+            ],
+            "lessons": 3,
+            "quiz_items": 6,
+            "project": None,
+        },
+        {
+            "title": "Functions",
+            "objectives": ["Define functions", "Use parameters", "Return values"],
+            "lessons": 2,
+            "quiz_items": 6,
+            "project": None,
+        },
+    ],
+    "capstone": "Build a small command-line utility that processes a text file.",
+    "references": [
+        {
+            "title": "Python Official Docs",
+            "url": "https://docs.python.org/3/",
+            "license": "Docs",
+        },
+        {
+            "title": "PEP 8",
+            "url": "https://peps.python.org/pep-0008/",
+            "license": "Docs",
+        },
+    ],
+}
+
+
+class IndexCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "rag_index.bm25"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _build(self, docs):
+        idx = BM25Index()
+        idx.build(docs)
+        idx.save(self.path)
+
+    def test_missing_file(self):
+        self.assertIsNone(IndexCache(self.path).get())
+
+    def test_loads_once_and_hot_swaps(self):
+        self._build([("a.md", "python loops\n\nfor and while")])
+        cache = IndexCache(self.path)
+        first = cache.get()
+        self.assertIs(cache.get(), first)
+        self.assertEqual(cache.stats()["loads"], 1)
+
+        self._build(
+            [("b.md", "decorators wrap functions"), ("c.md", "generators yield values")]
+        )
+        # на быстрых ФС mtime может совпасть — сдвигаем явно
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        second = cache.get()
+        self.assertIsNot(second, first)
+        self.assertEqual(len(second.passages), 2)
+        self.assertEqual(cache.stats()["loads"], 2)
+
+    def test_touch_without_changes_keeps_index(self):
+        self._build([("a.md", "python loops")])
+        cache = IndexCache(self.path)
+        first = cache.get()
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        self.assertIs(cache.get(), first)
+        self.assertEqual(cache.stats()["loads"], 1)
+
+
+class BM25IndexFormatTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "rag_index.bm25"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip_matches_bm25okapi(self):
+        idx = BM25Index()
+        idx.build(DOCS)
+        idx.save(self.path)
+        for mmap in (True, False):
+            loaded = BM25Index()
+            loaded.load(self.path, mmap=mmap)
+            self.assertEqual(list(loaded.passages), list(idx.passages))
+            ref = BM25Okapi([tokenize(p) for p in loaded.passages])
+            for q in [
+                "for loops",
+                "functions return values",
+                "unknown words",
+                "loops loops files",
+            ]:
+                self.assertEqual(
+                    loaded.get_scores(tokenize(q)).tolist(),
+                    ref.get_scores(tokenize(q)).tolist(),
+                )
+
+    def test_saved_file_is_readable_like_open(self):
+        umask = os.umask(0)
+        os.umask(umask)
+        idx = BM25Index()
+        idx.build(DOCS)
+        idx.save(self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o666 & ~umask)
+
+    def test_rejects_other_versions(self):
+        idx = BM25Index()
+        idx.build(DOCS)
+        idx.save(self.path)
+        with open(self.path, "r+b") as f:
+            f.seek(8)
+            f.write(struct.pack("<I", 999))
+        with self.assertRaises(IndexFormatError):
+            BM25Index().load(self.path)
+
+    def test_rejects_legacy_pickle(self):
+        self.path.write_bytes(b"\x80\x05legacy pickle")
+        with self.assertRaises(IndexFormatError):
+            BM25Index().load(self.path)
+
+
+class BM25SearchTests(SimpleTestCase):
+    def _reference(self, idx, query, top_k):
+        ref = BM25Okapi([tokenize(p) for p in idx.passages])
+        scores = ref.get_scores(tokenize(query))
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[
+            :top_k
+        ]
+        return [(idx.passages[i], float(scores[i])) for i in order]
+
+    def test_matches_full_scan(self):
+        idx = BM25Index()
+        idx.build(
+            DOCS
+            + [
+                ("dup.md", "for loops iterate over lists"),
+                ("misc.md", "dictionaries and sets"),
+            ]
+        )
+        for q in [
+            "for loops",
+            "loops",
+            "functions",
+            "nothing matches",
+            "files for loop lambda",
+            "",
+        ]:
+            for k in (1, 2, 3, 10):
+                self.assertEqual(
+                    idx.search(q, top_k=k), self._reference(idx, q, k), (q, k)
+                )
+
+    def test_negative_idf_ordering(self):
+        # в маленьком корпусе частые слова получают отрицательный IDF
+        idx = BM25Index()
+        idx.build(
+            [
+                ("a.md", "python python"),
+                ("b.md", "python code"),
+                ("c.md", "python tests"),
+                ("d.md", "notes"),
+            ]
+        )
+        for q in ["python", "python notes", "code python"]:
+            self.assertEqual(idx.search(q, top_k=4), self._reference(idx, q, 4), q)
+
+
+class TextPipelineTests(SimpleTestCase):
+    def test_same_output_as_before(self):
+        text = (
+            markdown_corpus(0.2)
+            + "\n\nİstanbul KELVIN \u212a ЁЛКА Ёлка ÀB_c1 "
+            + "x" * 900
+        )
+        self.assertEqual(tokenize(text), tokenize_baseline(text))
+        self.assertEqual(tokenize("İI \u212a"), tokenize_baseline("İI \u212a"))
+        for max_chars in (1, 80, 800):
+            self.assertEqual(
+                split_passages(text, max_chars),
+                split_passages_baseline(text, max_chars),
+            )
+
+    def test_stopwords_analyzer_is_stored_in_index(self):
+        analyzer = Analyzer.from_config({"stopwords": True})
+        idx = BM25Index()
+        idx.build(DOCS, analyzer=analyzer)
+        self.assertNotIn("the", idx.vocab)
+        self.assertNotIn("for", idx.vocab)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "rag_index.bm25"
+            idx.save(path)
+            loaded = BM25Index()
+            loaded.load(path)
+        self.assertIs(loaded.analyzer, analyzer)
+        # "for" и "a" из запроса отброшены так же, как из пассажей
+        self.assertEqual(
+            loaded.search("for a lambda", top_k=1), idx.search("lambda", top_k=1)
+        )
+        plain = BM25Index()
+        plain.build(DOCS)
+        self.assertIs(plain.analyzer, DEFAULT_ANALYZER)
+        self.assertIn("for", plain.vocab)
+
+    def test_stemming(self):
+        try:
+            analyzer = Analyzer.from_config({"stemmer": "english"})
+        except ImportError:
+            self.skipTest("nltk is not installed")
+        idx = BM25Index()
+        idx.build(DOCS, analyzer=analyzer)
+        self.assertIn("loop", idx.vocab)
+        self.assertNotIn("loops", idx.vocab)
+        self.assertEqual(idx.search("looping", top_k=2), idx.search("loop", top_k=2))
+
+
+class SearchManyTests(SimpleTestCase):
+    QUERIES = [
+        "for loops",
+        "loops",
+        "functions",
+        "nothing matches",
+        "files for loop lambda",
+        "",
+        "for loops",
+        "python python notes",
+        "return values from functions",
+    ]
+
+    def setUp(self):
+        self.idx = BM25Index()
+        self.idx.build(
+            DOCS
+            + [
+                ("dup.md", "for loops iterate over lists"),
+                ("py.md", "python python notes"),
+            ]
+        )
+
+    def test_matches_single_queries(self):
+        for k in (1, 3, 10):
+            self.assertEqual(
+                self.idx.search_many(self.QUERIES, top_k=k),
+                [self.idx.search(q, top_k=k) for q in self.QUERIES],
+            )
+        # маленький chunk — много пачек, результат тот же
+        expected = [self.idx.score_candidates(tokenize(q)) for q in self.QUERIES]
+        for (cand, scores), (ref_cand, ref_scores) in zip(
+            self.idx.score_candidates_many(
+                [tokenize(q) for q in self.QUERIES], chunk=3
+            ),
+            expected,
+            strict=True,
+        ):
+            self.assertEqual(cand.tolist(), ref_cand.tolist())
+            self.assertEqual(scores.tolist(), ref_scores.tolist())
+
+    def test_hybrid_matches_single_queries(self):
+        self.idx.build(DOCS, embedder=CountingEmbedder())
+        vecs = [fake_embedding(q) for q in self.QUERIES]
+        self.assertEqual(
+            self.idx.search_many(self.QUERIES, top_k=3, query_vecs=vecs),
+            [
+                self.idx.search(q, top_k=3, query_vec=v)
+                for q, v in zip(self.QUERIES, vecs, strict=True)
+            ],
+        )
+
+    def test_batch_endpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "rag_index.bm25"
+            self.idx.save(path)
+            with mock.patch("api.views.RAG_INDEX", IndexCache(path)):
+                resp = self.client.post(
+                    "/api/rag/search/batch/",
+                    {"queries": ["for loops", "functions"], "top_k": 2},
+                    content_type="application/json",
+                )
+                bad = self.client.post(
+                    "/api/rag/search/batch/",
+                    {"queries": ["ok", ""]},
+                    content_type="application/json",
+                )
+        self.assertEqual(resp.status_code, 200)
+        results = resp.json()["results"]
+        self.assertEqual(len(results), 2)
+        self.assertEqual(
+            [r["passage"] for r in results[1]],
+            [p for p, _ in self.idx.search("functions", top_k=2)],
+        )
+        self.assertEqual(bad.status_code, 400)
+
+
+class SearchCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = SearchCache()
+        patcher = mock.patch("api.generation.SEARCH_CACHE", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.idx = BM25Index()
+        self.idx.build(DOCS)
+
+    def test_word_order_and_case_share_entry(self):
+        first = search_index(self.idx, "For loops", 3)
+        with mock.patch.object(
+            self.idx, "rank_many", side_effect=AssertionError("not cached")
+        ):
+            self.assertEqual(search_index(self.idx, "loops for", 3), first)
+            self.assertEqual(
+                search_index_many(self.idx, ["LOOPS FOR", "for loops"], 3),
+                [first, first],
+            )
+        self.assertEqual(first, self.idx.search("for loops", top_k=3))
+        self.assertEqual((self.cache.hits, self.cache.misses), (3, 1))
+        search_index(self.idx, "for loops", 2)  # другой top_k — другой ключ
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_rebuild_invalidates(self):
+        search_index(self.idx, "functions", 2)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "rag_index.bm25"
+            self.idx.save(path)
+            loaded = BM25Index()
+            loaded.load(path)
+            self.assertEqual(loaded.version, self.idx.version)
+            search_index(loaded, "functions", 2)
+            self.assertEqual(self.cache.hits, 1)
+            self.idx.build(DOCS[:2])
+            self.assertNotEqual(self.idx.version, loaded.version)
+        search_index(self.idx, "functions", 2)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_bounded(self):
+        cache = SearchCache(max_entries=3, max_bytes=10_000)
+        for i in range(5):
+            cache.put(f"k{i}", [(i, 1.0)])
+        cache.get("k2")
+        cache.put("k5", [(5, 1.0)])
+        self.assertEqual(list(cache._data), ["k4", "k2", "k5"])
+        small = SearchCache(max_entries=100, max_bytes=600)
+        for i in range(10):
+            small.put(f"k{i}", [(j, 1.0) for j in range(3)])
+        self.assertLessEqual(small.stats()["bytes"], 600)
+        self.assertEqual(small.stats()["evictions"], 10 - small.stats()["entries"])
+
+    def test_status_endpoint(self):
+        search_index(self.idx, "functions", 2)
+        search_index(self.idx, "functions", 2)
+        with mock.patch("api.views.SEARCH_CACHE", self.cache):
+            stats = self.client.get("/api/rag/status/").json()["search_cache"]
+        self.assertEqual(stats["hit_rate"], 0.5)
+        self.assertEqual(stats["entries"], 1)
+
+
+class IncrementalIngestTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / "knowledge"
+        self.root.mkdir()
+        self.out = Path(self.tmp.name) / "rag_index.bm25"
+        for name, text in DOCS:
+            (self.root / name).write_text(text, encoding="utf-8")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _reingest(self):
+        previous = BM25Index()
+        previous.load(self.out)
+        idx, summary = update_index(self.root, previous)
+        idx.save(self.out)
+        return idx, summary
+
+    def test_only_changed_files_are_reindexed(self):
+        idx, summary = update_index(self.root)
+        idx.save(self.out)
+        self.assertEqual(summary["files_added"], len(DOCS))
+
+        (self.root / "loops.md").write_text(
+            "while loops and break statements", encoding="utf-8"
+        )
+        (self.root / "files.md").unlink()
+        (self.root / "sub").mkdir()
+        (self.root / "sub" / "new.md").write_text(
+            "generators yield values lazily", encoding="utf-8"
+        )
+        idx, summary = self._reingest()
+        self.assertEqual(
+            (
+                summary["files_added"],
+                summary["files_updated"],
+                summary["files_removed"],
+                summary["files_unchanged"],
+            ),
+            (1, 1, 1, 2),
+        )
+        self.assertEqual(summary["passages_reused"], 2)
+
+        full, _ = update_index(self.root)
+        self.assertEqual(list(idx.passages), list(full.passages))
+        for q in ["while loops", "generators", "functions for loop", "files"]:
+            self.assertEqual(idx.search(q, top_k=3), full.search(q, top_k=3))
+
+    def test_touch_keeps_passages(self):
+        update_index(self.root)[0].save(self.out)
+        st = os.stat(self.root / "basics.md")
+        os.utime(
+            self.root / "basics.md", ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000)
+        )
+        _, summary = self._reingest()
+        self.assertEqual(summary["files_unchanged"], len(DOCS))
+        self.assertEqual(summary["passages_added"], 0)
+
+    def test_analyzer_change_reanalyzes_everything(self):
+        update_index(self.root)[0].save(self.out)
+        idx, summary = self._reingest()
+        self.assertIs(idx.analyzer, DEFAULT_ANALYZER)
+        self.assertEqual(summary["files_unchanged"], len(DOCS))
+
+        previous = BM25Index()
+        previous.load(self.out)
+        analyzer = Analyzer.from_config({"stopwords": True})
+        idx, summary = update_index(self.root, previous, workers=2, analyzer=analyzer)
+        self.assertEqual(
+            (summary["files_updated"], summary["passages_reused"]), (len(DOCS), 0)
+        )
+        full = BM25Index()
+        full.build(
+            (
+                (name, (self.root / name).read_text(encoding="utf-8"))
+                for name, _ in sorted(DOCS)
+            ),
+            analyzer=analyzer,
+        )
+        self.assertIs(idx.analyzer, analyzer)
+        self.assertEqual(idx.vocab.keys(), full.vocab.keys())
+        self.assertEqual(
+            idx.search("for loops", top_k=3), full.search("for loops", top_k=3)
+        )
+
+    def test_parallel_matches_serial(self):
+        serial, _ = update_index(self.root, workers=1)
+        parallel, summary = update_index(self.root, workers=2)
+        self.assertEqual(summary["files_added"], len(DOCS))
+        self.assertEqual(list(parallel.passages), list(serial.passages))
+        self.assertEqual(parallel.vocab, serial.vocab)
+        self.assertEqual(parallel.post_docs.tolist(), serial.post_docs.tolist())
+
+
+class CountingEmbedder:
+    model = "fake-embed"
+
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return [fake_embedding(t) for t in texts]
+
+
+class HybridSearchTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name) / "knowledge"
+        self.root.mkdir()
+        self.out = Path(self.tmp.name) / "rag_index.bm25"
+        for name, text in DOCS:
+            (self.root / name).write_text(text, encoding="utf-8")
+
+    def test_embeddings_roundtrip_through_ollama_api(self):
+        with FakeOllama() as fake:
+            embedder = OllamaEmbedder("fake-embed", client=OllamaClient(host=fake.url))
+            idx, summary = update_index(self.root, embedder=embedder)
+            self.assertEqual(fake.requests[0][0], "/api/embed")
+        self.assertEqual(summary["passages_embedded"], len(idx.passages))
+        idx.save(self.out)
+        loaded = BM25Index()
+        loaded.load(self.out)
+        self.assertIsInstance(loaded.embeddings, np.memmap)
+        self.assertEqual(loaded.embeddings.dtype, np.float32)
+        self.assertEqual(loaded.embeddings.shape, (len(idx.passages), 64))
+        self.assertEqual(loaded.embed_model, "fake-embed")
+        np.testing.assert_allclose(
+            np.linalg.norm(loaded.embeddings, axis=1), 1.0, rtol=1e-5
+        )
+
+    def test_only_new_passages_are_embedded(self):
+        idx, _ = update_index(self.root, embedder=CountingEmbedder())
+        idx.save(self.out)
+        previous = BM25Index()
+        previous.load(self.out)
+        (self.root / "loops.md").write_text(
+            "while loops and break statements", encoding="utf-8"
+        )
+        embedder = CountingEmbedder()
+        idx, summary = update_index(self.root, previous, embedder=embedder)
+        self.assertEqual(
+            embedder.texts, ["[loops.md]\nwhile loops and break statements"]
+        )
+        self.assertEqual(summary["embeddings_reused"], len(idx.passages) - 1)
+        full, _ = update_index(self.root, embedder=CountingEmbedder())
+        np.testing.assert_allclose(idx.embeddings, full.embeddings, rtol=1e-6)
+
+    def test_hybrid_finds_paraphrase_bm25_misses(self):
+        idx = BM25Index()
+        idx.build(DOCS, embedder=CountingEmbedder())
+        query = "looping iterations"
+        self.assertEqual(
+            idx.top_k(tokenize(query), 1), [(0, 0.0)]
+        )  # ни одного общего токена
+        passage, _ = idx.search(query, top_k=1, query_vec=fake_embedding(query))[0]
+        self.assertTrue(passage.startswith("[loops.md]"))
+        # без вектора запроса — прежний BM25
+        self.assertEqual(
+            idx.search("for loops", top_k=3),
+            BM25SearchTests()._reference(idx, "for loops", 3),
+        )
+
+    def test_search_index_falls_back_to_bm25_without_ollama(self):
+        idx = BM25Index()
+        idx.build(DOCS, embedder=CountingEmbedder())
+        fake = FakeOllama().start()
+        url = fake.url
+        fake.stop()
+        breaker = ollama_client._Breaker(cooldown=60)
+        with mock.patch(
+            "api.ollama_client._client",
+            OllamaClient(host=url, max_retries=0, connect_timeout=1),
+        ), mock.patch("api.ollama_client._query_breaker", breaker):
+            self.assertEqual(
+                search_index(idx, "for loops", 2), idx.search("for loops", top_k=2)
+            )
+        self.assertFalse(breaker.allow())
+
+    def test_query_embedder_breaker_skips_ollama_after_failure(self):
+        idx = BM25Index()
+        idx.build(DOCS, embedder=CountingEmbedder())
+        breaker = ollama_client._Breaker(cooldown=60)
+        with FakeOllama() as fake, mock.patch(
+            "api.ollama_client._client", OllamaClient(host=fake.url)
+        ), mock.patch("api.ollama_client._query_breaker", breaker):
+            query_client = ollama_client.get_query_client()
+            self.assertEqual(
+                (query_client.max_retries, query_client.timeout[1]),
+                (0, ollama_client.OLLAMA_QUERY_EMBED_TIMEOUT),
+            )
+            breaker.trip()
+            search_index(idx, "looping iterations", 1)
+            self.assertEqual(
+                fake.requests, []
+            )  # разомкнут — BM25 без обращения к Ollama
+            breaker.reset()
+            search_index(idx, "functions", 1)
+            self.assertEqual([path for path, _ in fake.requests], ["/api/embed"])
+
+
+class ContextPackerTests(SimpleTestCase):
+    LOOPS = (
+        "[loops.md]\nA for loop iterates over a list. Dictionaries map keys to values. "
+        "A while loop repeats while a condition holds.\nSets store unique items."
+    )
+
+    def test_trim_keeps_source_and_query_sentences(self):
+        text = trim_passage(self.LOOPS, ["loop", "while"], 100)
+        self.assertEqual(
+            text,
+            "[loops.md]\nA for loop iterates over a list.\nA while loop repeats while a condition holds.",
+        )
+
+    def test_drops_low_scores_and_near_duplicates(self):
+        results = [
+            (self.LOOPS, 9.0),
+            (self.LOOPS.replace("unique items", "unique values"), 8.5),
+            ("[funcs.md]\nA loop inside a function body.", 6.0),
+            ("[misc.md]\nA loop mentioned in passing.", 1.0),
+        ]
+        with self.assertLogs("api.context_packer", "INFO") as logs:
+            context, stats = pack_context(results, "python loop")
+        self.assertEqual(
+            (stats["dropped_duplicate"], stats["dropped_low_score"], stats["passages"]),
+            (1, 1, 2),
+        )
+        self.assertIn("[funcs.md]", context)
+        self.assertNotIn("[misc.md]", context)
+        self.assertNotIn("Dictionaries", context)
+        self.assertEqual(
+            stats["saved_tokens"], stats["baseline_tokens"] - stats["tokens"]
+        )
+        self.assertGreater(stats["saved_tokens"], 0)
+        self.assertIn("saved", logs.output[0])
+
+    def test_respects_token_budget(self):
+        passages = [
+            (
+                f"[doc{i}.md]\n" + f"Loop example number {i} with some words. " * 30,
+                10.0 - i,
+            )
+            for i in range(8)
+        ]
+        for budget in (50, 200, 600):
+            with self.assertLogs("api.context_packer", "INFO"):
+                context, stats = pack_context(passages, "loop example", budget)
+            self.assertLessEqual(estimate_tokens(context), budget)
+            self.assertGreater(stats["passages"], 0)
+
+    def test_minhash_estimates_jaccard(self):
+        a = " ".join(f"w{i}" for i in range(200))
+        self.assertEqual(float(np.mean(minhash(a) == minhash(a))), 1.0)
+        self.assertLess(
+            float(
+                np.mean(minhash(a) == minhash(" ".join(f"x{i}" for i in range(200))))
+            ),
+            0.2,
+        )
+
+
+class OllamaClientTests(SimpleTestCase):
+    def test_reuses_connection(self):
+        with FakeOllama(response='{"ok": true}') as fake:
+            client = OllamaClient(host=fake.url)
+            for _ in range(3):
+                self.assertEqual(client.generate("hi"), '{"ok": true}')
+            self.assertEqual(fake.connections, 1)
+            stats = client.stats()
+            self.assertEqual(stats["calls"], 3)
+            self.assertGreater(stats["bytes_received"], 0)
+            self.assertGreater(stats["last_call"]["bytes_sent"], 0)
+
+    def test_retries_5xx(self):
+        with FakeOllama(response="done", fail_first=2) as fake:
+            client = OllamaClient(host=fake.url, max_retries=2, backoff=0)
+            self.assertEqual(client.generate("hi"), "done")
+            self.assertEqual(len(fake.requests), 3)
+            self.assertEqual(client.stats()["retries"], 2)
+
+    def test_gives_up_after_retries(self):
+        with FakeOllama(fail_first=10, fail_status=500) as fake:
+            client = OllamaClient(host=fake.url, max_retries=1, backoff=0)
+            with self.assertRaises(requests.HTTPError):
+                client.generate("hi")
+            self.assertEqual(len(fake.requests), 2)
+            self.assertEqual(client.stats()["errors"], 1)
+
+    def test_no_retry_on_4xx(self):
+        with FakeOllama(fail_first=1, fail_status=404) as fake:
+            client = OllamaClient(host=fake.url, max_retries=3, backoff=0)
+            with self.assertRaises(requests.HTTPError):
+                client.generate("hi")
+            self.assertEqual(len(fake.requests), 1)
+
+    def test_connection_refused(self):
+        fake = FakeOllama().start()
+        url = fake.url
+        fake.stop()
+        client = OllamaClient(host=url, max_retries=1, backoff=0, connect_timeout=1)
+        with self.assertRaises(requests.ConnectionError):
+            client.generate("hi")
+        self.assertEqual(client.stats()["last_call"]["attempts"], 2)
+
+
+class _PatchAllMixin:
+    """Подмены модульных синглтонов (клиент Ollama, кэш, допуск) на время теста."""
+
+    def _patch_all(self, patches):
+        for target, value in patches:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class AsyncGenerationTests(_PatchAllMixin, SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(response=json.dumps(GOLDEN_COURSE), delay=0.2).start()
+        self._patch_all(
+            [
+                ("api.ollama_client._client", OllamaClient(host=self.fake.url)),
+                ("api.llm_cache._cache", LLMCache(None)),
+            ]
+        )
+        self.addCleanup(self.fake.stop)
+
+    async def test_concurrent_blueprints(self):
+        async def one(i):
+            return await self.async_client.post(
+                "/api/async/generate/blueprint/",
+                {"topic": f"Python {i}"},
+                content_type="application/json",
+            )
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        responses = await asyncio.gather(*(one(i) for i in range(10)))
+        # 10 ответов по 0.2 с параллельно, а не по очереди
+        self.assertLess(loop.time() - started, 1.5)
+        self.assertEqual({r.status_code for r in responses}, {200})
+        self.assertEqual(responses[0].json()["topic"], GOLDEN_COURSE["topic"])
+
+    async def test_blueprint_requires_topic(self):
+        resp = await self.async_client.post(
+            "/api/async/generate/blueprint/", {}, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 400)
+
+    async def test_client_retries_and_reuses_connections(self):
+        self.fake.delay = 0
+        self.fake.fail_first = 2
+        client = AsyncOllamaClient(host=self.fake.url, max_retries=2, backoff=0)
+        try:
+            self.assertEqual(json.loads(await client.generate("hi")), GOLDEN_COURSE)
+            await client.generate("again")
+        finally:
+            await client.aclose()
+        self.assertEqual(len(self.fake.requests), 4)
+        self.assertEqual(self.fake.connections, 1)
+
+    async def test_client_no_retry_on_4xx(self):
+        self.fake.delay = 0
+        self.fake.fail_first = 1
+        self.fake.fail_status = 404
+        client = AsyncOllamaClient(host=self.fake.url, max_retries=3, backoff=0)
+        with self.assertRaises(OllamaHTTPError):
+            await client.generate("hi")
+        await client.aclose()
+        self.assertEqual(len(self.fake.requests), 1)
+
+    def test_client_closed_with_its_loop(self):
+        # async view под WSGI: свой loop на каждый запрос, клиент не должен его пережить
+        self.fake.delay = 0
+        seen = []
+
+        async def call():
+            client = get_async_client()
+            seen.append(client)
+            return await client.generate("hi")
+
+        for _ in range(3):
+            async_to_sync(call)()
+        self.assertEqual(len({id(c) for c in seen}), 3)
+        self.assertTrue(all(c.http.is_closed for c in seen))
+        self.assertEqual(len(ollama_client._async_clients), 0)
+
+
+class AdmissionTests(_PatchAllMixin, SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(response=json.dumps(GOLDEN_COURSE), delay=0.3).start()
+        self.admission = AdmissionControl(max_inflight=1, max_queue=1, queue_timeout=5)
+        self._patch_all(
+            [
+                ("api.ollama_client._client", OllamaClient(host=self.fake.url)),
+                ("api.llm_cache._cache", LLMCache(None)),
+                ("api.admission._admission", self.admission),
+            ]
+        )
+        self.addCleanup(self.fake.stop)
+
+    def _wait_queued(self, n):
+        deadline = time.monotonic() + 2
+        while (
+            sum(self.admission.stats()["queued"].values()) < n
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.005)
+
+    def test_full_queue_returns_429_with_retry_after(self):
+        release = self.admission.acquire()
+        waiter = threading.Thread(target=lambda: self.admission.acquire()())
+        waiter.start()
+        self._wait_queued(1)
+        resp = self.client.post(
+            "/api/generate/blueprint/",
+            {"topic": "Python"},
+            content_type="application/json",
+        )
+        release()
+        waiter.join()
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreaterEqual(int(resp["Retry-After"]), 1)
+        self.assertEqual(self.fake.requests, [])
+
+    def test_queue_timeout_is_503(self):
+        self.admission.queue_timeout = 0.05
+        release = self.admission.acquire()
+        with self.assertRaises(Overloaded) as ctx:
+            self.admission.acquire()
+        release()
+        self.assertEqual(ctx.exception.status, 503)
+        self.assertEqual(
+            self.admission.stats()["queued"], {"interactive": 0, "batch": 0}
+        )
+        self.admission.acquire()()  # ушедший ожидающий не держит слот
+
+    def test_interactive_goes_before_batch(self):
+        order = []
+        release = self.admission.acquire()
+
+        def take(name, priority):
+            with self.admission.slot(priority):
+                order.append(name)
+
+        threads = [threading.Thread(target=take, args=("batch", BATCH))]
+        threads[0].start()
+        self._wait_queued(1)
+        threads.append(threading.Thread(target=take, args=("interactive", INTERACTIVE)))
+        threads[1].start()
+        self._wait_queued(2)
+        release()
+        for t in threads:
+            t.join()
+        self.assertEqual(order, ["interactive", "batch"])
+
+    def test_follower_of_queued_leader_times_out(self):
+        self.admission.queue_timeout = 0.05
+        release = self.admission.acquire()
+        leader = threading.Thread(
+            target=lambda: self.admission.call("k", lambda: "batch", BATCH)
+        )
+        leader.start()
+        self._wait_queued(1)
+        with self.assertRaises(Overloaded) as ctx:
+            self.admission.call("k", lambda: "own", INTERACTIVE)
+        self.assertEqual(ctx.exception.status, 503)
+
+        async def follow():
+            return await self.admission.acall("k", self._never_called, INTERACTIVE)
+
+        with self.assertRaises(Overloaded):
+            asyncio.run(follow())
+        release()
+        leader.join()
+
+    def test_follower_of_running_leader_waits_past_queue_timeout(self):
+        self.admission.queue_timeout = 0.05
+
+        def slow():
+            time.sleep(0.3)
+            return "done"
+
+        leader = threading.Thread(target=lambda: self.admission.call("k", slow, BATCH))
+        leader.start()
+        while not self.admission.stats()["inflight"]:
+            time.sleep(0.005)
+        self.assertEqual(
+            self.admission.call("k", self._never_called, INTERACTIVE), "done"
+        )
+        leader.join()
+
+    @staticmethod
+    def _never_called():
+        raise AssertionError("follower must not call the model")
+
+    def test_identical_prompts_share_one_call(self):
+        self.admission.max_queue = (
+            0  # ждать слот некому: остальные должны присоединиться к первому
+        )
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    run_generation("same prompt", finalize_blueprint)
+                )
+            )
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(self.fake.requests), 1)
+        self.assertEqual(self.admission.stats()["coalesced"], 4)
+
+    def test_stream_closed_before_first_chunk_releases_slot(self):
+        resp = self.client.post(
+            "/api/generate/blueprint/stream/",
+            {"topic": "Python"},
+            content_type="application/json",
+        )
+        self.assertEqual(self.admission.stats()["inflight"], 1)
+        resp.close()  # клиент ушёл, генератор так и не запускался
+        self.assertEqual(self.admission.stats()["inflight"], 0)
+        self.assertEqual(self.fake.requests, [])
+
+    async def test_async_view_shares_call_with_sync(self):
+        sync_call = asyncio.to_thread(
+            run_generation, "Python prompt", finalize_blueprint
+        )
+        task = asyncio.ensure_future(sync_call)
+        await asyncio.sleep(0.1)
+        with mock.patch(
+            "api.async_views.blueprint_prompt", return_value="Python prompt"
+        ):
+            resp = await self.async_client.post(
+                "/api/async/generate/blueprint/",
+                {"topic": "Python"},
+                content_type="application/json",
+            )
+        await task
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(self.fake.requests), 1)
+
+
+class StreamingGenerationTests(_PatchAllMixin, SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(
+            response=json.dumps(GOLDEN_COURSE), chunk_size=50
+        ).start()
+        self._patch_all(
+            [
+                ("api.ollama_client._client", OllamaClient(host=self.fake.url)),
+                ("api.llm_cache._cache", LLMCache(None)),
+            ]
+        )
+        self.addCleanup(self.fake.stop)
+
+    def test_blueprint_ndjson(self):
+        resp = self.client.post(
+            "/api/generate/blueprint/stream/",
+            {"topic": "Python"},
+            content_type="application/json",
+        )
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        events = [
+            json.loads(line) for line in b"".join(resp.streaming_content).splitlines()
+        ]
+        tokens = [e["text"] for e in events if e["type"] == "token"]
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual("".join(tokens), json.dumps(GOLDEN_COURSE))
+        self.assertEqual(events[-1]["type"], "result")
+        self.assertEqual(events[-1]["data"]["topic"], GOLDEN_COURSE["topic"])
+        self.assertTrue(self.fake.requests[-1][1]["stream"])
+
+    def test_blueprint_sse(self):
+        resp = self.client.post(
+            "/api/generate/blueprint/stream/",
+            {"topic": "Python"},
+            content_type="application/json",
+            HTTP_ACCEPT="text/event-stream",
+        )
+        body = b"".join(resp.streaming_content).decode()
+        self.assertTrue(body.startswith("event: token\ndata: "))
+        self.assertIn("event: result\n", body)
+
+    def test_blueprint_requires_topic(self):
+        resp = self.client.post(
+            "/api/generate/blueprint/stream/", {}, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 400)
+
+    def test_non_streaming_blueprint_unchanged(self):
+        resp = self.client.post(
+            "/api/generate/blueprint/",
+            {"topic": "Python"},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()["modules"]), len(GOLDEN_COURSE["modules"]))
+
+
+class LLMCacheTests(_PatchAllMixin, SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(response=json.dumps(GOLDEN_COURSE)).start()
+        self.addCleanup(self.fake.stop)
+        self.cache = LLMCache(MemoryBackend())
+        self._patch_all(
+            [
+                ("api.ollama_client._client", OllamaClient(host=self.fake.url)),
+                ("api.llm_cache._cache", self.cache),
+            ]
+        )
+
+    def _post(self, path, **extra):
+        return self.client.post(
+            path, {"topic": "Python", **extra}, content_type="application/json"
+        )
+
+    def test_repeat_request_hits_cache(self):
+        first = self._post("/api/generate/blueprint/")
+        second = self._post("/api/generate/blueprint/")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(len(self.fake.requests), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self._post("/api/generate/blueprint/", no_cache=True)
+        self.assertEqual(len(self.fake.requests), 2)
+        self.assertEqual(self.cache.bypassed, 1)
+
+        # другой промпт — другой ключ
+        self._post("/api/generate/blueprint/", level="advanced")
+        self.assertEqual(len(self.fake.requests), 3)
+
+    def test_stream_uses_cache(self):
+        self._post("/api/generate/blueprint/")
+        resp = self._post("/api/generate/blueprint/stream/")
+        events = [
+            json.loads(line) for line in b"".join(resp.streaming_content).splitlines()
+        ]
+        self.assertTrue(events[-1]["cached"])
+        self.assertEqual(len(self.fake.requests), 1)
+
+    def test_unparsable_answer_not_cached(self):
+        self.fake.response = "no json here"
+        self.assertEqual(self._post("/api/generate/blueprint/").status_code, 500)
+        self.assertEqual(self.cache.stores, 0)
+
+    def test_memory_lru_and_ttl(self):
+        backend = MemoryBackend(max_entries=2)
+        backend.set("a", "1", ttl=60)
+        backend.set("b", "2", ttl=60)
+        backend.get("a")
+        backend.set("c", "3", ttl=60)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), "1")
+        backend.set("d", "4", ttl=-1)
+        self.assertIsNone(backend.get("d"))
+
+    def test_sqlite_eviction_by_bytes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SQLiteBackend(
+                os.path.join(tmp, "c.sqlite3"), max_entries=10, max_bytes=10
+            )
+            backend.set("a", "12345", ttl=60)
+            backend.set("b", "12345", ttl=60)
+            backend.get("a")
+            backend.set("c", "12345", ttl=60)
+            self.assertIsNone(backend.get("b"))
+            self.assertEqual(backend.get("a"), "12345")
+            self.assertEqual(backend.size(), {"entries": 2, "bytes": 10})
+            backend._conn.close()
+
+
+class GenerationJobTests(_PatchAllMixin, TestCase):
+    def setUp(self):
+        self.fake = FakeOllama(response=json.dumps(GOLDEN_COURSE)).start()
+        self.addCleanup(self.fake.stop)
+        self._patch_all(
+            [
+                ("api.ollama_client._client", OllamaClient(host=self.fake.url)),
+                ("api.llm_cache._cache", LLMCache(None)),
+                ("api.jobs.JOBS_IN_PROCESS", False),
+            ]
+        )
+
+    def test_polling_starts_in_process_runner(self):
+        job = GenerationJob.objects.create(
+            kind="blueprint", payload_json={"topic": "Python"}
+        )
+        with mock.patch("api.jobs.JOBS_IN_PROCESS", True), mock.patch(
+            "api.jobs._runner", None
+        ), mock.patch("api.jobs.JobRunner") as runner_cls:
+            self.client.get(f"/api/jobs/{job.id}/")
+            self.client.get(f"/api/jobs/{job.id}/result")
+        runner_cls.return_value.start.assert_called_once_with()
+
+    def test_submit_poll_result(self):
+        resp = self.client.post(
+            "/api/jobs/blueprint/", {"topic": "Python"}, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 202)
+        job_id = resp.json()["job_id"]
+        self.assertEqual(self.client.get(f"/api/jobs/{job_id}/result").status_code, 202)
+        self.assertEqual(len(self.fake.requests), 0)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(
+            self.client.get(f"/api/jobs/{job_id}/").json()["status"], "done"
+        )
+        result = self.client.get(f"/api/jobs/{job_id}/result")
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json()["topic"], GOLDEN_COURSE["topic"])
+
+    def test_failed_job(self):
+        self.fake.response = "not json"
+        job_id = self.client.post(
+            "/api/jobs/blueprint/", {"topic": "Python"}, content_type="application/json"
+        ).json()["job_id"]
+        jobs.run_pending()
+        resp = self.client.get(f"/api/jobs/{job_id}/result")
+        self.assertEqual(resp.status_code, 500)
+        self.assertIn("generation_error", resp.json()["detail"])
+
+    def test_validation_happens_on_submit(self):
+        self.assertEqual(
+            self.client.post(
+                "/api/jobs/blueprint/", {}, content_type="application/json"
+            ).status_code,
+            400,
+        )
+        self.assertEqual(
+            self.client.post(
+                "/api/jobs/lesson/", {"course_id": 999}, content_type="application/json"
+            ).status_code,
+            404,
+        )
+        self.assertFalse(GenerationJob.objects.exists())
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = GenerationJob.objects.create(
+            kind="blueprint",
+            payload_json={"topic": "Python"},
+            status=GenerationJob.RUNNING,
+        )
+        GenerationJob.objects.filter(id=job.id).update(
+            started_at=timezone.now() - timedelta(hours=1), attempts=1
+        )
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (GenerationJob.DONE, 2))
+
+    def test_heartbeat_not_start_time_decides_staleness(self):
+        jobs.submit("blueprint", {"topic": "Python"})
+        job = jobs.claim_next()
+        GenerationJob.objects.filter(id=job.id).update(
+            started_at=timezone.now() - timedelta(hours=2)
+        )
+        self.assertEqual(
+            jobs.requeue_stale(), 0
+        )  # долгое задание с живым heartbeat не брошено
+        GenerationJob.objects.filter(id=job.id).update(
+            heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(jobs.requeue_stale(), 1)
+
+    def test_heartbeat_thread(self):
+        owned = mock.Mock()
+        owned.return_value.update.side_effect = [1, 1, 0]
+        job = GenerationJob(kind="blueprint", claim="x")
+        with mock.patch("api.jobs._owned", owned), mock.patch("api.jobs.connection"):
+            beat = jobs._Heartbeat(job, interval=0.01)
+            with beat:
+                beat._thread.join(
+                    5
+                )  # после третьего тика задание "не наше" — поток выходит сам
+        self.assertEqual(owned.return_value.update.call_count, 3)
+
+    def test_requeued_job_result_is_not_written_by_old_worker(self):
+        jobs.submit("blueprint", {"topic": "Python"})
+        old = jobs.claim_next()
+        GenerationJob.objects.filter(id=old.id).update(
+            heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+        jobs.requeue_stale()
+        new = jobs.claim_next()
+        self.assertNotEqual(new.claim, old.claim)
+        jobs.run_job(old)
+        new.refresh_from_db()
+        self.assertEqual((new.status, new.result_json), (GenerationJob.RUNNING, None))
+        jobs.run_job(new)
+        new.refresh_from_db()
+        self.assertEqual(new.status, GenerationJob.DONE)
+
+    def test_generate_course_is_resumable(self):
+        course_id = self.client.post(
+            "/api/courses/save_blueprint/",
+            GOLDEN_COURSE,
+            content_type="application/json",
+        ).json()["course_id"]
+        module = Module.objects.get(course_id=course_id, order=1)
+        Lesson.objects.create(
+            module=module, order=1, title="Kept", content_json={"title": "Kept"}
+        )
+        self.fake.response = json.dumps(
+            {"title": "Generated", "theory_md": "# Generated"}
+        )
+
+        resp = self.client.post(
+            f"/api/courses/{course_id}/generate/",
+            {"concurrency": 3},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 202)
+        jobs.run_pending()
+        job = self.client.get(f"/api/jobs/{resp.json()['job_id']}/").json()
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(
+            (
+                job["progress"]["total"],
+                job["progress"]["skipped"],
+                job["progress"]["generated"],
+            ),
+            (8, 1, 7),
+        )
+        self.assertEqual(len(self.fake.requests), 7)
+        self.assertEqual(Lesson.objects.get(module=module, order=1).title, "Kept")
+
+        self.client.post(
+            f"/api/courses/{course_id}/generate/", {}, content_type="application/json"
+        )
+        jobs.run_pending()
+        self.assertEqual(len(self.fake.requests), 7)
+        self.assertEqual(Lesson.objects.filter(module__course_id=course_id).count(), 8)
+
+    def test_generate_course_validates_concurrency(self):
+        course_id = self.client.post(
+            "/api/courses/save_blueprint/",
+            GOLDEN_COURSE,
+            content_type="application/json",
+        ).json()["course_id"]
+        url = f"/api/courses/{course_id}/generate/"
+        for bad in ("abc", []):
+            self.assertEqual(
+                self.client.post(
+                    url, {"concurrency": bad}, content_type="application/json"
+                ).status_code,
+                400,
+            )
+        for asked, used in ((0, 1), (-5, 1), (10**6, GENERATION_MAX_CONCURRENCY)):
+            job_id = self.client.post(
+                url, {"concurrency": asked}, content_type="application/json"
+            ).json()["job_id"]
+            self.assertEqual(
+                GenerationJob.objects.get(id=job_id).payload_json["concurrency"], used
+            )
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch("api.exporter.EXPORT_CACHE_DIR", Path(tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.course_id = self.client.post(
+            "/api/courses/save_blueprint/",
+            GOLDEN_COURSE,
+            content_type="application/json",
+        ).json()["course_id"]
+        for m in Module.objects.filter(course_id=self.course_id):
+            for n in range(1, m.lessons + 1):
+                Lesson.objects.create(
+                    module=m,
+                    order=n,
+                    title=f"L{n}",
+                    content_json={
+                        "title": f"{m.title} {n}",
+                        "theory_md": "text " * 200,
+                        "code_examples": [
+                            {"filename": "ex.py", "content": f"print({n})\n"}
+                        ],
+                    },
+                )
+
+    def test_streamed_zip_is_valid(self):
+        resp = self.client.get(f"/api/courses/{self.course_id}/export")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        chunks = list(resp.streaming_content)
+        self.assertGreater(len(chunks), 8)  # по куску на урок + хвост архива
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as z:
+            self.assertIsNone(z.testzip())
+            manifest = json.loads(z.read("manifest.json"))
+            self.assertEqual(sum(len(m["lessons"]) for m in manifest["modules"]), 8)
+            self.assertEqual(
+                z.read(
+                    manifest["modules"][0]["lessons"][1]["path"] + "code_examples/ex.py"
+                ),
+                b"print(2)\n",
+            )
+
+    def test_lessons_changed_mid_export_do_not_break_archive(self):
+        chunks = exporter.iter_course_zip(self.course_id)  # манифест уже прочитан
+        module = Module.objects.get(course_id=self.course_id, order=1)
+        module.lesson_set.get(order=1).delete()
+        Lesson.objects.create(
+            module=module, order=99, title="Late", content_json={"theory_md": "late"}
+        )
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as z:
+            self.assertIsNone(z.testzip())
+            lessons = json.loads(z.read("manifest.json"))["modules"][0]["lessons"]
+            self.assertEqual([l["title"] for l in lessons][:2], ["L1", "L2"])
+            names = z.namelist()
+            self.assertIn(
+                lessons[0]["path"] + "lesson.md", names
+            )  # удалённый — пустой урок
+            self.assertNotIn(lessons[0]["path"] + "code_examples/ex.py", names)
+            self.assertIn(lessons[1]["path"] + "code_examples/ex.py", names)
+            self.assertFalse(any("late" in n for n in names))
+
+    def test_export_query_count_does_not_grow(self):
+        with self.assertNumQueries(4):  # курс, модули, заголовки уроков, контент уроков
+            small = export_course_zip(self.course_id)
+        m = Module.objects.create(
+            course_id=self.course_id, order=4, title="Extra", lessons=5
+        )
+        for n in range(1, 6):
+            Lesson.objects.create(
+                module=m, order=n, title=f"E{n}", content_json={"theory_md": "x"}
+            )
+        with mock.patch("api.exporter.EXPORT_LESSON_CHUNK", 2), self.assertNumQueries(
+            4
+        ):
+            self.assertGreater(len(export_course_zip(self.course_id)), len(small))
+
+    def test_missing_course(self):
+        self.assertEqual(self.client.get("/api/courses/999/export").status_code, 404)
+
+    def test_pooled_export_matches_serial(self):
+        def unpack(data):
+            with zipfile.ZipFile(io.BytesIO(data)) as z:
+                return [(i.filename, z.read(i)) for i in z.infolist()]
+
+        serial = unpack(
+            b"".join(exporter.iter_course_zip(self.course_id, workers=1, level=1))
+        )
+        with tempfile.TemporaryDirectory() as tmp, mock.patch(
+            "api.exporter.EXPORT_CACHE_DIR", Path(tmp)
+        ):
+            pooled = unpack(
+                b"".join(
+                    exporter.iter_course_zip(
+                        self.course_id, workers=3, pool="thread", level=9
+                    )
+                )
+            )
+        self.assertEqual(pooled, serial)
+
+    def test_process_pool_under_spawn(self):
+        def unpack(data):
+            with zipfile.ZipFile(io.BytesIO(data)) as z:
+                return [(i.filename, z.read(i)) for i in z.infolist()]
+
+        serial = unpack(
+            b"".join(exporter.iter_course_zip(self.course_id, workers=1, level=1))
+        )
+        with tempfile.TemporaryDirectory() as tmp, mock.patch(
+            "api.exporter.EXPORT_CACHE_DIR", Path(tmp)
+        ), mock.patch("api.exporter.EXPORT_POOL_START", "spawn"):
+            pooled = unpack(
+                b"".join(
+                    exporter.iter_course_zip(
+                        self.course_id, workers=2, pool="process", level=9
+                    )
+                )
+            )
+            self.assertTrue(any(Path(tmp).glob("fragments/*/*.frag")))
+        self.assertEqual(pooled, serial)
+
+    def test_cached_archive_and_etag(self):
+        url = f"/api/courses/{self.course_id}/export"
+        first = self.client.get(url)
+        body = b"".join(first.streaming_content)
+        etag = first["ETag"]
+
+        with mock.patch(
+            "api.export_render.lesson_to_files"
+        ) as render, self.assertNumQueries(1):
+            second = self.client.get(url)
+            self.assertEqual(b"".join(second.streaming_content), body)
+        render.assert_not_called()
+        self.assertEqual(second["ETag"], etag)
+        umask = os.umask(0)
+        os.umask(umask)
+        written = [
+            *exporter.EXPORT_CACHE_DIR.glob("courses/*.zip"),
+            *exporter.EXPORT_CACHE_DIR.glob("fragments/*/*"),
+        ]
+        self.assertGreater(len(written), 1)
+        for path in written:
+            self.assertEqual(path.stat().st_mode & 0o777, 0o666 & ~umask, path.name)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH="W/" + etag).status_code, 304
+        )
+        with mock.patch("api.exporter.EXPORT_COMPRESS_LEVEL", 1):
+            relevel = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(relevel.status_code, 200)
+            self.assertNotEqual(relevel["ETag"], etag)
+            b"".join(relevel.streaming_content)
+
+    def test_edit_rerenders_only_that_lesson(self):
+        url = f"/api/courses/{self.course_id}/export"
+        first = self.client.get(url)
+        b"".join(first.streaming_content)
+        etag = first["ETag"]
+        module = Module.objects.get(course_id=self.course_id, order=2)
+        saved = self.client.post(
+            "/api/lessons/save",
+            {
+                "module_id": module.id,
+                "lesson_order": 1,
+                "lesson": repair_lesson(
+                    {"title": "Edited", "theory_md": "new text"}, "Python"
+                ),
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(saved.status_code, 200)
+
+        with mock.patch(
+            "api.export_render.lesson_to_files", wraps=export_render.lesson_to_files
+        ) as render:
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 200)
+            with zipfile.ZipFile(io.BytesIO(b"".join(resp.streaming_content))) as z:
+                self.assertIsNone(z.testzip())
+                self.assertIn(
+                    "modules/02_control-flow/lesson_01_edited/lesson.md", z.namelist()
+                )
+        self.assertEqual(render.call_count, 1)
+        self.assertNotEqual(resp["ETag"], etag)
+        self.assertEqual(len(list(exporter.EXPORT_CACHE_DIR.glob("courses/*.zip"))), 1)
+
+    def test_admin_style_edits_and_deletes_change_etag(self):
+        url = f"/api/courses/{self.course_id}/export"
+        etags = [self.client.get(url)["ETag"]]
+
+        course = Course.objects.get(id=self.course_id)
+        version = course.content_version
+        course.capstone = "Changed"
+        course.save()
+        self.assertEqual(course.content_version, version + 1)
+        module = Module.objects.get(course_id=self.course_id, order=3)
+        module.title = "Renamed"
+        module.save()
+        etags.append(self.client.get(url)["ETag"])
+        Lesson.objects.filter(module=module).first().delete()
+        etags.append(self.client.get(url)["ETag"])
+        with self.assertNumQueries(
+            4
+        ):  # уроки, два DELETE и один UPDATE версии — не по UPDATE на урок
+            module.delete()
+        etags.append(self.client.get(url)["ETag"])
+        self.assertEqual(len(set(etags)), 4)
+        self.assertEqual(
+            Course.objects.get(id=self.course_id).content_version, version + 4
+        )
+
+    def test_prune_removes_orphaned_fragments_and_archives(self):
+        b"".join(
+            self.client.get(f"/api/courses/{self.course_id}/export").streaming_content
+        )
+        fragments = set(exporter.EXPORT_CACHE_DIR.glob("fragments/*/*.frag"))
+        self.assertEqual(len(fragments), 8)
+        lesson = Lesson.objects.filter(module__course_id=self.course_id).first()
+        lesson.content_json = {"title": "Edited", "theory_md": "new"}
+        lesson.save()
+        b"".join(
+            self.client.get(f"/api/courses/{self.course_id}/export").streaming_content
+        )
+        other = Course.objects.create(topic="Other", level="beginner", capstone="-")
+        b"".join(self.client.get(f"/api/courses/{other.id}/export").streaming_content)
+        other.delete()
+
+        out = io.StringIO()
+        call_command("prune_export_cache", "--dry-run", stdout=out)
+        self.assertIn("1 fragments, 1 archives", out.getvalue())
+        self.assertEqual(
+            len(list(exporter.EXPORT_CACHE_DIR.glob("fragments/*/*.frag"))), 9
+        )
+        stats = exporter.prune_cache()
+        self.assertEqual((stats["fragments"], stats["archives"]), (1, 1))
+        remaining = set(exporter.EXPORT_CACHE_DIR.glob("fragments/*/*.frag"))
+        self.assertEqual(len(remaining), 8)
+        self.assertEqual(len(fragments - remaining), 1)
+        self.assertEqual(len(list(exporter.EXPORT_CACHE_DIR.glob("courses/*.zip"))), 1)
+
+
+class CourseListTests(TestCase):
+    def setUp(self):
+        stamp = timezone.now()
+        for i in range(7):
+            course = Course.objects.create(
+                topic=f"T{i}", level="beginner" if i % 2 else "advanced", capstone="-"
+            )
+            for n in range(1, i % 3 + 1):
+                Module.objects.create(course=course, order=n, title=f"M{n}")
+        # одинаковые created_at — граница страницы должна резаться по id
+        Course.objects.update(created_at=stamp)
+
+    def test_single_query_per_page(self):
+        with self.assertNumQueries(1):
+            resp = self.client.get("/api/courses/", {"limit": 3})
+        body = resp.json()
+        self.assertEqual(len(body["results"]), 3)
+        self.assertEqual(
+            body["results"][0]["modules"],
+            Course.objects.get(id=body["results"][0]["id"]).modules.count(),
+        )
+
+    def test_keyset_walk_covers_all_courses_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, "fields": "id"}
+            if cursor:
+                params["cursor"] = cursor
+            body = self.client.get("/api/courses/", params).json()
+            seen += [r["id"] for r in body["results"]]
+            cursor = body["next"]
+            if not cursor:
+                break
+        self.assertEqual(
+            seen, sorted(Course.objects.values_list("id", flat=True), reverse=True)
+        )
+
+    def test_filters_and_fields(self):
+        body = self.client.get(
+            "/api/courses/", {"level": "beginner", "fields": "id,level"}
+        ).json()
+        self.assertEqual(len(body["results"]), 3)
+        self.assertEqual({tuple(r) for r in body["results"]}, {("id", "level")})
+        self.assertEqual(
+            self.client.get("/api/courses/", {"fields": "id,secret"}).status_code, 400
+        )
+        self.assertEqual(
+            self.client.get("/api/courses/", {"cursor": "garbage"}).status_code, 400
+        )
+        self.assertEqual(
+            self.client.get("/api/courses/", {"owner": "me"}).status_code, 400
+        )
+
+
+class BulkImportTests(TestCase):
+    def test_import_courses_in_few_queries(self):
+        lesson = repair_lesson({"title": "Intro", "theory_md": "text"}, "Python")
+        course = dict(
+            GOLDEN_COURSE,
+            lessons=[
+                {"module_order": 1, "lesson_order": n, "lesson": lesson} for n in (1, 2)
+            ],
+        )
+        items = [course] * 5 + [{"topic": "broken"}]
+        # пачка: SAVEPOINT/RELEASE + INSERT курсов, модулей, уроков — на 5 курсов сразу
+        with self.assertNumQueries(5):
+            summary = importer.import_courses(items, batch_size=10)
+        self.assertEqual(
+            (
+                summary["courses"],
+                summary["modules"],
+                summary["lessons"],
+                summary["invalid"],
+            ),
+            (5, 15, 10, 1),
+        )
+        self.assertEqual(summary["errors"][0]["index"], 5)
+        self.assertEqual(
+            Lesson.objects.filter(module__course_id=summary["course_ids"][0]).count(), 2
+        )
+
+        resp = self.client.post(
+            "/api/courses/import/",
+            {"courses": [GOLDEN_COURSE] * 3},
+            content_type="application/json",
+        )
+        self.assertEqual((resp.status_code, resp.json()["courses"]), (201, 3))
+        self.assertEqual(Course.objects.count(), 8)
+
+    def test_malformed_lessons_skip_only_that_course(self):
+        items = [
+            dict(GOLDEN_COURSE, lessons=["x"]),
+            dict(GOLDEN_COURSE, lessons={"a": 1}),
+            GOLDEN_COURSE,
+        ]
+        summary = importer.import_courses(items)
+        self.assertEqual((summary["courses"], summary["invalid"]), (1, 2))
+        self.assertEqual([e["index"] for e in summary["errors"]], [0, 1])
+        resp = self.client.post(
+            "/api/courses/import/",
+            {"courses": items[:1]},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bulk_save_lessons_upserts(self):
+        course_id = self.client.post(
+            "/api/courses/save_blueprint/",
+            GOLDEN_COURSE,
+            content_type="application/json",
+        ).json()["course_id"]
+        module = Module.objects.get(course_id=course_id, order=1)
+        version = Course.objects.get(id=course_id).content_version
+        lessons = [
+            {
+                "module_id": module.id,
+                "lesson_order": n,
+                "lesson": repair_lesson({"title": f"L{n}", "theory_md": "x"}, "Python"),
+            }
+            for n in (1, 2)
+        ]
+        self.assertEqual(
+            self.client.post(
+                "/api/lessons/bulk_save",
+                {"lessons": lessons},
+                content_type="application/json",
+            ).json()["saved"],
+            2,
+        )
+        lessons[0]["lesson"]["title"] = "Renamed"
+        self.client.post(
+            "/api/lessons/bulk_save",
+            {"lessons": lessons[:1]},
+            content_type="application/json",
+        )
+        self.assertEqual(
+            list(module.lesson_set.values_list("title", flat=True)), ["Renamed", "L2"]
+        )
+        self.assertGreater(Course.objects.get(id=course_id).content_version, version)
+
+        lessons[1]["module_id"] = 999
+        resp = self.client.post(
+            "/api/lessons/bulk_save",
+            {"lessons": lessons},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 400)
+
+
+class LessonListingTests(TestCase):
+    def setUp(self):
+        course_id = self.client.post(
+            "/api/courses/save_blueprint/",
+            GOLDEN_COURSE,
+            content_type="application/json",
+        ).json()["course_id"]
+        self.module = Module.objects.get(course_id=course_id, order=1)
+        lesson = repair_lesson(
+            {"title": "Intro", "theory_md": "long " * 1000, "reading_time_min": 12},
+            "Python",
+        )
+        self.client.post(
+            "/api/lessons/save",
+            {"module_id": self.module.id, "lesson_order": 1, "lesson": lesson},
+            content_type="application/json",
+        )
+
+    def test_listing_is_summary_only(self):
+        url = f"/courses/{self.module.id}/lessons/"
+        with self.assertNumQueries(2):
+            rows = self.client.get(url).json()
+        self.assertEqual(
+            rows,
+            [
+                {
+                    "id": rows[0]["id"],
+                    "order": 1,
+                    "title": "Intro",
+                    "reading_time_min": 12,
+                    "quiz_count": 3,
+                }
+            ],
+        )
+        self.assertIn("content_json", self.client.get(url, {"full": "1"}).json()[0])
+        detail = self.client.get(f"/api/lessons/{rows[0]['id']}/").json()
+        self.assertEqual(detail["content_json"]["theory_md"][:4], "long")
+
+    def test_add_lesson_picks_next_order_after_gaps(self):
+        Lesson.objects.create(
+            module=self.module, order=5, title="Late", content_json={"quiz": [{}, {}]}
+        )
+        with self.assertNumQueries(3):  # модуль+MAX(order), INSERT, content_version
+            resp = self.client.post(
+                f"/courses/{self.module.id}/lessons/add/",
+                {"title": "Next"},
+                content_type="application/json",
+            )
+        self.assertEqual(resp.json()["order"], 6)
+        self.assertEqual(Lesson.objects.get(order=5, module=self.module).quiz_count, 2)
@@ -1,145 +1,40 @@
 from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework import status
 
-from pydantic import ValidationError
-from .ollama_client import call_ollama, parse_json_loose
-from .schemas import CourseBlueprint, LessonContent
-
-from django.db import transaction
-from .models import Course, Module, Lesson
-
-from pathlib import Path
-from .rag import BM25Index
+import base64
+import json
+from datetime import datetime
 
-from django.http import HttpResponse
-from .exporter import export_course_zip
-
-# ──────────────────────────────────────────────────────────────────────────────
-# ЖЕСТКИЕ ИНСТРУКЦИИ ДЛЯ МОДЕЛИ
-# ──────────────────────────────────────────────────────────────────────────────
-BLUEPRINT_INSTRUCTIONS = """
-You are Course Architect AI.
-
-Generate a STRICT JSON object for a programming course blueprint that matches EXACTLY this schema:
-
-{
-  "topic": string,
-  "level": "beginner" | "intermediate" | "advanced",
-  "duration_weeks": integer (1..52),
-  "prerequisites": string[],                    // 0..10
-  "learning_outcomes": string[],                // 5..12, measurable
-  "modules": [                                  // 3..20 modules
-    {
-      "title": string,
-      "objectives": string[],                   // 3..8 items, action verbs
-      "lessons": integer,                       // 2..8
-      "quiz_items": integer,                    // 5..15
-      "project": string | null
-    }
-  ],
-  "capstone": string,
-  "references": [                               // 2..12
-    {"title": string, "url": string, "license": "MIT" | "BSD" | "Apache-2.0" | "CC-BY" | "Docs"}
-  ]
-}
-
-HARD RULES (must always be satisfied):
-- Return JSON ONLY. No prose, no markdown.
-- learning_outcomes: at least 5 items (5..12).
-- modules: between 3 and 20 items.
-- For each module:
-  - objectives: 3..8 items (add realistic extra ones if needed).
-  - lessons: integer 2..8 (never above 8).
-  - quiz_items: integer 5..15 (never below 5).
-- Use official docs or permissive-licensed sources only (license 'Docs' for official docs).
-- If the user's duration_weeks is short, adjust scope so all numeric constraints still hold.
-"""
-
-# ──────────────────────────────────────────────────────────────────────────────
-# ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ "АВТО-РЕМОНТА" JSON
-# ──────────────────────────────────────────────────────────────────────────────
-def clamp(n: int, lo: int, hi: int) -> int:
-    return max(lo, min(hi, int(n)))
-
-ACTION_VERBS = [
-    "Understand", "Explain", "Apply", "Implement", "Debug",
-    "Refactor", "Test", "Optimize", "Use", "Design"
-]
-
-def pad_objectives(obj_list, topic: str, need: int):
-    base = list(obj_list or [])
-    while len(base) < need:
-        base.append(f"Apply {topic} concepts in small tasks")
-    return base[:8]
-
-def pad_outcomes(lo_list, topic: str, min_len: int = 5):
-    base = list(lo_list or [])
-    verbs = iter(ACTION_VERBS)
-    while len(base) < min_len:
-        v = next(verbs, "Apply")
-        base.append(f"{v} {topic} to build small practical programs")
-    return base[:12]
-
-def ensure_references(refs, topic: str):
-    base = list(refs or [])
-    # добавим минимум официальных доков (валидные ссылки и license="Docs")
-    essentials = [
-        {"title": "Python Official Docs", "url": "https://docs.python.org/3/", "license": "Docs"},
-        {"title": "pip User Guide", "url": "https://pip.pypa.io/en/stable/", "license": "Docs"},
-    ]
-    # не дублируем существующие по url
-    have = {r.get("url") for r in base if isinstance(r, dict)}
-    for r in essentials:
-        if r["url"] not in have:
-            base.append(r)
-    return base[:12]
-
-def repair_blueprint_data(data: dict) -> dict:
-    """Подправляем поля до мин/макс ограничений схемы."""
-    topic = (data.get("topic") or "the topic").strip()
-
-    # learning_outcomes: 5..12
-    data["learning_outcomes"] = pad_outcomes(data.get("learning_outcomes"), topic, 5)
-
-    # modules: 3..20 (если меньше 3 — продублируем/упростим; если больше 20 — обрежем)
-    modules = list(data.get("modules") or [])
-    if len(modules) < 3 and modules:
-        while len(modules) < 3:
-            # добавляем упрощённую копию последнего модуля
-            clone = dict(modules[-1])
-            clone["title"] = f"{clone.get('title', 'Module')} (extended)"
-            modules.append(clone)
-    data["modules"] = modules[:20]
-
-    # правим каждый модуль
-    fixed_modules = []
-    for m in data["modules"]:
-        m = dict(m or {})
-        m["lessons"] = clamp(m.get("lessons", 4), 2, 8)
-        m["quiz_items"] = clamp(m.get("quiz_items", 8), 5, 15)
-        m["objectives"] = pad_objectives(m.get("objectives") or [], topic, 3)
-        fixed_modules.append(m)
-    data["modules"] = fixed_modules
-
-    # references: минимум 2
-    data["references"] = ensure_references(data.get("references"), topic)
-
-    # prerequisites: максимум 10; если None — в пустой список
-    prereq = data.get("prerequisites") or []
-    data["prerequisites"] = list(prereq)[:10]
-
-    # duration_weeks границы 1..52 (на всякий)
-    data["duration_weeks"] = clamp(data.get("duration_weeks", 4), 1, 52)
-
-    # level нормализуем
-    level = (data.get("level") or "beginner").lower()
-    if level not in {"beginner", "intermediate", "advanced"}:
-        level = "beginner"
-    data["level"] = level
-
-    return data
+from .ollama_client import get_client
+from .llm_cache import get_cache
+from .admission import INTERACTIVE, Overloaded, get_admission
+from .schemas import CourseBlueprint, LessonContent
+from .generation import (
+    GENERATION_MAX_CONCURRENCY,
+    RAG_INDEX,
+    blueprint_prompt,
+    finalize_blueprint,
+    finalize_lesson,
+    lesson_prompt,
+    run_generation,
+    save_lesson_content,
+    search_index,
+    search_index_many,
+)
+from .context_packer import context_stats
+from .importer import create_course, import_courses, save_lessons_bulk
+from .rag import SEARCH_CACHE, IndexFormatError
+
+from django.db.models import Count, Max, Q
+from .models import Course, GenerationJob, Module, Lesson
+from . import jobs
+
+from django.http import FileResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from .exporter import archive_path, cached_course_zip, course_etag
 
 # ──────────────────────────────────────────────────────────────────────────────
 # ЭНДПОИНТЫ
@@ -148,6 +43,11 @@ def repair_blueprint_data(data: dict) -> dict:
 def ping(request):
     return Response({"status": "ok"})
 
+
+def _overloaded(e: Overloaded) -> Response:
+    """Очередь к модели полна (429) или слот не дождались (503) — клиенту стоит повторить позже."""
+    return Response({"detail": str(e)}, status=e.status, headers={"Retry-After": str(e.retry_after)})
+
 @api_view(["POST"])
 def generate_blueprint(request):
     """
@@ -156,40 +56,21 @@ def generate_blueprint(request):
       "topic": "Python basics",
       "level": "beginner",         # optional
       "duration_weeks": 4,         # optional
-      "goals": ["prepare..."]      # optional
+      "goals": ["prepare..."],     # optional
+      "no_cache": false            # optional, true = не брать ответ из кэша
     }
     """
     data = request.data or {}
-    topic = (data.get("topic") or "").strip()
-    level = (data.get("level") or "beginner").strip().lower()
-    duration_weeks = int(data.get("duration_weeks") or 4)
-    goals = data.get("goals") or []
-
-    if not topic:
-        return Response({"detail": "topic is required"}, status=status.HTTP_400_BAD_REQUEST)
-
-    goals_str = ""
-    if goals and isinstance(goals, list):
-        goals_str = "User goals:\n- " + "\n- ".join([str(g) for g in goals])
-
-    user_block = f"User input:\n- topic: {topic}\n- level: {level}\n- duration_weeks: {duration_weeks}\n{goals_str}"
-    prompt = f"{BLUEPRINT_INSTRUCTIONS}\n\n{user_block}\n\nReturn JSON now."
-
     try:
-        # 1) вызов модели
-        raw = call_ollama(prompt)
-        as_json = parse_json_loose(raw)
-
-        # 2) пробуем строгую валидацию
-        try:
-            blueprint = CourseBlueprint(**as_json)
-            return Response(blueprint.model_dump(mode="json"), status=200)
-        except ValidationError:
-            # 3) авто-ремонт, затем повторная валидация
-            repaired = repair_blueprint_data(as_json)
-            blueprint = CourseBlueprint(**repaired)
-            return Response(blueprint.model_dump(mode="json"), status=200)
+        prompt = blueprint_prompt(data)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    try:
+        result = run_generation(prompt, finalize_blueprint, bypass_cache=bool(data.get("no_cache")))
+        return Response(result, status=200)
+    except Overloaded as e:
+        return _overloaded(e)
     except Exception as e:
         return Response(
             {"detail": f"generation_error: {type(e).__name__}: {e}"},
@@ -197,9 +78,102 @@ def generate_blueprint(request):
         )
 
 
+class EventStreamRenderer(BaseRenderer):
+    """Чтобы DRF не отвечал 406 на Accept: text/event-stream; сами события пишет _stream_generation."""
+    media_type = "text/event-stream"
+    format = "sse"
 
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
 
 
+@api_view(["POST"])
+@renderer_classes([JSONRenderer, EventStreamRenderer])
+def generate_blueprint_stream(request):
+    """
+    То же, что generate_blueprint, но токены модели отдаются по мере генерации:
+    NDJSON ({"type": "token", "text": ...} построчно) или SSE при Accept: text/event-stream.
+    Последнее событие — {"type": "result", "data": <CourseBlueprint>} или {"type": "error", ...}.
+    """
+    data = request.data or {}
+    try:
+        prompt = blueprint_prompt(data)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return _stream_generation(request, prompt, finalize_blueprint, bool(data.get("no_cache")))
+
+
+def _format_event(event: dict, sse: bool) -> bytes:
+    payload = json.dumps(event, ensure_ascii=False)
+    if sse:
+        return f"event: {event['type']}\ndata: {payload}\n\n".encode("utf-8")
+    return (payload + "\n").encode("utf-8")
+
+
+class _ClosingStream:
+    """
+    Содержимое потокового ответа, чей close() вызывает ещё и on_close. StreamingHttpResponse
+    вызывает close() содержимого при закрытии ответа — так слот вернётся, даже если клиент
+    ушёл до первого чанка и генератор (с его finally) так и не запустился.
+    """
+
+    def __init__(self, chunks, on_close):
+        self._chunks = chunks
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def close(self):
+        try:
+            self._chunks.close()
+        finally:
+            self._on_close()
+
+
+def _stream_generation(request, prompt: str, finalize, bypass_cache: bool = False):
+    sse = "text/event-stream" in request.headers.get("Accept", "")
+    cache = get_cache()
+    cached = cache.get(prompt, bypass=bypass_cache)
+    release = None
+    if cached is None:
+        # слот берём до начала ответа, чтобы при перегрузке отдать 429/503, а не поток с ошибкой;
+        # токены у каждого потока свои, поэтому одинаковые промпты здесь не объединяются
+        try:
+            release = get_admission().acquire(INTERACTIVE)
+        except Overloaded as e:
+            return _overloaded(e)
+
+    def events():
+        try:
+            if cached is not None:
+                # из кэша — весь текст одним событием
+                yield _format_event({"type": "token", "text": cached}, sse)
+                yield _format_event({"type": "result", "data": finalize(cached), "cached": True}, sse)
+                return
+            parts = []
+            for chunk in get_client().generate_stream(prompt):
+                parts.append(chunk)
+                yield _format_event({"type": "token", "text": chunk}, sse)
+            raw = "".join(parts)
+            result = finalize(raw)
+            cache.put(prompt, raw)
+            yield _format_event({"type": "result", "data": result}, sse)
+        except Exception as e:
+            yield _format_event({"type": "error", "detail": f"generation_error: {type(e).__name__}: {e}"}, sse)
+        finally:
+            if release is not None:
+                release()
+
+    content = events() if release is None else _ClosingStream(events(), release)
+    resp = StreamingHttpResponse(
+        content, content_type="text/event-stream" if sse else "application/x-ndjson"
+    )
+    resp["Cache-Control"] = "no-cache"
+    # nginx по умолчанию буферизует ответ целиком — отключаем
+    resp["X-Accel-Buffering"] = "no"
+    return resp
+
 
 @api_view(["POST"])
 def save_blueprint(request):
@@ -214,106 +188,140 @@ def save_blueprint(request):
     except Exception as e:
         return Response({"detail": f"invalid_blueprint: {e}"}, status=400)
 
-    with transaction.atomic():
-        course = Course.objects.create(
-            owner=request.user if request.user.is_authenticated else None,
-            topic=bp.topic,
-            level=bp.level,
-            duration_weeks=bp.duration_weeks,
-            prerequisites_json=bp.prerequisites,
-            learning_outcomes_json=bp.learning_outcomes,
-            capstone=bp.capstone,
-            references_json=[r.model_dump(mode="json") for r in bp.references],
-        )
-        for idx, m in enumerate(bp.modules, start=1):
-            Module.objects.create(
-                course=course,
-                order=idx,
-                title=m.title,
-                objectives_json=m.objectives,
-                lessons=m.lessons,
-                quiz_items=m.quiz_items,
-                project=m.project,
-            )
+    course = create_course(bp, owner=request.user if request.user.is_authenticated else None)
 
     return Response({"course_id": course.id}, status=201)
 
 
 
 
-@api_view(["GET"])
-def list_courses(request):
-    qs = Course.objects.all().order_by("-created_at")
-    out = []
-    for c in qs:
-        out.append({
-            "id": c.id,
-            "topic": c.topic,
-            "level": c.level,
-            "duration_weeks": c.duration_weeks,
-            "created_at": c.created_at.isoformat(),
-            "modules": c.modules.count(),
-        })
-    return Response(out, status=200)
+COURSE_LIST_FIELDS = ("id", "topic", "level", "duration_weeks", "created_at", "modules", "owner")
+COURSE_PAGE_SIZE = 50
+COURSE_MAX_PAGE_SIZE = 200
 
 
+def _encode_course_cursor(created_at, course_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{course_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
 
 
+def _decode_course_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+    ts, course_id = raw.rsplit("|", 1)
+    created_at = datetime.fromisoformat(ts)
+    if created_at.tzinfo is None:
+        raise ValueError("naive timestamp")
+    return created_at, int(course_id)
 
 
 @api_view(["GET"])
 def list_courses(request):
-    qs = Course.objects.all().order_by("-created_at")
+    """
+    Каталог курсов, новые первыми, keyset-пагинация по (created_at, id).
+    Query: ?limit=50&cursor=<next из прошлого ответа>&level=beginner&owner=<user id>
+           &fields=id,topic,modules
+    Ответ: {"results": [...], "next": "<cursor>" | null}
+    """
+    params = request.query_params
+    fields = [f for f in (params.get("fields") or "").split(",") if f] or list(COURSE_LIST_FIELDS)
+    unknown = sorted(set(fields) - set(COURSE_LIST_FIELDS))
+    if unknown:
+        return Response({"detail": f"unknown fields: {', '.join(unknown)}"}, status=400)
+    try:
+        limit = min(max(int(params.get("limit") or COURSE_PAGE_SIZE), 1), COURSE_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({"detail": "limit must be an integer"}, status=400)
+
+    qs = Course.objects.order_by("-created_at", "-id")
+    if params.get("level"):
+        qs = qs.filter(level=params["level"])
+    if params.get("owner"):
+        try:
+            qs = qs.filter(owner_id=int(params["owner"]))
+        except ValueError:
+            return Response({"detail": "owner must be an integer"}, status=400)
+    if params.get("cursor"):
+        try:
+            created_at, last_id = _decode_course_cursor(params["cursor"])
+        except (ValueError, UnicodeDecodeError):
+            return Response({"detail": "invalid cursor"}, status=400)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id))
+
+    # одним запросом: число модулей — COUNT в том же SELECT, только запрошенные колонки
+    columns = {"id", "created_at"} | {("owner_id" if f == "owner" else f) for f in fields if f != "modules"}
+    qs = qs.values(*columns)
+    if "modules" in fields:
+        qs = qs.annotate(modules_count=Count("modules"))
+    rows = list(qs[:limit + 1])
+
     out = []
-    for c in qs:
-        out.append({
-            "id": c.id,
-            "topic": c.topic,
-            "level": c.level,
-            "duration_weeks": c.duration_weeks,
-            "created_at": c.created_at.isoformat(),
-            "modules": c.modules.count(),
-        })
-    return Response(out, status=200)
+    for row in rows[:limit]:
+        item = {}
+        for f in fields:
+            if f == "modules":
+                item[f] = row["modules_count"]
+            elif f == "owner":
+                item[f] = row["owner_id"]
+            elif f == "created_at":
+                item[f] = row["created_at"].isoformat()
+            else:
+                item[f] = row[f]
+        out.append(item)
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_course_cursor(last["created_at"], last["id"])
+    return Response({"results": out, "next": next_cursor}, status=200)
 
 
 # ───────────────────────────────────────────────
 # STEP C: Работа с уроками
 # ───────────────────────────────────────────────
 
+LESSON_LIST_FIELDS = ("id", "order", "title", "reading_time_min", "quiz_count")
+
+
 @api_view(["GET"])
 def list_lessons(request, module_id: int):
-    """Вернуть все уроки конкретного модуля"""
-    try:
-        module = Module.objects.get(id=module_id)
-    except Module.DoesNotExist:
+    """
+    Уроки модуля без контента: id/order/title и выжимка (время чтения, число вопросов).
+    ?full=1 — как раньше, с content_json; один урок целиком — /api/lessons/<id>/.
+    """
+    if not Module.objects.filter(id=module_id).exists():
         return Response({"detail": "Module not found"}, status=404)
 
-    lessons = module.lesson_set.all().order_by("order")
-    data = [
-        {
-            "id": l.id,
-            "order": l.order,
-            "title": l.title,
-            "content_json": l.content_json,
-        }
-        for l in lessons
-    ]
+    fields = LESSON_LIST_FIELDS + (("content_json",) if request.query_params.get("full") == "1" else ())
+    data = list(Lesson.objects.filter(module_id=module_id).order_by("order").values(*fields))
     return Response(data, status=200)
 
 
+@api_view(["GET"])
+def lesson_detail(request, lesson_id: int):
+    """Один урок с полным content_json."""
+    lesson = get_object_or_404(Lesson, id=lesson_id)
+    return Response({
+        "id": lesson.id,
+        "module_id": lesson.module_id,
+        "order": lesson.order,
+        "title": lesson.title,
+        "reading_time_min": lesson.reading_time_min,
+        "quiz_count": lesson.quiz_count,
+        "content_json": lesson.content_json,
+    }, status=200)
+
+
 @api_view(["POST"])
 def add_lesson(request, module_id: int):
     """Добавить новый урок в модуль"""
-    try:
-        module = Module.objects.get(id=module_id)
-    except Module.DoesNotExist:
+    # модуль и последний order одним запросом
+    module = Module.objects.filter(id=module_id).annotate(last_order=Max("lesson_set__order")).first()
+    if module is None:
         return Response({"detail": "Module not found"}, status=404)
 
     data = request.data or {}
     title = data.get("title") or "Untitled lesson"
     content_json = data.get("content_json") or {}
-    order = int(data.get("order") or (module.lesson_set.count() + 1))
+    order = int(data.get("order") or ((module.last_order or 0) + 1))
 
     lesson = Lesson.objects.create(
         module=module,
@@ -358,17 +366,36 @@ def save_lesson(request):
 
     module = get_object_or_404(Module, id=module_id)
 
-    obj, created = Lesson.objects.update_or_create(
-        module=module,
-        order=lesson_order,
-        defaults={
-            "title": lc.title,
-            "content_json": lc.model_dump(mode="json"),
-        }
-    )
+    obj, created = save_lesson_content(module, lesson_order, lc.model_dump(mode="json"))
     return Response({"lesson_id": obj.id, "created": created}, status=201 if created else 200)
 
 
+@api_view(["POST"])
+def bulk_import_courses(request):
+    """
+    Input: {"courses": [<blueprint>, ...]}; у blueprint может быть
+    "lessons": [{"module_order": 1, "lesson_order": 1, "lesson": {...}}].
+    Невалидные курсы пропускаются, ошибки — в "errors" по индексу.
+    """
+    items = (request.data or {}).get("courses")
+    if not isinstance(items, list):
+        return Response({"detail": "courses must be a list"}, status=400)
+    summary = import_courses(items, owner=request.user if request.user.is_authenticated else None)
+    return Response(summary, status=201 if summary["courses"] else 400)
+
+
+@api_view(["POST"])
+def bulk_save_lessons(request):
+    """
+    Input: {"lessons": [{"module_id": 1, "lesson_order": 1, "lesson": {...}}, ...]}
+    Как /api/lessons/save для каждого элемента, но одним запросом к БД; всё или ничего.
+    """
+    items = (request.data or {}).get("lessons")
+    if not isinstance(items, list):
+        return Response({"detail": "lessons must be a list"}, status=400)
+    result = save_lessons_bulk(items)
+    return Response(result, status=400 if result["errors"] else 200)
+
 
 
 
@@ -383,7 +410,6 @@ def save_lesson(request):
 
 
 
-RAG_INDEX_PATH = Path("rag_index.pkl")
 
 @api_view(["POST"])
 def rag_search(request):
@@ -396,195 +422,252 @@ def rag_search(request):
     if not q:
         return Response({"detail": "query is required"}, status=400)
 
-    idx = BM25Index()
-    if not RAG_INDEX_PATH.exists():
+    try:
+        idx = RAG_INDEX.get()
+    except IndexFormatError as e:
+        return Response({"detail": f"RAG index is unreadable: {e}"}, status=400)
+    if idx is None:
         return Response({"detail": "RAG index not found. Run ingest_rag first."}, status=400)
-    idx.load(RAG_INDEX_PATH)
 
-    results = idx.search(q, top_k=top_k)
+    results = search_index(idx, q, top_k=top_k)
     out = [{"passage": p, "score": s} for p, s in results]
     return Response({"results": out}, status=200)
 
 
+# сколько запросов принимает /api/rag/search/batch/ за раз
+RAG_BATCH_MAX_QUERIES = 500
 
 
+@api_view(["POST"])
+def rag_search_batch(request):
+    """
+    Input: {"queries": ["python loops", "functions"], "top_k": 5}
+    Output: {"results": [[{"passage", "score"}, ...], ...]} — по списку на запрос, в том же порядке.
+    Те же результаты, что у /api/rag/search/ по одному, но запросы оцениваются вместе.
+    """
+    payload = request.data or {}
+    queries = payload.get("queries")
+    if not isinstance(queries, list) or not queries:
+        return Response({"detail": "queries must be a non-empty list"}, status=400)
+    if len(queries) > RAG_BATCH_MAX_QUERIES:
+        return Response({"detail": f"at most {RAG_BATCH_MAX_QUERIES} queries per request"}, status=400)
+    queries = [q.strip() if isinstance(q, str) else "" for q in queries]
+    if not all(queries):
+        return Response({"detail": "every query must be a non-empty string"}, status=400)
+    try:
+        top_k = int(payload.get("top_k") or 5)
+    except (TypeError, ValueError):
+        return Response({"detail": "top_k must be an integer"}, status=400)
 
+    try:
+        idx = RAG_INDEX.get()
+    except IndexFormatError as e:
+        return Response({"detail": f"RAG index is unreadable: {e}"}, status=400)
+    if idx is None:
+        return Response({"detail": "RAG index not found. Run ingest_rag first."}, status=400)
 
+    results = search_index_many(idx, queries, top_k=top_k)
+    out = [[{"passage": p, "score": s} for p, s in r] for r in results]
+    return Response({"results": out}, status=200)
 
 
+@api_view(["GET"])
+def llm_cache_status(request):
+    """Счётчики попаданий/промахов кэша ответов модели."""
+    return Response(get_cache().stats(), status=200)
 
 
+@api_view(["GET"])
+def admission_status(request):
+    """Слоты генерации: сколько в работе, сколько ждут, отказы и объединённые запросы."""
+    return Response(get_admission().stats(), status=200)
 
-LESSON_INSTR = """
-You are Course Lesson Writer AI.
-
-Return STRICT JSON ONLY matching this schema:
-{
-  "title": string,
-  "reading_time_min": integer (5..30),
-  "objectives": string[] (2..6 items, action verbs),
-  "theory_md": string,
-  "code_examples": [{"filename": string, "content": string}],
-  "quiz": [{"type":"mcq"|"short"|"code_output","question":string,"options":string[],"answer":string,"explain":string|null}] (3..15),
-  "exercise": {"task":string,"starter_files":[{"filename":string,"content":string}],"tests":[{"filename":string,"content":string}],"rubric":string[]},
-  "further_reading": [{"title":string,"url":string,"license":"MIT"|"BSD"|"Apache-2.0"|"CC-BY"|"Docs"}] (0..8)
-}
-
-HARD RULES:
-- JSON ONLY. No prose. No markdown fences.
-- All URLs in further_reading MUST be absolute http(s) links (e.g., https://docs.python.org/3/). DO NOT use relative links or markdown like [text](#anchor).
-- Code must be runnable and minimal. No nonexistent libs.
-- Respect the student's level and module objectives.
-"""
 
+@api_view(["GET"])
+def rag_status(request):
+    """Состояние RAG-индекса и время его загрузки, кэш результатов поиска, экономия токенов на контексте."""
+    return Response(
+        {"index": RAG_INDEX.stats(), "search_cache": SEARCH_CACHE.stats(), "context": context_stats()}, status=200
+    )
 
 
 
-def build_rag_context(query: str, k: int = 5) -> str:
-    idx = BM25Index()
-    if not RAG_INDEX_PATH.exists():
-        return ""
-    idx.load(RAG_INDEX_PATH)
-    results = idx.search(query, top_k=k)
-    blocks = []
-    for p, s in results:
-        blocks.append(f"[CTX score={s:.2f}]\n{p}")
-    return "\n\n".join(blocks)
 
 
 
 
-def clamp(n: int, lo: int, hi: int) -> int:
-    return max(lo, min(hi, int(n)))
 
 
 
 
-def _is_http_url(s: str) -> bool:
-    return isinstance(s, str) and (s.startswith("http://") or s.startswith("https://"))
+@api_view(["POST"])
+def generate_lesson(request):
+    """
+    Input:
+    {
+      "course_id": 1,
+      "module_order": 1,
+      "lesson_order": 1,
+      "no_cache": false
+    }
+    """
+    body = request.data or {}
+    course_id = int(body.get("course_id") or 0)
+    module_order = int(body.get("module_order") or 1)
+    lesson_order = int(body.get("lesson_order") or 1)
 
+    course = get_object_or_404(Course, id=course_id)
+    module = get_object_or_404(Module, course=course, order=module_order)
+    prompt = lesson_prompt(course, module, lesson_order)
 
+    try:
+        result = run_generation(
+            prompt, lambda raw: finalize_lesson(raw, course.topic), bypass_cache=bool(body.get("no_cache"))
+        )
+        return Response(result, status=200)
+    except Overloaded as e:
+        return _overloaded(e)
+    except Exception as e:
+        return Response({"detail": f"generation_error: {type(e).__name__}: {e}"}, status=500)
 
 
-def _sanitize_further_reading(items, topic: str):
-    allowed = {"MIT", "BSD", "Apache-2.0", "CC-BY", "Docs"}
-    out = []
-    for it in list(items or []):
-        t = (it or {}).get("title") or "Official Docs"
-        u = (it or {}).get("url") or ""
-        lic = (it or {}).get("license") or "Docs"
-        if not _is_http_url(u):
-            # Подставляем безопасный дефолт, чтобы пройти валидацию.
-            # Для Python-тем по умолчанию ведём на оф. доки.
-            u = "https://docs.python.org/3/"
-            lic = "Docs"
-        if lic not in allowed:
-            lic = "Docs"
-        out.append({"title": t, "url": u, "license": lic})
-    if not out:
-        out = [{"title": "Python Official Docs", "url": "https://docs.python.org/3/", "license": "Docs"}]
-    return out[:8]
+@api_view(["POST"])
+@renderer_classes([JSONRenderer, EventStreamRenderer])
+def generate_lesson_stream(request):
+    """Потоковый вариант generate_lesson; формат событий как у generate_blueprint_stream."""
+    body = request.data or {}
+    course_id = int(body.get("course_id") or 0)
+    module_order = int(body.get("module_order") or 1)
+    lesson_order = int(body.get("lesson_order") or 1)
 
+    course = get_object_or_404(Course, id=course_id)
+    module = get_object_or_404(Module, course=course, order=module_order)
+    prompt = lesson_prompt(course, module, lesson_order)
+    return _stream_generation(
+        request, prompt, lambda raw: finalize_lesson(raw, course.topic), bool(body.get("no_cache"))
+    )
 
 
 
 
-def repair_lesson(data: dict, topic: str) -> dict:
-    data = dict(data or {})
-    data.setdefault("title", f"{topic}: Lesson")
-    data["reading_time_min"] = clamp(data.get("reading_time_min", 10), 5, 30)
 
-    objs = list(data.get("objectives") or [])
-    while len(objs) < 2:
-        objs.append(f"Apply {topic} basics in small tasks")
-    data["objectives"] = objs[:6]
 
-    quiz = list(data.get("quiz") or [])
-    while len(quiz) < 3:
-        quiz.append({
-            "type": "mcq",
-            "question": f"Basic concept of {topic}?",
-            "options": ["Option A", "Option B", "Option C"],
-            "answer": "Option A",
-            "explain": "A simple recall question."
-        })
-    data["quiz"] = quiz[:15]
 
-    ex = dict(data.get("exercise") or {})
-    ex.setdefault("task", f"Write a small program related to {topic}.")
-    ex.setdefault("starter_files", [{"filename": "main.py", "content": "# TODO\n"}])
-    ex.setdefault("tests", [{"filename": "test_basic.py", "content": "def test_true():\n    assert True\n"}])
-    ex.setdefault("rubric", ["Correctness", "Style", "Edge cases"])
-    data["exercise"] = ex
+@api_view(["GET"])
+def export_course(request, course_id: int):
+    """
+    ZIP курса. Готовый архив берётся с диска, пока не изменилась content_version;
+    ETag/If-None-Match дают 304 без передачи архива.
+    """
+    course = Course.objects.filter(id=course_id).only("id", "created_at", "content_version").first()
+    if course is None:
+        return Response({"detail": "Course not found"}, status=404)
 
-    data["code_examples"] = list(data.get("code_examples") or [])[:10]
-    data["further_reading"] = _sanitize_further_reading(data.get("further_reading"), topic)
+    etag = quote_etag(course_etag(course))
+    # If-None-Match сравнивается слабо (RFC 9110): W/"x" совпадает с "x"
+    client_etags = [t.removeprefix("W/") for t in parse_etags(request.headers.get("If-None-Match", ""))]
+    if etag in client_etags or "*" in client_etags:
+        resp = HttpResponseNotModified()
+        resp["ETag"] = etag
+        return resp
 
-    return data
+    path = archive_path(course_id, course_etag(course))
+    try:
+        # файл закрывает сам FileResponse, когда ответ отдан
+        resp = FileResponse(open(path, "rb"), content_type="application/zip")  # noqa: SIM115
+    except FileNotFoundError:
+        try:
+            # архив пишется прямо в ответ по урокам и попутно — в кэш
+            resp = StreamingHttpResponse(cached_course_zip(course_id, path), content_type="application/zip")
+        except Course.DoesNotExist:
+            return Response({"detail": "Course not found"}, status=404)
+    resp["ETag"] = etag
+    resp["Cache-Control"] = "private, no-cache"
+    resp["Content-Disposition"] = f'attachment; filename="course_{course_id}.course.zip"'
+    return resp
 
 
 
 
-@api_view(["POST"])
-def generate_lesson(request):
-    """
-    Input:
-    {
-      "course_id": 1,
-      "module_order": 1,
-      "lesson_order": 1
-    }
-    """
-    body = request.data or {}
-    course_id = int(body.get("course_id") or 0)
-    module_order = int(body.get("module_order") or 1)
-    lesson_order = int(body.get("lesson_order") or 1)
 
-    course = get_object_or_404(Course, id=course_id)
-    module = get_object_or_404(Module, course=course, order=module_order)
 
-    # RAG-контекст под тему и модуль
-    q = f"{course.topic} {module.title} {' '.join(module.objectives_json)}"
-    rag_ctx = build_rag_context(q, k=5)
 
-    context = f"""
-Course topic: {course.topic}
-Level: {course.level}
-Module: {module.title}
-Module objectives:
-- """ + "\n- ".join(module.objectives_json)
+# ───────────────────────────────────────────────
+# Фоновые генерации (очередь заданий)
+# ───────────────────────────────────────────────
 
-    if rag_ctx:
-        context += "\n\nRAG CONTEXT (authoritative excerpts, do not contradict):\n" + rag_ctx
+def _job_json(job: GenerationJob) -> dict:
+    return {
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "error": job.error or None,
+        "attempts": job.attempts,
+        "progress": job.progress_json,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "heartbeat_at": job.heartbeat_at.isoformat() if job.heartbeat_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "status_url": f"/api/jobs/{job.id}/",
+        "result_url": f"/api/jobs/{job.id}/result",
+    }
 
-    prompt = f"{LESSON_INSTR}\n\n{context}\n\nReturn JSON for lesson #{lesson_order}."
 
+@api_view(["POST"])
+def submit_blueprint_job(request):
+    """Вход как у /api/generate/blueprint/; сразу возвращает job_id (202)."""
+    data = request.data or {}
     try:
-        raw = call_ollama(prompt)
-        as_json = parse_json_loose(raw)
-        try:
-            lc = LessonContent(**as_json)
-            return Response(lc.model_dump(mode='json'), status=200)
-        except ValidationError:
-            repaired = repair_lesson(as_json, course.topic)
-            lc = LessonContent(**repaired)
-            return Response(lc.model_dump(mode='json'), status=200)
-    except Exception as e:
-        return Response({"detail": f"generation_error: {type(e).__name__}: {e}"}, status=500)
-
+        blueprint_prompt(data)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    job = jobs.submit("blueprint", dict(data))
+    return Response(_job_json(job), status=status.HTTP_202_ACCEPTED)
 
 
+@api_view(["POST"])
+def submit_lesson_job(request):
+    """Вход как у /api/generate/lesson/; сразу возвращает job_id (202)."""
+    body = request.data or {}
+    course = get_object_or_404(Course, id=int(body.get("course_id") or 0))
+    get_object_or_404(Module, course=course, order=int(body.get("module_order") or 1))
+    job = jobs.submit("lesson", dict(body))
+    return Response(_job_json(job), status=status.HTTP_202_ACCEPTED)
 
 
+@api_view(["POST"])
+def generate_course(request, course_id: int):
+    """
+    Сгенерировать все ещё не сохранённые уроки курса (фоновое задание).
+    Input: {"concurrency": 2, "no_cache": false}; прогресс — в /api/jobs/<id>/.
+    """
+    get_object_or_404(Course, id=course_id)
+    body = request.data or {}
+    payload = {"course_id": course_id, "no_cache": bool(body.get("no_cache"))}
+    if body.get("concurrency") is not None:
+        try:
+            concurrency = int(body["concurrency"])
+        except (TypeError, ValueError):
+            return Response({"detail": "concurrency must be an integer"}, status=400)
+        payload["concurrency"] = min(max(concurrency, 1), GENERATION_MAX_CONCURRENCY)
+    job = jobs.submit("course", payload)
+    return Response(_job_json(job), status=status.HTTP_202_ACCEPTED)
 
 
 @api_view(["GET"])
-def export_course(request, course_id: int):
-    try:
-        payload = export_course_zip(course_id)
-    except Course.DoesNotExist:
-        return Response({"detail": "Course not found"}, status=404)
+def job_status(request, job_id):
+    jobs.ensure_runner()
+    job = get_object_or_404(GenerationJob, id=job_id)
+    return Response(_job_json(job), status=200)
 
-    resp = HttpResponse(payload, content_type="application/zip")
-    resp["Content-Disposition"] = f'attachment; filename="course_{course_id}.course.zip"'
-    return resp
\ No newline at end of file
+
+@api_view(["GET"])
+def job_result(request, job_id):
+    """200 + результат, 202 пока выполняется, 500 если генерация упала."""
+    jobs.ensure_runner()
+    job = get_object_or_404(GenerationJob, id=job_id)
+    if job.status == GenerationJob.DONE:
+        return Response(job.result_json, status=200)
+    if job.status == GenerationJob.FAILED:
+        return Response({"detail": job.error}, status=500)
+    return Response(_job_json(job), status=status.HTTP_202_ACCEPTED)
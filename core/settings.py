@@ -78,12 +78,47 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=sqlite (по умолчанию, локально) | postgres (прод)
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite")
+
+if DB_ENGINE == "postgres":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv("DB_NAME", "coursegen"),
+            'USER': os.getenv("DB_USER", "coursegen"),
+            'PASSWORD': os.getenv("DB_PASSWORD", ""),
+            'HOST': os.getenv("DB_HOST", "127.0.0.1"),
+            'PORT': os.getenv("DB_PORT", "5432"),
+            # постоянные соединения: не открывать новое на каждый запрос
+            'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "60")),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.getenv("DB_POOL", "0") == "1":
+        # пул psycopg 3 (Django 5.1+); с ним CONN_MAX_AGE должен быть 0
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv("DB_POOL_MIN", "2")),
+            'max_size': int(os.getenv("DB_POOL_MAX", "10")),
+            'timeout': float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv("DB_NAME", str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': {
+                # ждать блокировку вместо мгновенного "database is locked"
+                'timeout': float(os.getenv("SQLITE_BUSY_TIMEOUT", "20")),
+                # запись берёт блокировку в начале транзакции: без дедлока "читал, потом пишу"
+                'transaction_mode': 'IMMEDIATE',
+                # WAL: читатели не блокируют писателя и наоборот
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -133,3 +168,13 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [],
     "DEFAULT_PERMISSION_CLASSES": [],
 }
+
+# логи приложения (api.*) в консоль; уровень — API_LOG_LEVEL
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "api": {"handlers": ["console"], "level": os.getenv("API_LOG_LEVEL", "INFO")},
+    },
+}
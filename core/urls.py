@@ -1,18 +1,36 @@
 from django.contrib import admin
 from django.urls import path
-from api.views import ping, generate_blueprint, save_blueprint, list_courses, list_lessons, add_lesson, save_lesson, rag_search, generate_lesson, export_course
+from api import async_views
+from api.views import ping, generate_blueprint, generate_blueprint_stream, save_blueprint, list_courses, list_lessons, lesson_detail, add_lesson, save_lesson, bulk_import_courses, bulk_save_lessons, rag_search, rag_search_batch, rag_status, generate_lesson, generate_lesson_stream, llm_cache_status, admission_status, submit_blueprint_job, submit_lesson_job, generate_course, job_status, job_result, export_course
 
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/ping/", ping),
     path("api/generate/blueprint/", generate_blueprint),
+    path("api/generate/blueprint/stream/", generate_blueprint_stream),
     path("api/courses/save_blueprint/", save_blueprint),
     path("api/courses/", list_courses),
+    path("api/courses/import/", bulk_import_courses),
     path("courses/<int:module_id>/lessons/", list_lessons),
     path("courses/<int:module_id>/lessons/add/", add_lesson),
+    path("api/lessons/<int:lesson_id>/", lesson_detail),
     path("api/lessons/save", save_lesson),
+    path("api/lessons/bulk_save", bulk_save_lessons),
     path("api/rag/search/", rag_search),
+    path("api/rag/search/batch/", rag_search_batch),
+    path("api/rag/status/", rag_status),
     path("api/generate/lesson/", generate_lesson),
+    path("api/generate/lesson/stream/", generate_lesson_stream),
+    path("api/generate/cache/", llm_cache_status),
+    path("api/generate/admission/", admission_status),
     path("api/courses/<int:course_id>/export", export_course),
+    path("api/courses/<int:course_id>/generate/", generate_course),
+    path("api/async/generate/blueprint/", async_views.generate_blueprint),
+    path("api/async/generate/lesson/", async_views.generate_lesson),
+    path("api/async/rag/search/", async_views.rag_search),
+    path("api/jobs/blueprint/", submit_blueprint_job),
+    path("api/jobs/lesson/", submit_lesson_job),
+    path("api/jobs/<uuid:job_id>/", job_status),
+    path("api/jobs/<uuid:job_id>/result", job_result),
 ]